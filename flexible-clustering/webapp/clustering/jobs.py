@@ -0,0 +1,169 @@
+"""
+Background jobs for the long-running clustering calls of the web app.
+
+Jobs run on a thread pool, since they update the models held in `clustering_algorithms`
+globals. Submitting a job whose key matches a queued or running job returns that job instead
+of starting a new one.
+"""
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import uuid
+
+from .config import JOB_WORKERS, JOB_HISTORY
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# The state of a job, replaced as a whole by the worker so that readers see a consistent one
+JobStatus = namedtuple("JobStatus", ["status", "result", "error", "started", "finished"])
+
+class Job:
+    """
+    A function call running in the background.
+
+    The worker publishes the job's state as a new `JobStatus`, read by the properties below.
+
+    Attributes:
+        id (str): Job id.
+        key (tuple): Deduplication key.
+        status (str): One of "queued", "running", "done" or "failed".
+        progress (dict): Latest progress reported by the job.
+        result: Return value of the function, once done. It is kept with the job's status,
+            so it should be small, e.g. a reference to where the actual result is kept.
+        error (str): Error message, if it failed.
+    """
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.progress = {}
+        self.created = time.time()
+        self.done = threading.Event()
+        self._status = JobStatus(QUEUED, None, None, None, None)
+
+    @property
+    def status(self):
+        return self._status.status
+
+    @property
+    def result(self):
+        return self._status.result
+
+    @property
+    def error(self):
+        return self._status.error
+
+    @property
+    def started(self):
+        return self._status.started
+
+    @property
+    def finished(self):
+        return self._status.finished
+
+    def _publish(self, **fields):
+        # only called by the worker running the job
+        self._status = self._status._replace(**fields)
+
+    def report(self, **progress):
+        """
+        Updates the job's progress, e.g. `job.report(stage="fetch", items=1000)`.
+
+        Args:
+            **progress: JSON-serializable fields merged into `progress`.
+        """
+
+        self.progress = dict(self.progress, **progress)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: Status of the job, without its result.
+        """
+
+        status = self._status
+        now = time.time()
+        return {
+            "id": self.id,
+            "status": status.status,
+            "progress": self.progress,
+            "error": status.error,
+            "created": self.created,
+            "elapsed": (status.finished or now) - status.started if status.started else 0.0,
+        }
+
+class JobQueue:
+    """
+    Runs jobs on a thread pool and keeps the most recent ones.
+
+    Args:
+        workers (int): Jobs running at the same time. Jobs updating the same global model
+            still run one after the other, on the model's lock.
+        history (int): Finished jobs kept for their status; older ones are forgotten.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._history = history
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs, job=job)` in the background.
+
+        Args:
+            key (tuple): Deduplication key, e.g. (operation, honeypot, from, to, size).
+            fn (callable): Function to run; it receives the `Job` as keyword argument `job`,
+                to report its progress.
+
+        Returns:
+            Job: The new job, or the queued or running job with the same key.
+        """
+
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                return job
+            job = Job(key)
+            self._in_flight[key] = job
+            self._jobs[job.id] = job
+            self._forget_old()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            Job: The job, or None if it is unknown or was forgotten.
+        """
+
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job._publish(status=RUNNING, started=time.time())
+        try:
+            result = fn(*args, job=job, **kwargs)
+            job._publish(status=DONE, result=result, finished=time.time())
+        except Exception as e:
+            logger.exception("Job %s %s failed", job.id, job.key)
+            job._publish(status=FAILED, error=str(e), finished=time.time())
+        finally:
+            with self._lock:
+                self._in_flight.pop(job.key, None)
+            job.done.set()
+
+    def _forget_old(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(len(finished) - self._history, 0)]:
+            del self._jobs[job_id]
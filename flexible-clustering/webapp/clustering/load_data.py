@@ -1,28 +1,157 @@
-import pandas as pd
+"""
+Command and signature resources, loaded once per process on first use.
+
+The CSVs under `databases/` are parsed once and compiled to `RESOURCE_CACHE_DIR`: the
+similarity matrix as a .npy file, memory-mapped when loaded (so forked workers share its
+pages), and the other resources as a pickle. The compiled files are rebuilt whenever the
+modification time or size of a CSV changes.
+"""
+
+from collections import namedtuple
+import os
+import pickle
+import threading
+import uuid
+
+import numpy as np
+
+from .config import RESOURCE_CACHE_DIR
+
+COMMANDS_CSV = "databases/commands_cleaned.csv"
+SIMILARITY_CSV = "databases/UpdatedSimilarity.csv"
+PURPOSES_CSV = "databases/UpdatedCommandDB.csv"
+SIGNATURE_PURPOSES_CSV = "databases/signature_purposes.csv"
+RESOURCE_CSVS = [COMMANDS_CSV, SIMILARITY_CSV, PURPOSES_CSV, SIGNATURE_PURPOSES_CSV]
+
+# Bumped whenever the compiled format or the parsing of the CSVs changes
+COMPILED_VERSION = 1
+
+CommandResources = namedtuple(
+    "CommandResources", ["valid_commands", "similarity_matrix", "purpose_lookup", "suricata_purpose_lookup"]
+)
+
+_resources = None
+_resources_lock = threading.Lock()
+
+def get_resources():
+    """
+    Returns the process-wide resources, loading them on the first call.
+
+    Returns:
+        CommandResources: (valid_commands, similarity_matrix, purpose_lookup,
+        suricata_purpose_lookup).
+    """
+
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                _resources = _load(RESOURCE_CACHE_DIR)
+    return _resources
 
 def load_command_resources():
-    commands_df = pd.read_csv("databases/commands_cleaned.csv")
+    """
+    Returns the resources as a tuple, see `get_resources`.
+
+    Returns:
+        tuple: (valid_commands, similarity_matrix, purpose_lookup, suricata_purpose_lookup).
+    """
+
+    return get_resources()
+
+def parse_command_resources():
+    """
+    Parses the resource CSVs.
+
+    Returns:
+        CommandResources: The parsed resources.
+    """
+
+    import pandas as pd
+
+    commands_df = pd.read_csv(COMMANDS_CSV)
     valid_commands = set(commands_df["Command"].str.strip().unique())
 
-    similarity_matrix = pd.read_csv("databases/UpdatedSimilarity.csv", index_col=0)
-
-    purpose_df = pd.read_csv("databases/UpdatedCommandDB.csv")
-    purpose_lookup = dict(
-        zip(
-            purpose_df["label"].str.strip(),
-            purpose_df.apply(
-                lambda row: f"{row['simplified_purpose'].strip()} ({row['flag_description'].strip()})"
-                if pd.notna(row["flag_description"])
-                else row["simplified_purpose"].strip(),
-                axis=1
-            )
-        )
-    )
+    similarity_matrix = pd.read_csv(SIMILARITY_CSV, index_col=0)
+
+    purpose_df = pd.read_csv(PURPOSES_CSV)
+    purposes = purpose_df["simplified_purpose"].str.strip()
+    described = purpose_df["flag_description"].notna()
+    purposes[described] = purposes[described] + " (" + purpose_df.loc[described, "flag_description"].str.strip() + ")"
+    purpose_lookup = dict(zip(purpose_df["label"].str.strip(), purposes))
 
     try:
-        sig_df = pd.read_csv("databases/signature_purposes.csv")
+        sig_df = pd.read_csv(SIGNATURE_PURPOSES_CSV)
         suricata_purpose_lookup = dict(zip(sig_df["signature"], sig_df["purpose"]))
     except Exception:
         suricata_purpose_lookup = {}
 
-    return valid_commands, similarity_matrix, purpose_lookup, suricata_purpose_lookup
+    return CommandResources(valid_commands, similarity_matrix, purpose_lookup, suricata_purpose_lookup)
+
+def _csv_stamps():
+    stamps = {}
+    for path in RESOURCE_CSVS:
+        try:
+            st = os.stat(path)
+            stamps[path] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamps[path] = None
+    return stamps
+
+def _load(cache_dir):
+    import pandas as pd
+
+    if not cache_dir:
+        return parse_command_resources()
+
+    stamps = _csv_stamps()
+    index_path = os.path.join(cache_dir, "resources.pickle")
+    try:
+        with open(index_path, "rb") as f:
+            compiled = pickle.load(f)
+        if compiled["version"] == COMPILED_VERSION and compiled["stamps"] == stamps:
+            values = np.load(os.path.join(cache_dir, compiled["similarity_file"]), mmap_mode="r")
+            similarity_matrix = pd.DataFrame(
+                values, index=compiled["similarity_index"], columns=compiled["similarity_columns"], copy=False
+            )
+            return CommandResources(
+                compiled["valid_commands"], similarity_matrix, compiled["purpose_lookup"],
+                compiled["suricata_purpose_lookup"],
+            )
+    except (OSError, EOFError, KeyError, ValueError, pickle.UnpicklingError):
+        pass
+
+    resources = parse_command_resources()
+    try:
+        _compile(cache_dir, resources, stamps)
+    except OSError:
+        pass  # e.g. a read-only checkout: the CSVs are parsed again next time
+    return resources
+
+def _compile(cache_dir, resources, stamps):
+    os.makedirs(cache_dir, exist_ok=True)
+    matrix = resources.similarity_matrix
+    similarity_file = f"similarity-{uuid.uuid4().hex[:8]}.npy"
+    np.save(os.path.join(cache_dir, similarity_file), matrix.to_numpy(dtype=float))
+    compiled = {
+        "version": COMPILED_VERSION,
+        "stamps": stamps,
+        "similarity_file": similarity_file,
+        "similarity_index": matrix.index.tolist(),
+        "similarity_columns": matrix.columns.tolist(),
+        "valid_commands": resources.valid_commands,
+        "purpose_lookup": resources.purpose_lookup,
+        "suricata_purpose_lookup": resources.suricata_purpose_lookup,
+    }
+    tmp_path = os.path.join(cache_dir, f".resources-{uuid.uuid4().hex}.pickle")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, os.path.join(cache_dir, "resources.pickle"))
+
+    # matrices of previous compilations; processes that mapped them keep their pages
+    for name in os.listdir(cache_dir):
+        if name.startswith("similarity-") and name != similarity_file:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
@@ -0,0 +1,161 @@
+"""
+Pagination and NDJSON streaming of cluster results.
+
+Cluster results are sorted by id (see `build_cluster_results`), so a page starts after the
+id of the last cluster of the previous page. Cluster ids are renumbered by every clustering,
+so a cursor also holds the model version it was read from, and is only valid for that
+version (see `make_cursor`).
+"""
+
+from bisect import bisect_right
+import json
+import zlib
+
+# Records of a NDJSON stream sent to the client at once, and gzip compression level
+STREAM_BATCH = 200
+GZIP_LEVEL = 6
+
+def cluster_filter(min_size=None, purpose=None):
+    """
+    Returns a predicate selecting clusters by size and purpose.
+
+    Args:
+        min_size (int, optional): Minimum cluster size.
+        purpose (str, optional): Case-insensitive substring of the cluster purpose.
+
+    Returns:
+        callable: `keep(cluster)`, or None if nothing is filtered.
+    """
+
+    if min_size is None and not purpose:
+        return None
+    purpose = purpose.lower() if purpose else None
+
+    def keep(cluster):
+        if min_size is not None and cluster["size"] < min_size:
+            return False
+        return purpose is None or purpose in cluster["purpose"].lower()
+    return keep
+
+def make_cursor(version, cluster_id):
+    """
+    Returns the cursor of the page following `cluster_id` in model version `version`.
+
+    Args:
+        version (int): Model version of the page.
+        cluster_id (int): Id of the last cluster of the page.
+
+    Returns:
+        str: Opaque cursor, "<version>:<cluster_id>".
+    """
+
+    return f"{version}:{cluster_id}"
+
+def parse_cursor(cursor):
+    """
+    Parses a cursor built by `make_cursor`.
+
+    Args:
+        cursor (str): Cursor from a previous page.
+
+    Returns:
+        tuple: (version, cluster_id).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+
+    version, sep, cluster_id = cursor.partition(":")
+    if not sep:
+        raise ValueError(f"Malformed cursor: {cursor}")
+    return int(version), int(cluster_id)
+
+def page_clusters(clusters, cursor=None, page_size=500, keep=None):
+    """
+    Returns one page of clusters.
+
+    Args:
+        clusters (list): Cluster results, sorted by id.
+        cursor (int, optional): Id of the last cluster of the previous page; None for the
+            first page. Ids are only comparable within the same model version.
+        page_size (int): Maximum number of clusters in the page.
+        keep (callable, optional): Filter, see `cluster_filter`.
+
+    Returns:
+        tuple: (page, last_id), where `last_id` is the id of the last cluster of the page,
+        or None on the last page.
+    """
+
+    start = 0
+    if cursor is not None:
+        start = bisect_right(clusters, cursor, key=lambda c: c["id"])
+
+    page = []
+    for i in range(start, len(clusters)):
+        cluster = clusters[i]
+        if keep is not None and not keep(cluster):
+            continue
+        if len(page) == page_size:
+            return page, page[-1]["id"]
+        page.append(cluster)
+    return page, None
+
+def ndjson_records(clusters, full_clusters, tree, keep=None):
+    """
+    Yields the records of a NDJSON cluster stream, one JSON object per line.
+
+    Each record has a `type` and its `data`: first the "cluster" records, then the
+    "full_tree_cluster" records used for the minimap, then the "edge" records ([parent,
+    child]) of the tree. Only the "cluster" records are filtered, so that the tree stays
+    complete.
+
+    Args:
+        clusters (list): Cluster results for the dashboard.
+        full_clusters (list): Cluster results with all the alerts.
+        tree (list): Condensed cluster tree.
+        keep (callable, optional): Filter, see `cluster_filter`.
+
+    Yields:
+        str: Lines, newline included.
+    """
+
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    for cluster in clusters:
+        if keep is None or keep(cluster):
+            yield dumps({"type": "cluster", "data": cluster}) + "\n"
+    for cluster in full_clusters:
+        yield dumps({"type": "full_tree_cluster", "data": cluster}) + "\n"
+    for parent, child, *_ in tree:
+        yield dumps({"type": "edge", "data": [str(parent), str(child)]}) + "\n"
+
+def encode_stream(lines, gzip=False, batch=STREAM_BATCH, level=GZIP_LEVEL):
+    """
+    Encodes lines to bytes in batches, optionally as a gzip stream.
+
+    Each batch is flushed, so the client can decode it as soon as it arrives.
+
+    Args:
+        lines (iterable): Lines of text.
+        gzip (bool): Compress with gzip.
+        batch (int): Lines per chunk.
+        level (int): Compression level.
+
+    Yields:
+        bytes: Chunks of the response body.
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzip else None
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == batch:
+            data = "".join(chunk).encode("utf-8")
+            chunk = []
+            if gzip:
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield data
+    data = "".join(chunk).encode("utf-8")
+    if gzip:
+        yield compressor.compress(data) + compressor.flush()
+    elif data:
+        yield data
@@ -1,12 +1,26 @@
 import re
-from collections import Counter
-from .load_data import load_command_resources
-
-valid_commands, similarity_matrix, purpose_lookup, _ = load_command_resources()
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from .load_data import get_resources
 
 OPERATOR_PATTERN = r'(\|\||&&|\||;|>|>>)'
 OPERATORS = {'|', '||', '&&', ';', '>', '>>'}
 
+OPERATOR_RE = re.compile(OPERATOR_PATTERN)
+SECURE_URL_RE = re.compile(r'^https://', re.IGNORECASE)
+URL_RE = re.compile(r'^http://', re.IGNORECASE)
+IP_RE = re.compile(r'^\b\d{1,3}(?:\.\d{1,3}){3}\b$')
+HEX_RE = re.compile(r'\\x[0-9a-fA-F]{2}')
+
+# Maximum number of raw command lines whose abstraction is memoized by `abstract_command`
+ABSTRACTION_CACHE_SIZE = 1 << 18
+
+def __getattr__(name):
+    # resources used to be loaded at import time as module attributes
+    if name in ("valid_commands", "similarity_matrix", "purpose_lookup"):
+        return getattr(get_resources(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def classify_argument(arg):
     """
     Classifies a command-line argument into semantic types (e.g., COMMAND, FILE, FLAG, IP, etc.).
@@ -18,27 +32,43 @@ def classify_argument(arg):
         dict: A dictionary with keys 'type' and 'value', where 'type' is the semantic category.
     """
 
-    if arg in valid_commands or arg in ('busybox', 'which'):
-        return {'type': arg, 'value': arg}
+    return {'type': argument_type(arg), 'value': arg}
+
+@lru_cache(maxsize=ABSTRACTION_CACHE_SIZE)
+def argument_type(arg):
+    """
+    Semantic type of a command-line argument, as in `classify_argument`.
+
+    Tokens repeat a lot across command lines, so types are memoized.
+
+    Args:
+        arg (str): A single token/argument from a command line.
+
+    Returns:
+        str: The semantic category of the argument.
+    """
+
+    if arg in get_resources().valid_commands or arg in ('busybox', 'which'):
+        return arg
     if arg.startswith("./"):
-        return {'type': 'FILE_SCRIPT' if arg.endswith('.sh') else 'FILE_EXECUTION', 'value': arg}
+        return 'FILE_SCRIPT' if arg.endswith('.sh') else 'FILE_EXECUTION'
     if arg in OPERATORS:
-        return {'type': 'OPERATOR', 'value': arg}
-    if re.match(r'^https://', arg, re.IGNORECASE):
-        return {'type': 'SECURE_URL', 'value': arg}
-    if re.match(r'^http://', arg, re.IGNORECASE):
-        return {'type': 'URL', 'value': arg}
-    if re.match(r'^\b\d{1,3}(?:\.\d{1,3}){3}\b$', arg):
-        return {'type': 'IP', 'value': arg}
-    if re.match(r'\\x[0-9a-fA-F]{2}', arg):
-        return {'type': 'HEX', 'value': arg}
+        return 'OPERATOR'
+    if SECURE_URL_RE.match(arg):
+        return 'SECURE_URL'
+    if URL_RE.match(arg):
+        return 'URL'
+    if IP_RE.match(arg):
+        return 'IP'
+    if HEX_RE.match(arg):
+        return 'HEX'
     if arg.startswith('/'):
-        return {'type': 'FILE_SCRIPT' if arg.endswith('.sh') else 'FILE' if '.' in arg.split('/')[-1] else 'PATH', 'value': arg}
+        return 'FILE_SCRIPT' if arg.endswith('.sh') else 'FILE' if '.' in arg.split('/')[-1] else 'PATH'
     if arg.startswith('-'):
-        return {'type': arg, 'value': arg}
+        return arg
     if '.' in arg:
-        return {'type': 'FILE', 'value': arg}
-    return {'type': 'STRING', 'value': arg}
+        return 'FILE'
+    return 'STRING'
 
 def abstract_command_line_substitution(cmd_line):
     """
@@ -55,9 +85,26 @@ def abstract_command_line_substitution(cmd_line):
         str: Abstracted command line string, e.g., "COMMAND FILE FLAG".
     """
 
-    parts = re.split(OPERATOR_PATTERN, cmd_line)
+    return abstract_command(cmd_line)[0]
+
+@lru_cache(maxsize=ABSTRACTION_CACHE_SIZE)
+def abstract_command(cmd_line):
+    """
+    Abstracts a raw shell command line and tells whether it is a real command, in a single pass.
+
+    Equivalent to `(abstract_command_line_substitution(cmd_line), is_real_command(cmd_line))`;
+    results are memoized by raw command line.
+
+    Args:
+        cmd_line (str): Raw shell command line.
+
+    Returns:
+        tuple: (abstract, is_real) where abstract is the abstracted command line string and
+        is_real is True if the command is operationally relevant.
+    """
+
     new_parts = []
-    for part in parts:
+    for part in OPERATOR_RE.split(cmd_line):
         part = part.strip()
         if not part:
             continue
@@ -65,13 +112,39 @@ def abstract_command_line_substitution(cmd_line):
             new_parts.append(part)
         else:
             tokens = part.split()
-            if tokens and tokens[0] == "echo":
+            if tokens[0] == "echo":
                 payload = " ".join(tokens[1:]).strip('"\'')
                 new_parts.append("echo STRING({})".format(len(payload)))
             else:
-                types = [classify_argument(t)['type'] for t in tokens]
-                new_parts.append(" ".join(types))
-    return " ".join(new_parts)
+                new_parts.append(" ".join([argument_type(t) for t in tokens]))
+    abstract = " ".join(new_parts)
+    is_real = bool(new_parts) and not (abstract.startswith("STRING(") and " " not in abstract)
+    return abstract, is_real
+
+def abstract_many(commands, processes=None, chunksize=10000):
+    """
+    Batch version of `abstract_command`.
+
+    Each distinct command line is abstracted once. With `processes` > 1 the distinct command
+    lines are split across a process pool, which pays off for multi-million-row imports.
+
+    Args:
+        commands (iterable): Raw command-line strings.
+        processes (int, optional): Number of worker processes. If None or 1, runs in-process.
+        chunksize (int): Number of command lines sent to a worker at a time.
+
+    Returns:
+        list: One (abstract, is_real) tuple per command, in order.
+    """
+
+    commands = list(commands)
+    unique = list(dict.fromkeys(commands))
+    if processes is None or processes <= 1 or len(unique) <= chunksize:
+        results = dict(zip(unique, map(abstract_command, unique)))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = dict(zip(unique, executor.map(abstract_command, unique, chunksize=chunksize)))
+    return [results[cmd] for cmd in commands]
 
 def group_commands_and_flags(abstract_cmd):
     """
@@ -89,7 +162,7 @@ def group_commands_and_flags(abstract_cmd):
     tokens = abstract_cmd.strip().split()
     grouped = []
     for i, token in enumerate(tokens):
-        if classify_argument(token)['type'] == 'OPERATOR':
+        if argument_type(token) == 'OPERATOR':
             continue
         if token.startswith('-') and i > 0:
             grouped[-1] = f"{grouped[-1]} {token}"
@@ -108,7 +181,7 @@ def split_by_operators(cmd):
         list: List of command segments and operators in original order.
     """
 
-    return re.split(r'(\|\||&&|\||;|>|>>)', cmd)
+    return OPERATOR_RE.split(cmd)
 
 def is_pure_string(cmd):
     """
@@ -121,7 +194,7 @@ def is_pure_string(cmd):
         bool: True if the command is a single string abstraction, False otherwise.
     """
 
-    abs_cmd = abstract_command_line_substitution(cmd).strip()
+    abs_cmd = abstract_command(cmd)[0]
     return abs_cmd.startswith("STRING(") and " " not in abs_cmd
 
 def is_real_command(cmd):
@@ -137,10 +210,9 @@ def is_real_command(cmd):
         bool: True if the command is operationally relevant, False if it's just a string.
     """
 
-    if not cmd or not cmd.strip():
+    if not cmd:
         return False
-    abs_cmd = abstract_command_line_substitution(cmd).strip()
-    return not (abs_cmd.startswith("STRING(") and " " not in abs_cmd)
+    return abstract_command(cmd)[1]
 
 def classify_purpose_from_lookup(commands):
     """
@@ -155,46 +227,57 @@ def classify_purpose_from_lookup(commands):
         str: A string summarizing one or more inferred purposes (e.g., "Reconnaissance + Execution").
     """
 
-    purpose_counts = Counter()
-
+    purposes = set()
     for cmd in commands:
-        if not cmd or not cmd.strip():
-            continue
-        
-        if cmd.strip().startswith(">"):
-            purpose_counts["Write Inside File"] += 1
-            continue
+        purposes.update(command_purposes(cmd))
+    purposes.discard("Unknown")
+    return " + ".join(sorted(purposes)) if purposes else "Unknown"
 
-        sub_cmds = re.split(OPERATOR_PATTERN, cmd)
-
-        for sub in sub_cmds:
-            sub = sub.strip()
-            if not sub or sub in OPERATORS:
-                continue
-
-            tokens = sub.split()
-            if not tokens:
-                continue
-
-            full_key = " ".join(tokens)
-            base_key = tokens[0]
-
-            if full_key in purpose_lookup:
-                purpose = purpose_lookup[full_key]
-            elif base_key in purpose_lookup:
-                purpose = purpose_lookup[base_key]
-            elif base_key.startswith("./"):
-                purpose = "File Execution"
-            elif base_key.startswith(">"):
-                purpose = "Write Inside File"
-            elif base_key.startswith("/"):
-                purpose = "File Execution"
-            else:
-                purpose = "Unknown"
+@lru_cache(maxsize=ABSTRACTION_CACHE_SIZE)
+def command_purposes(cmd):
+    """
+    Purposes of the sub-commands of a single command line, as used by `classify_purpose_from_lookup`.
 
+    Args:
+        cmd (str): Raw command-line string.
+
+    Returns:
+        frozenset: Purposes found, possibly including "Unknown".
+    """
+
+    if not cmd or not cmd.strip():
+        return frozenset()
 
-            purpose_counts[purpose] += 1
+    if cmd.strip().startswith(">"):
+        return frozenset(["Write Inside File"])
+
+    purpose_lookup = get_resources().purpose_lookup
+    purposes = set()
+    for sub in OPERATOR_RE.split(cmd):
+        sub = sub.strip()
+        if not sub or sub in OPERATORS:
+            continue
+
+        tokens = sub.split()
+        if not tokens:
+            continue
+
+        full_key = " ".join(tokens)
+        base_key = tokens[0]
+
+        if full_key in purpose_lookup:
+            purpose = purpose_lookup[full_key]
+        elif base_key in purpose_lookup:
+            purpose = purpose_lookup[base_key]
+        elif base_key.startswith("./"):
+            purpose = "File Execution"
+        elif base_key.startswith(">"):
+            purpose = "Write Inside File"
+        elif base_key.startswith("/"):
+            purpose = "File Execution"
+        else:
+            purpose = "Unknown"
 
-    purposes = [p for p in purpose_counts if p != "Unknown"]
-    return " + ".join(sorted(set(purposes))) if purposes else "Unknown"
+        purposes.add(purpose)
 
+    return frozenset(purposes)
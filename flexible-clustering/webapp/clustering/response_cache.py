@@ -0,0 +1,63 @@
+"""
+Cache of serialized responses, keyed by the version of the model they were built from.
+
+Entries never go stale: a new model state has a new version, so its responses get new keys,
+and the old entries are evicted as the least recently used.
+"""
+
+from collections import OrderedDict
+import hashlib
+import threading
+
+from .config import RESPONSE_CACHE_SIZE
+
+class ResponseCache:
+    """
+    Bounded LRU cache of response bodies and their ETags.
+
+    Args:
+        maxsize (int): Responses kept; 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """
+        Returns the cached response for `key`, building it with `build()` on a miss.
+
+        Args:
+            key (tuple): Hashable key, starting with the model version, e.g.
+                (version, honeypot, limit).
+            build (callable): Returns the response body as bytes.
+
+        Returns:
+            tuple: (body, etag), where `etag` is a hash of the body.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # built outside the lock, so a slow build doesn't hold up other keys
+        body = build()
+        entry = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
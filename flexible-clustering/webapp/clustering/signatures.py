@@ -0,0 +1,443 @@
+from collections import Counter
+from functools import lru_cache
+from hashlib import blake2b
+import numpy as np
+
+__all__ = [
+    "shingles", "jaccard_distance", "MinHash", "LSHIndex", "SignatureDistance", "ShingleMatrix",
+    "SparseJaccardDistance",
+]
+
+# Length of the character shingles compared by `jaccard_distance`
+SHINGLE_SIZE = 3
+
+# Number of MinHash permutations, and LSH bands they are split into
+NUM_PERM = 128
+LSH_BANDS = 32
+
+# Estimated distances below this are recomputed exactly; None keeps the estimates
+EXACT_THRESHOLD = 0.5
+
+# Maximum number of LSH candidates returned for an element
+MAX_CANDIDATES = 16
+
+SHINGLE_CACHE_SIZE = 1 << 16
+
+# Smaller batches are intersected by ShingleMatrix.count_columns rather than by scipy, whose
+# per-call overhead dominates on the few rows FISHDBC usually compares at once
+SPARSE_MIN_BATCH = 256
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Sketch value of the empty set: no hash of a shingle can be equal to it
+_EMPTY = np.uint64(1 << 62)
+
+@lru_cache(maxsize=SHINGLE_CACHE_SIZE)
+def shingles(text, k=SHINGLE_SIZE):
+    """
+    Set of the substrings of length `k` of a text.
+
+    Args:
+        text (str): Text, e.g. a Suricata alert signature.
+        k (int): Shingle length.
+
+    Returns:
+        frozenset: Shingles of `text`; empty if `text` is shorter than `k`.
+    """
+
+    return frozenset(text[i:i + k] for i in range(len(text) - k + 1))
+
+def jaccard_distance(a, b, k=SHINGLE_SIZE):
+    """
+    Jaccard distance between the shingle sets of two texts.
+
+    Args:
+        a (str): First text.
+        b (str): Second text.
+        k (int): Shingle length.
+
+    Returns:
+        float: Distance in [0.0, 1.0]; 0.0 if both texts have no shingles.
+    """
+
+    return _set_distance(shingles(a, k), shingles(b, k))
+
+def _set_distance(A, B):
+    if not A and not B:
+        return 0.0
+    common = len(A & B)
+    return 1 - common / (len(A) + len(B) - common)
+
+@lru_cache(maxsize=SHINGLE_CACHE_SIZE)
+def _shingle_hash(shingle):
+    return int.from_bytes(blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+
+class MinHash:
+    """
+    MinHash sketches of sets of shingles.
+
+    The fraction of equal positions between the sketches of two sets estimates their Jaccard
+    similarity, with a standard error of about `1 / sqrt(num_perm)`. Shingles are hashed
+    with blake2b, so sketches don't depend on the interpreter's hash seed.
+
+    Args:
+        num_perm (int): Number of hash permutations, i.e. the sketch length.
+        seed (int): Seed of the permutations; only sketches with the same seed are comparable.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def sketch(self, shingle_set):
+        """
+        Sketch of a set of shingles.
+
+        Args:
+            shingle_set (iterable): Shingles, e.g. from `shingles`.
+
+        Returns:
+            np.ndarray: `num_perm` uint64 values.
+        """
+
+        if not shingle_set:
+            return np.full(self.num_perm, _EMPTY, dtype=np.uint64)
+        hashes = np.fromiter((_shingle_hash(s) for s in shingle_set), dtype=np.uint64,
+                             count=len(shingle_set))
+        # products overflow on purpose: they are hashes, not numbers
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+class LSHIndex:
+    """
+    Banded locality-sensitive hashing index of MinHash sketches.
+
+    Sketches are split into `bands` bands of `rows` values, and elements whose sketches are
+    equal on at least one band are candidates to be similar: with Jaccard similarity s, two
+    elements collide with probability `1 - (1 - s**rows)**bands`.
+
+    Args:
+        bands (int): Number of bands.
+        rows (int): Sketch values per band.
+    """
+
+    def __init__(self, bands, rows):
+        self.bands = bands
+        self.rows = rows
+        self._buckets = [{} for _ in range(bands)]
+
+    def _keys(self, sketch):
+        rows = self.rows
+        return [sketch[band * rows:(band + 1) * rows].tobytes() for band in range(self.bands)]
+
+    def insert(self, key, sketch):
+        """
+        Adds an element to the index.
+
+        Args:
+            key (hashable): Element, e.g. its index.
+            sketch (np.ndarray): MinHash sketch of the element.
+        """
+
+        for buckets, band_key in zip(self._buckets, self._keys(sketch)):
+            buckets.setdefault(band_key, []).append(key)
+
+    def candidates(self, sketch, limit=MAX_CANDIDATES):
+        """
+        Elements sharing at least one band with a sketch.
+
+        Args:
+            sketch (np.ndarray): MinHash sketch to look up.
+            limit (int): Maximum number of elements returned.
+
+        Returns:
+            list: Up to `limit` elements, those sharing more bands first. Among the members
+            of each bucket, only the `limit` most recently inserted are considered.
+        """
+
+        counts = Counter()
+        for buckets, band_key in zip(self._buckets, self._keys(sketch)):
+            counts.update(buckets.get(band_key, ())[-limit:])
+        return [key for key, _ in counts.most_common(limit)]
+
+class SignatureDistance:
+    """
+    One-vs-many Jaccard distance between signature shingles for `FISHDBC(..., vectorized=True)`.
+
+    As with `similarity.CommandDistance`, the instance must be bound to the model's data list,
+    since FISHDBC calls it as `d(signature, js)` with `js` indices into its data:
+
+        distance = SignatureDistance()
+        model = FISHDBC(distance, vectorized=True, entry_points=distance.entry_points)
+        distance.data = model.data
+
+    Each element is shingled and sketched once. Distances are estimated by comparing sketches,
+    and the ones below `exact_threshold` are recomputed exactly from the shingle sets, so that
+    close pairs, which decide the clusters, get exact distances. `entry_points` returns the
+    elements found by an `LSHIndex` of the sketches.
+
+    Args:
+        data (list, optional): Signatures, indexed by FISHDBC.
+        k (int): Shingle length.
+        num_perm (int): Sketch length.
+        bands (int): LSH bands; `num_perm` must be a multiple of it.
+        exact_threshold (float, optional): Estimated distances below it are recomputed
+            exactly. None uses the estimates only.
+        max_candidates (int): Maximum number of entry points returned by `entry_points`.
+    """
+
+    def __init__(self, data=None, k=SHINGLE_SIZE, num_perm=NUM_PERM, bands=LSH_BANDS,
+                 exact_threshold=EXACT_THRESHOLD, max_candidates=MAX_CANDIDATES):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.data = data
+        self.k = k
+        self.exact_threshold = exact_threshold
+        self.max_candidates = max_candidates
+        self.minhash = MinHash(num_perm)
+        self.lsh = LSHIndex(bands, num_perm // bands)
+        self._shingles = []
+        self._sketches = np.empty((0, num_perm), dtype=np.uint64)
+        self._last = (None, None, None)
+
+    def _index(self, n):
+        # shingles, sketches and indexes the elements up to data[n - 1]
+        start = len(self._shingles)
+        if n <= start:
+            return
+        if n > len(self._sketches):
+            sketches = np.empty((max(n, 2 * len(self._sketches)), self.minhash.num_perm), dtype=np.uint64)
+            sketches[:start] = self._sketches[:start]
+            self._sketches = sketches
+        for j in range(start, n):
+            shingle_set = shingles(self.data[j], self.k)
+            self._shingles.append(shingle_set)
+            self._sketches[j] = self.minhash.sketch(shingle_set)
+            self.lsh.insert(j, self._sketches[j])
+
+    def entry_points(self, i):
+        """
+        Elements likely to be close to `self.data[i]`, according to the LSH index.
+
+        Args:
+            i (int): Element index.
+
+        Returns:
+            list: Indices of up to `max_candidates` other elements.
+        """
+
+        self._index(i + 1)
+        candidates = self.lsh.candidates(self._sketches[i], self.max_candidates + 1)
+        return [j for j in candidates if j != i][:self.max_candidates]
+
+    def __call__(self, signature, js):
+        if len(js) == 0:
+            return []
+        n = max(js) + 1
+        if n > len(self._shingles):
+            self._index(n)
+
+        last_signature, shingle_set, sketch = self._last
+        if signature is not last_signature:
+            shingle_set = shingles(signature, self.k)
+            sketch = self.minhash.sketch(shingle_set)
+            self._last = (signature, shingle_set, sketch)
+
+        equal = np.count_nonzero(self._sketches[js] == sketch, axis=1)
+        distances = (1.0 - equal / self.minhash.num_perm).tolist()
+        threshold = self.exact_threshold
+        if threshold is not None:
+            own = self._shingles
+            for pos, dist in enumerate(distances):
+                if dist < threshold:
+                    distances[pos] = _set_distance(shingle_set, own[js[pos]])
+        return distances
+
+class ShingleMatrix:
+    """
+    Binary matrix of shingles, one row per text, stored in CSR format.
+
+    Columns are shingles, numbered as they are first seen. Rows are appended to growing
+    arrays, so adding a text doesn't copy the matrix; `matrix` wraps them in a
+    `scipy.sparse.csr_matrix` without copying.
+
+    Args:
+        k (int): Shingle length.
+    """
+
+    def __init__(self, k=SHINGLE_SIZE):
+        self.k = k
+        self.vocabulary = {}
+        self._indptr = np.zeros(1024, dtype=np.int64)
+        self._indices = np.empty(1024, dtype=np.int32)
+        self._ones = np.ones(1024)
+        self._sizes = np.empty(1024)
+        self._nrows = 0
+
+    def __len__(self):
+        return self._nrows
+
+    def columns(self, text, add=False):
+        """
+        Column ids of the shingles of a text.
+
+        Args:
+            text (str): Text to shingle.
+            add (bool): If True, unknown shingles get new columns; otherwise they are skipped.
+
+        Returns:
+            tuple: (ids, size) where ids is a sorted array of column ids and size is the number
+            of distinct shingles of `text`, including unknown ones.
+        """
+
+        shingle_set = shingles(text, self.k)
+        vocabulary = self.vocabulary
+        if add:
+            ids = [vocabulary.setdefault(s, len(vocabulary)) for s in shingle_set]
+        else:
+            ids = [vocabulary[s] for s in shingle_set if s in vocabulary]
+        ids.sort()
+        return np.array(ids, dtype=np.int32), len(shingle_set)
+
+    def append(self, text):
+        """
+        Adds a row for a text.
+
+        Args:
+            text (str): Text to shingle.
+        """
+
+        ids, size = self.columns(text, add=True)
+        n = self._nrows
+        start = int(self._indptr[n])
+        end = start + len(ids)
+        if n + 2 > len(self._indptr):
+            self._indptr = np.resize(self._indptr, 2 * len(self._indptr))
+            self._sizes = np.resize(self._sizes, 2 * len(self._sizes))
+        if end > len(self._indices):
+            capacity = max(end, 2 * len(self._indices))
+            self._indices = np.resize(self._indices, capacity)
+            self._ones = np.ones(capacity)
+        self._indices[start:end] = ids
+        self._indptr[n + 1] = end
+        self._sizes[n] = size
+        self._nrows = n + 1
+
+    def count_columns(self, rows, mask):
+        """
+        Number of the columns of each row where `mask` is True, e.g. the size of each
+        intersection with a text whose columns are set in `mask`.
+
+        Args:
+            rows (np.ndarray): Row indices.
+            mask (np.ndarray): Booleans, at least one per column.
+
+        Returns:
+            np.ndarray: One value per row.
+        """
+
+        starts = self._indptr[rows]
+        lengths = self._indptr[rows + 1] - starts
+        ends = np.cumsum(lengths)
+        offsets = ends - lengths
+        # positions in _indices of the nonzeros of each row, one row after the other
+        gather = np.arange(int(ends[-1])) + np.repeat(starts - offsets, lengths)
+        values = mask[self._indices[gather]].astype(np.float64)
+        result = np.zeros(len(rows))
+        nonempty = lengths > 0
+        if nonempty.any():
+            result[nonempty] = np.add.reduceat(values, offsets[nonempty])
+        return result
+
+    @property
+    def sizes(self):
+        """np.ndarray: Number of shingles of each row."""
+
+        return self._sizes[:self._nrows]
+
+    @property
+    def matrix(self):
+        """scipy.sparse.csr_matrix: The rows added so far."""
+
+        import scipy.sparse
+
+        n = self._nrows
+        nnz = int(self._indptr[n])
+        return scipy.sparse.csr_matrix(
+            (self._ones[:nnz], self._indices[:nnz], self._indptr[:n + 1]),
+            shape=(n, max(len(self.vocabulary), 1)),
+        )
+
+class SparseJaccardDistance:
+    """
+    Exact one-vs-many `jaccard_distance` for `FISHDBC(..., vectorized=True)`.
+
+    Elements are rows of a `ShingleMatrix`, and a batch of rows is compared at once: the size of
+    each intersection is the number of the row's columns set in a mask of the signature's
+    columns, counted with a single sparse product for large batches. The instance must be
+    bound to the model's data list, as `SignatureDistance`:
+
+        distance = SparseJaccardDistance()
+        model = FISHDBC(distance, vectorized=True)
+        distance.data = model.data
+
+    Args:
+        data (list, optional): Signatures, indexed by FISHDBC.
+        k (int): Shingle length.
+    """
+
+    def __init__(self, data=None, k=SHINGLE_SIZE):
+        self.data = data
+        self.shingles = ShingleMatrix(k)
+        self._matrix = None
+        # True on the columns of the last signature, whose (signature, ids, size) is _last;
+        # reused from one signature to the next rather than allocated for each
+        self._mask = np.zeros(0, dtype=bool)
+        self._last = (None, None, None)
+
+    def _index(self, n):
+        rows = self.shingles
+        if n <= len(rows):
+            return
+        for j in range(len(rows), n):
+            rows.append(self.data[j])
+        # built again by the next large batch; the columns of the last signature may have
+        # changed too
+        self._matrix = None
+        self._forget_last()
+
+    def _forget_last(self):
+        ids = self._last[1]
+        if ids is not None:
+            self._mask[ids] = False
+        self._last = (None, None, None)
+
+    def __call__(self, signature, js):
+        if len(js) == 0:
+            return []
+        self._index(max(js) + 1)
+
+        last_signature, _, size = self._last
+        if signature is not last_signature:
+            self._forget_last()
+            ids, size = self.shingles.columns(signature)
+            ncolumns = len(self.shingles.vocabulary)
+            if len(self._mask) < ncolumns:
+                self._mask = np.zeros(max(ncolumns, 2 * len(self._mask)), dtype=bool)
+            self._mask[ids] = True
+            self._last = (signature, ids, size)
+
+        js = np.asarray(js, dtype=np.intp)
+        if len(js) >= SPARSE_MIN_BATCH:
+            if self._matrix is None:
+                self._matrix = self.shingles.matrix
+            common = self._matrix[js] @ self._mask[:self._matrix.shape[1]]
+        else:
+            common = self.shingles.count_columns(js, self._mask)
+        union = self.shingles.sizes[js] + size - common
+        # texts without shingles are at distance 0 from each other, as in jaccard_distance
+        similarity = np.ones(len(js))
+        np.divide(common, union, out=similarity, where=union > 0)
+        return (1.0 - similarity).tolist()
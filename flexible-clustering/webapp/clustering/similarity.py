@@ -1,13 +1,57 @@
+from collections import OrderedDict
+from functools import lru_cache
 import numpy as np
 from .preprocessing import is_pure_string, group_commands_and_flags
-from .load_data import load_command_resources
+from .load_data import get_resources
 
-_, similarity_matrix, _, _ = load_command_resources()
-
-__all__ = ["geometric_distance", "distance_func"]
+__all__ = [
+    "geometric_distance", "distance_func", "encode_command", "encoded_distance",
+    "geometric_distance_many", "CommandDistance",
+]
 
 SIMILARITY_THRESHOLD = 1e-9
 
+# Maximum number of parsed elements kept by each CommandDistance
+PARSED_CACHE_SIZE = 1 << 20
+
+# Id of the units skipped when comparing commands (abstract types like FILE or STRING(n))
+SKIPPED_TOKEN = -1
+
+@lru_cache(maxsize=None)
+def similarity_tables():
+    """
+    Token vocabulary of the similarity matrix, built on first use.
+
+    TOKEN_IDS maps each token to its row/column in SIMILARITY, where
+    SIMILARITY[TOKEN_IDS[u1], TOKEN_IDS[u2]] == sim_matrix[u1][u2]. Unknown tokens map to
+    UNKNOWN_TOKEN, whose row and column are all zeros.
+
+    Returns:
+        tuple: (TOKEN_IDS, SIMILARITY, rows) where rows is SIMILARITY as nested lists:
+        indexing them is much faster than indexing arrays one item at a time.
+    """
+
+    similarity_matrix = get_resources().similarity_matrix
+    token_ids = {token: i for i, token in enumerate(similarity_matrix.columns)}
+    unknown = len(token_ids)
+    similarity = np.zeros((unknown + 1, unknown + 1))
+    similarity[:unknown, :unknown] = (
+        similarity_matrix.loc[similarity_matrix.columns, similarity_matrix.columns].to_numpy(dtype=float).T
+    )
+    return token_ids, similarity, similarity.tolist()
+
+def __getattr__(name):
+    # these used to be computed at import time
+    if name == "similarity_matrix":
+        return get_resources().similarity_matrix
+    if name == "TOKEN_IDS":
+        return similarity_tables()[0]
+    if name == "UNKNOWN_TOKEN":
+        return len(similarity_tables()[0])
+    if name == "SIMILARITY":
+        return similarity_tables()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def geometric_distance(cmd1, cmd2, sim_matrix):
     """
     Computes a semantic distance between two abstracted command lines using geometric mean
@@ -59,4 +103,165 @@ def distance_func():
         Callable: A two-argument function (cmd1, cmd2) → distance (float).
     """
 
+    similarity_matrix = get_resources().similarity_matrix
     return lambda x, y: geometric_distance(x, y, similarity_matrix)
+
+def encode_command(cmd):
+    """
+    Parses an abstracted command line into token ids of the similarity vocabulary.
+
+    Units are grouped as in `geometric_distance`; units that `geometric_distance` skips
+    (uppercase types and `STRING(n)` payloads) become `SKIPPED_TOKEN`.
+
+    Args:
+        cmd (str): Abstracted command string.
+
+    Returns:
+        tuple: (ids, pure) where ids is a tuple of token ids and pure is True if the
+        command is a pure string payload.
+    """
+
+    if is_pure_string(cmd):
+        return (), True
+    token_ids = similarity_tables()[0]
+    unknown = len(token_ids)
+    return tuple(
+        SKIPPED_TOKEN if unit.isupper() or '(' in unit else token_ids.get(unit, unknown)
+        for unit in group_commands_and_flags(cmd.strip())
+    ), False
+
+def encoded_distance(encoded1, encoded2):
+    """
+    `geometric_distance` between two commands parsed by `encode_command`.
+
+    Args:
+        encoded1 (tuple): (ids, pure) of the first command.
+        encoded2 (tuple): (ids, pure) of the second command.
+
+    Returns:
+        float: Distance in [0.0, 1.0], where 0 means highly similar, 1 means dissimilar.
+    """
+
+    ids1, pure1 = encoded1
+    ids2, pure2 = encoded2
+    if pure1 or pure2:
+        return 1.0
+
+    rows = similarity_tables()[2]
+    sims = [
+        rows[u1][u2]
+        for u1, u2 in zip(ids1, ids2)
+        if u1 != SKIPPED_TOKEN and u2 != SKIPPED_TOKEN
+    ]
+    if not sims:
+        return 1.0
+
+    product = 1.0
+    for s in sims:
+        product *= max(s, SIMILARITY_THRESHOLD)
+
+    geometric_mean = product ** (1.0 / len(sims))
+    return min(max(1.0 - geometric_mean, 0.0), 1.0)
+
+def geometric_distance_many(encoded, others):
+    """
+    Vectorized `geometric_distance` between one encoded command and a batch of others.
+
+    Pairs of units are compared position by position as in `geometric_distance`; the whole
+    batch is scored with a single lookup in the dense `SIMILARITY` matrix.
+
+    Args:
+        encoded (tuple): (ids, pure) as returned by `encode_command`.
+        others (list): List of (ids, pure) tuples.
+
+    Returns:
+        np.ndarray: Distances in [0.0, 1.0], one per element of `others`.
+    """
+
+    ids, pure = encoded
+    distances = np.ones(len(others))
+    if pure or not ids or not others:
+        return distances
+
+    width = len(ids)
+    batch = np.full((len(others), width), SKIPPED_TOKEN, dtype=np.intp)
+    batch_pure = np.zeros(len(others), dtype=bool)
+    for row, (other_ids, other_pure) in enumerate(others):
+        batch_pure[row] = other_pure
+        other_ids = other_ids[:width]
+        batch[row, :len(other_ids)] = other_ids
+
+    # positions past the end of either command are SKIPPED_TOKEN as well
+    ids = np.array(ids, dtype=np.intp)
+    valid = (batch != SKIPPED_TOKEN) & (ids != SKIPPED_TOKEN)
+    sims = similarity_tables()[1][ids, batch]
+    logs = np.where(valid, np.log(np.maximum(sims, SIMILARITY_THRESHOLD)), 0.0)
+    counts = valid.sum(axis=1)
+    found = (counts > 0) & ~batch_pure
+    geometric_mean = np.exp(logs[found].sum(axis=1) / counts[found])
+    distances[found] = np.clip(1.0 - geometric_mean, 0.0, 1.0)
+    return distances
+
+class CommandDistance:
+    """
+    One-vs-many command distance for `FISHDBC(..., vectorized=True)`.
+
+    FISHDBC calls a vectorized distance as `d(cmd, js)`, where `js` are indices into its data,
+    so the instance must be bound to the model's data list:
+
+        distance = CommandDistance()
+        model = FISHDBC(distance, vectorized=True)
+        distance.data = model.data
+
+    Each element is parsed once by `encode_command` and kept in an LRU cache keyed by its
+    index, holding at most `max_cached` elements; evicted elements are parsed again if needed.
+    """
+
+    def __init__(self, data=None, max_cached=PARSED_CACHE_SIZE):
+        self.data = data
+        self.max_cached = max_cached
+        self._encoded = OrderedDict()
+        self._last = (None, None)
+
+    def encoded(self, j):
+        """
+        Returns the parsed form of `self.data[j]`, parsing it if it isn't cached.
+
+        Args:
+            j (int): Element index.
+
+        Returns:
+            tuple: (ids, pure) as returned by `encode_command`.
+        """
+
+        cache = self._encoded
+        try:
+            cache.move_to_end(j)
+            return cache[j]
+        except KeyError:
+            pass
+        encoded = cache[j] = encode_command(self.data[j])
+        if len(cache) > self.max_cached:
+            cache.popitem(last=False)
+        return encoded
+
+    def distance(self, i, j):
+        """
+        Distance between the elements at indices `i` and `j`, on their parsed forms.
+
+        Args:
+            i (int): First element index.
+            j (int): Second element index.
+
+        Returns:
+            float: Distance in [0.0, 1.0].
+        """
+
+        return encoded_distance(self.encoded(i), self.encoded(j))
+
+    def __call__(self, cmd, js):
+        last_cmd, last_encoded = self._last
+        if cmd is not last_cmd:
+            last_encoded = encode_command(cmd)
+            self._last = (cmd, last_encoded)
+        return geometric_distance_many(last_encoded, [self.encoded(j) for j in js])
@@ -0,0 +1,333 @@
+# Copyright (c) 2017-2018 Symantec Corporation. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+
+# views of an ArrayGraph kept with their row as Python lists, which are
+# much faster to probe than the arrays; each takes a few hundred bytes
+CACHED_ROWS = 16384
+
+
+class ArrayGraph(object):
+    """One level of an HNSW, stored in fixed-width NumPy arrays.
+
+    This is a drop-in replacement for the {i: {j: dist}} dictionaries
+    used by default in HNSW._graphs: g[i] returns a dict-like view of
+    i's neighbors, backed by row i of the arrays. Each node has room for
+    at most width neighbors, which is what HNSW guarantees anyway (m0
+    for level 0, m for the upper levels).
+    """
+
+    # self._rows[i] is the row where node i is stored, or -1;
+    # self._ids[row, :self._degree[row]] are the neighbor ids and
+    # self._dists[row, :self._degree[row]] the respective distances;
+    # self._nodes[row] is the node stored at row; self._cache[i] is a
+    # view of node i holding its row as lists (see _Neighbors), for
+    # recently read nodes.
+
+    def __init__(self, width, capacity=16, dtype=np.float64):
+        """width is the maximum number of neighbors per node.
+
+        Distances are stored with the given dtype; use np.float32 to
+        halve the memory used by distances at the cost of precision."""
+
+        self.width = width
+        self._rows = np.full(capacity, -1, dtype=np.int32)
+        self._nodes = np.empty(capacity, dtype=np.int32)
+        self._ids = np.empty((capacity, width), dtype=np.int32)
+        self._dists = np.empty((capacity, width), dtype=dtype)
+        self._degree = np.zeros(capacity, dtype=np.int32)
+        self._len = 0
+        self._cache = {}
+
+    @property
+    def nbytes(self):
+        """Bytes used by the arrays backing this graph."""
+
+        return sum(a.nbytes for a in (self._rows, self._nodes, self._ids,
+                                      self._dists, self._degree))
+
+    def _row(self, i):
+        rows = self._rows
+        if i < 0 or i >= len(rows):
+            return -1
+        return int(rows[i])
+
+    def _drop_cache(self):
+        for view in self._cache.values():
+            view._id_list = view._dist_list = None
+        self._cache = {}
+
+    def _grow_rows(self, i):
+        rows = self._rows
+        size = max(i + 1, 2 * len(rows))
+        self._rows = np.full(size, -1, dtype=np.int32)
+        self._rows[:len(rows)] = rows
+
+    def _grow_storage(self):
+        size = 2 * len(self._nodes)
+        self._nodes = np.resize(self._nodes, size)
+        self._degree = np.resize(self._degree, size)
+        self._degree[self._len:] = 0
+        ids = np.empty((size, self.width), dtype=self._ids.dtype)
+        ids[:self._len] = self._ids[:self._len]
+        dists = np.empty((size, self.width), dtype=self._dists.dtype)
+        dists[:self._len] = self._dists[:self._len]
+        self._ids, self._dists = ids, dists
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, i):
+        return i in self._cache or self._row(i) >= 0
+
+    def __iter__(self):
+        return iter(self._nodes[:self._len].tolist())
+
+    def __getitem__(self, i):
+        cache = self._cache
+        view = cache.get(i)
+        if view is None:
+            row = self._row(i)
+            if row < 0:
+                raise KeyError(i)
+            if len(cache) >= CACHED_ROWS:
+                self._drop_cache()
+                cache = self._cache
+            view = cache[i] = _Neighbors(self, row, cached=True)
+        return view
+
+    def __setitem__(self, i, neighbors):
+        """Insert node i, with neighbors given as a {j: dist} mapping."""
+
+        row = self._row(i)
+        if row < 0:
+            if i >= len(self._rows):
+                self._grow_rows(i)
+            if self._len == len(self._nodes):
+                self._grow_storage()
+            row = self._len
+            self._len += 1
+            self._rows[i] = row
+            self._nodes[row] = i
+        view = self._cache.pop(i, None)
+        if view is not None:
+            view._id_list = view._dist_list = None
+        neighbors = dict(neighbors)
+        if len(neighbors) > self.width:
+            raise ValueError("node already has {} neighbors"
+                             .format(self.width))
+        n = len(neighbors)
+        self._ids[row, :n] = list(neighbors.keys())
+        self._dists[row, :n] = list(neighbors.values())
+        self._degree[row] = n
+
+    @classmethod
+    def from_csr(cls, width, nodes, indptr, indices, dists, dtype=np.float64):
+        """Build a graph from the arrays returned by to_csr()."""
+
+        nodes = np.asarray(nodes)
+        degree = np.diff(indptr)
+        if len(degree) and degree.max() > width:
+            raise ValueError("node with more than {} neighbors"
+                             .format(width))
+        n = len(nodes)
+        g = cls(width, max(n, 1), dtype)
+        g._grow_rows(int(nodes.max()) if n else 0)
+        g._rows[nodes] = np.arange(n, dtype=np.int32)
+        g._nodes[:n] = nodes
+        g._degree[:n] = degree
+        mask = np.arange(width) < degree[:, None]
+        g._ids[:n][mask] = indices
+        g._dists[:n][mask] = dists
+        g._len = n
+        return g
+
+    def to_csr(self):
+        """Return (nodes, indptr, indices, dists) arrays, in the same
+        format as a scipy CSR matrix whose i-th row is nodes[i]."""
+
+        n = self._len
+        degree = self._degree[:n]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(degree, out=indptr[1:])
+        mask = np.arange(self.width) < degree[:, None]
+        return (self._nodes[:n].copy(), indptr, self._ids[:n][mask],
+                self._dists[:n][mask])
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        for row, i in enumerate(self._nodes[:self._len].tolist()):
+            yield i, _Neighbors(self, row)
+
+    def values(self):
+        for row in range(self._len):
+            yield _Neighbors(self, row)
+
+
+class _Neighbors(object):
+    """Dict-like view of the neighbors of a node in an ArrayGraph.
+
+    The views cached by the graph also hold the row as lists, updated
+    on writes; the other views read the arrays at each access."""
+
+    __slots__ = ('_graph', '_row', '_id_list', '_dist_list')
+
+    def __init__(self, graph, row, cached=False):
+        self._graph = graph
+        self._row = row
+        self._id_list = self._read(graph._ids) if cached else None
+        self._dist_list = None
+
+    def _read(self, array):
+        row = self._row
+        return array[row, :self._graph._degree.item(row)].tolist()
+
+    def _ids(self):
+        ids = self._id_list
+        return self._read(self._graph._ids) if ids is None else ids
+
+    def _dists(self):
+        dists = self._dist_list
+        if dists is None:
+            dists = self._read(self._graph._dists)
+            if self._id_list is not None:
+                self._dist_list = dists
+        return dists
+
+    def __len__(self):
+        return len(self._ids())
+
+    def __iter__(self):
+        return iter(self._ids())
+
+    def __contains__(self, j):
+        return j in self._ids()
+
+    def keys(self):
+        return list(self._ids())
+
+    def values(self):
+        return list(self._dists())
+
+    def items(self):
+        return list(zip(self._ids(), self._dists()))
+
+    def get(self, j, default=None):
+        ids = self._ids()
+        if j not in ids:
+            return default
+        return self._dists()[ids.index(j)]
+
+    def __getitem__(self, j):
+        ids = self._ids()
+        if j not in ids:
+            raise KeyError(j)
+        return self._dists()[ids.index(j)]
+
+    def __setitem__(self, j, dist):
+        g, row = self._graph, self._row
+        ids = self._ids()
+        if j in ids:
+            pos = ids.index(j)
+        else:
+            pos = len(ids)
+            if pos == g.width:
+                raise ValueError("node already has {} neighbors"
+                                 .format(g.width))
+            g._ids[row, pos] = j
+            g._degree[row] = pos + 1
+            if self._id_list is not None:
+                ids.append(j)
+        g._dists[row, pos] = dist
+        self._dist_list = None
+
+    def __delitem__(self, j):
+        g, row = self._graph, self._row
+        ids = self._ids()
+        if j not in ids:
+            raise KeyError(j)
+        pos = ids.index(j)
+        # shift the following neighbors left, preserving insertion order
+        # like a dict would
+        last = len(ids) - 1
+        g._ids[row, pos:last] = g._ids[row, pos + 1:last + 1]
+        g._dists[row, pos:last] = g._dists[row, pos + 1:last + 1]
+        g._degree[row] = last
+        if self._id_list is not None:
+            del ids[pos]
+        self._dist_list = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, dict(self.items()))
+
+
+if __name__ == '__main__':
+
+    import tracemalloc
+
+    from argparse import ArgumentParser
+    from random import random, seed
+
+    from .hnsw import HNSW
+
+    parser = ArgumentParser(description="Compare the memory used per node "
+                            "by the dict and array HNSW graph backends.")
+    parser.add_argument('--nitems', type=int, default=5000)
+    parser.add_argument('--m', type=int, default=5)
+    parser.add_argument('--m0', type=int)
+    parser.add_argument('--float32', action='store_true')
+    args = parser.parse_args()
+
+    def d(a, b):
+        ax, ay = a
+        bx, by = b
+        dx = ax - bx
+        dy = ay - by
+        return (dx*dx + dy*dy) ** 0.5
+
+    seed(42)
+    data = [(random(), random()) for _ in range(args.nitems)]
+
+    fmt = "{:>8}: {:8.1f} bytes/node, {} levels"
+    for compact in False, True:
+        seed(0)
+        dtype = np.float32 if args.float32 else np.float64
+        hnsw = HNSW(d, m=args.m, m0=args.m0, compact=compact,
+                    compact_dtype=dtype)
+        tracemalloc.start()
+        for p in data:
+            hnsw.balanced_add(p)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(fmt.format('array' if compact else 'dict',
+                         size / args.nitems, len(hnsw._graphs)))
@@ -28,21 +28,26 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import array
+import bisect
 import heapq
 
-import hdbscan
 import numpy as np
-import scipy.sparse
 
-from hdbscan import hdbscan_
+# hdbscan and scipy.sparse are imported where they're used, since
+# importing hdbscan takes about a second
 
 from . import hnsw
+from . import snapshot
 from .unionfind import UnionFind
 
 def hnsw_hdbscan(data, d, m=5, ef=50, m0=None, level_mult=None,
                  heuristic=True, balanced_add=True, **kwargs):
     """Simple implementation for when you don't need incremental updates."""
 
+    import hdbscan
+    import scipy.sparse
+
     n = len(data)
     distance_matrix = scipy.sparse.lil_matrix((n, n))
     
@@ -59,23 +64,184 @@ def hnsw_hdbscan(data, d, m=5, ef=50, m0=None, level_mult=None,
     return hdbscan.hdbscan(distance_matrix, metric='precomputed', **kwargs)
 
 
+# update_mst replaces MST edges one at a time while there are fewer than
+# len(data) / MST_REPLACE_RATIO candidate edges, and runs Kruskal's
+# algorithm on the whole MST otherwise
+MST_REPLACE_RATIO = 10
+
+class _SpanningForest:
+    """Parent pointers on a minimum spanning forest, whose edges are
+    (rd, i, j, dist) tuples as in FISHDBC._mst_edges.
+
+    Adding an edge between two trees links them; otherwise it closes a
+    cycle, and the heaviest edge of the cycle is dropped. Only the path
+    between the endpoints of the edge is visited."""
+
+    def __init__(self, n, edges):
+        # parent[i] is (p, edge) with edge linking i to its parent p,
+        # or None for roots; linked[i] is 1 if i has any edge
+        self.parent = parent = [None] * n
+        self.linked = linked = bytearray(n)
+        # scratch space of add()
+        self._mark = [0] * n
+        self._heavy = [None] * n
+        self._stamp = 0
+        adjacent = [[] for _ in range(n)]
+        for edge in edges:
+            _, i, j, _ = edge
+            adjacent[i].append((j, edge))
+            adjacent[j].append((i, edge))
+            linked[i] = linked[j] = 1
+        seen = bytearray(n)
+        for root in range(n):
+            if seen[root]:
+                continue
+            seen[root] = 1
+            stack = [root]
+            while stack:
+                i = stack.pop()
+                for j, edge in adjacent[i]:
+                    if not seen[j]:
+                        seen[j] = 1
+                        parent[j] = (i, edge)
+                        stack.append(j)
+
+    def grow(self, n):
+        """Make room for nodes up to n - 1."""
+
+        missing = n - len(self.parent)
+        self.parent.extend([None] * missing)
+        self.linked.extend(bytes(missing))
+        self._mark.extend([0] * missing)
+        self._heavy.extend([None] * missing)
+
+    def _reroot(self, i):
+        # make i the root of its tree, reversing the path to the old one
+        parent = self.parent
+        new = None
+        while True:
+            old = parent[i]
+            parent[i] = new
+            if old is None:
+                return
+            p, edge = old
+            new = (i, edge)
+            i = p
+
+    def add(self, edge):
+        """Add edge to the forest unless it's the heaviest edge of the
+        cycle it closes. Returns (added, dropped), where dropped is the
+        edge removed from the forest or None."""
+
+        _, i, j, _ = edge
+        parent = self.parent
+        linked = self.linked
+        if not linked[i] or not linked[j]:
+            if linked[i]:  # hang the single node from the other one
+                i, j = j, i
+            linked[i] = linked[j] = 1
+            parent[i] = (j, edge)
+            return True, None
+
+        # walk up from i and j in turns until the paths meet: mark[k] is
+        # stamp for the ancestors of i, stamp + 1 for those of j, and
+        # heavy[k] the heaviest edge between k and i or j
+        mark = self._mark
+        heavy = self._heavy
+        stamp = self._stamp = self._stamp + 2
+        mark[i] = stamp
+        mark[j] = stamp + 1
+        heavy[i] = heavy[j] = None
+        x, y = i, j
+        max_x = max_y = None
+        while True:
+            up_x = parent[x]
+            if up_x is not None:
+                x, e = up_x
+                if max_x is None or e > max_x:
+                    max_x = e
+                if mark[x] == stamp + 1:
+                    max_y = heavy[x]
+                    break
+                mark[x] = stamp
+                heavy[x] = max_x
+            up_y = parent[y]
+            if up_y is not None:
+                y, e = up_y
+                if max_y is None or e > max_y:
+                    max_y = e
+                if mark[y] == stamp:
+                    max_x = heavy[y]
+                    break
+                mark[y] = stamp + 1
+                heavy[y] = max_y
+            elif up_x is None:  # both roots: i and j are in different trees
+                self._reroot(i)
+                parent[i] = (j, edge)
+                return True, None
+
+        heaviest, side, other = max_x, i, j
+        if max_x is None or (max_y is not None and max_y > max_x):
+            heaviest, side, other = max_y, j, i
+        if heaviest <= edge:
+            return False, None
+        # cut the heaviest edge, below which side hangs, then hang side
+        # from other
+        _, a, b, _ = heaviest
+        up_a = parent[a]
+        parent[a if up_a is not None and up_a[1] is heaviest else b] = None
+        self._reroot(side)
+        parent[side] = (other, edge)
+        return True, heaviest
+
 class FISHDBC:
     """Flexible Incremental Scalable Hierarchical Density-Based Clustering."""
 
     def __init__(self, d, min_samples=5, m=5, ef=50, m0=None, level_mult=None,
-                 heuristic=True, balanced_add=True, vectorized=False):
+                 heuristic=True, balanced_add=True, vectorized=False,
+                 compact=False, compact_dtype=None, collapse_duplicates=False,
+                 entry_points=None):
         """Setup the algorithm. The only mandatory parameter is d, the
         dissimilarity function. min_samples is passed to hdbscan, and
-        the other parameters are all passed to HNSW."""
+        the other parameters are all passed to HNSW.
+
+        If collapse_duplicates is true, elements must be hashable and
+        each distinct element becomes a single node with an integer
+        weight, counted in core distances and cluster sizes as if the
+        element was added weight times: this avoids computing distances
+        for repeated elements. Rows, i.e. the elements as they were
+        added, are then the points returned by cluster(); row_nodes maps
+        each row to its node.
+
+        entry_points is passed to HNSW: it is called with the index of
+        the element being added and returns the indices of elements
+        likely to be close to it."""
 
         self.min_samples = min_samples
         
         self.data = data = []  # the data we're clustering
+
+        if collapse_duplicates:
+            # _weights[i] is the multiplicity of data[i], _node_index
+            # maps elements to their index, and row_nodes[r] is the
+            # index of the element of the r-th row
+            self._weights = []
+            self._node_index = {}
+            self.row_nodes = array.array('q')
+            # _in_heaps[j] is the set of nodes i such that j is in
+            # _neighbor_heaps[i]: their core distance may decrease when
+            # j's weight grows
+            self._in_heaps = []
+        else:
+            self._weights = None
         
         self._mst_edges = []  # minimum spanning tree.
         # format: a list of (rd, i, j, dist) edges where nodes are
         # data[i] and data[j], dist is the dissimilarity between them, and rd
         # is the reachability distance.
+        # _mst_forest holds the same edges as a _SpanningForest, for small
+        # updates; it's None when it needs to be rebuilt.
+        self._mst_forest = None
 
         # (i, j) -> dist: the new candidates for the spanning tree
         # reachability distance will be computed afterwards
@@ -86,6 +252,9 @@ class FISHDBC:
         # to i and mdist = -d(data[i], data[j]). Since heapq doesn't
         # currently support max-heaps, we use a min-heap with the
         # negative values of distances.
+        # With collapse_duplicates, heaps hold the closest neighbors
+        # whose weights sum to min_samples; the other copies of data[i]
+        # are a (-0.0, i) entry of weight _weights[i] - 1.
         self._neighbor_heaps = []
 
         # caches the distances computed to the last data item inserted
@@ -124,16 +293,43 @@ class FISHDBC:
                 return res
 
         # We create the HNSW
-        the_hnsw = hnsw.HNSW(decorated_d, m, ef, m0, level_mult, heuristic,
-                             vectorized)
+        self._hnsw = the_hnsw = hnsw.HNSW(decorated_d, m, ef, m0, level_mult,
+                                          heuristic, vectorized, compact,
+                                          compact_dtype, entry_points)
+        self._balanced_add = balanced_add
         self._hnsw_add = (the_hnsw.balanced_add if balanced_add
                           else the_hnsw.add)
 
     def __len__(self):
         return len(self.data)
+
+    def save(self, path):
+        """Save the state of the algorithm to a snapshot file at path.
+
+        Elements are stored as text if they are all strings, and
+        pickled otherwise. See snapshot.py for the file format."""
+
+        snapshot.save_fishdbc(self, path)
+
+    @classmethod
+    def load(cls, path, d, entry_points=None):
+        """Load the state saved with save(); d is the dissimilarity
+        function and entry_points the one given to the constructor, if
+        any: functions can't be saved. No distance is computed, so
+        this is much faster than adding the elements again."""
+
+        return snapshot.load_fishdbc(path, d, cls, entry_points)
     
-    def add(self, elem):
-        """Add elem to the data structure."""
+    def add(self, elem, weight=1):
+        """Add elem to the data structure and return its index.
+
+        weight, the number of times elem is added, can only be used with
+        collapse_duplicates."""
+
+        if self._weights is not None:
+            return self._add_weighted(elem, weight)
+        if weight != 1:
+            raise ValueError("weights require collapse_duplicates=True")
         
         data = self.data
         distance_cache = self._distance_cache
@@ -173,6 +369,110 @@ class FISHDBC:
                         key = (j, k) if j < k else (k, j)
                         new_edges[key] = -min(md, new_mrd)
         distance_cache.clear()
+        return idx
+
+    def _entry_weight(self, i, j):
+        # weight of the (mdist, j) entry in i's neighbor heap
+        if j == i:
+            return self._weights[i] - 1
+        if j == -np.inf:
+            return 1
+        return self._weights[j]
+
+    def _trim_heap(self, i):
+        # pop the farthest neighbors of i while the others still weigh
+        # at least min_samples
+        h = self._neighbor_heaps[i]
+        entry_weight = self._entry_weight
+        total = sum(entry_weight(i, j) for _, j in h)
+        while len(h) > 1:
+            top_weight = entry_weight(i, h[0][1])
+            if total - top_weight < self.min_samples:
+                break
+            _, j = heapq.heappop(h)
+            total -= top_weight
+            if j != i and j != -np.inf:
+                self._in_heaps[j].discard(i)
+
+    def _push_neighbor(self, i, mdist, j):
+        # add j to i's neighbor heap if it's closer than its core
+        # distance; returns the old and new (negated) core distances
+        h = self._neighbor_heaps[i]
+        old_mrd = h[0][0]
+        if mdist >= old_mrd:
+            heapq.heappush(h, (mdist, j))
+            self._in_heaps[j].add(i)
+            self._trim_heap(i)
+        return old_mrd, h[0][0]
+
+    def _core_decreased(self, j, old_mrd, new_mrd, skip=None):
+        # j's core distance decreased: so did the reachability distance
+        # to the neighbors k whose core distance is lower
+        nh = self._neighbor_heaps
+        new_edges = self._new_edges
+        for md, k in nh[j]:
+            if k == skip or k == j or k == -np.inf:
+                continue
+            if nh[k][0][0] > old_mrd:
+                key = (j, k) if j < k else (k, j)
+                new_edges[key] = -min(md, new_mrd)
+
+    def _add_weighted(self, elem, weight):
+        if weight < 1:
+            raise ValueError("weight must be a positive integer")
+
+        nh = self._neighbor_heaps
+        idx = self._node_index.get(elem)
+        if idx is not None:
+            # a duplicate: no distance to compute, but idx's and its
+            # neighbors' core distances may decrease
+            self._weights[idx] += weight
+            self.row_nodes.extend([idx] * weight)
+            h = nh[idx]
+            old_mrd = h[0][0]
+            if not any(j == idx for _, j in h):
+                heapq.heappush(h, (-0.0, idx))
+            self._trim_heap(idx)
+            if h[0][0] != old_mrd:
+                self._core_decreased(idx, old_mrd, h[0][0])
+            for i in list(self._in_heaps[idx]):
+                old_mrd = nh[i][0][0]
+                self._trim_heap(i)
+                if nh[i][0][0] != old_mrd:
+                    self._core_decreased(i, old_mrd, nh[i][0][0])
+            return idx
+
+        data = self.data
+        distance_cache = self._distance_cache
+        new_edges = self._new_edges
+        minus_infty = -np.inf
+
+        assert distance_cache == {}
+
+        idx = len(data)
+        data.append(elem)
+        self._node_index[elem] = idx
+        self._weights.append(weight)
+        self._in_heaps.append(set())
+        self.row_nodes.extend([idx] * weight)
+        nh.append([(minus_infty, minus_infty)] * self.min_samples)
+        if weight > 1:
+            nh[idx].append((-0.0, idx))
+            self._trim_heap(idx)
+
+        self._hnsw_add(idx)
+
+        for j, dist in distance_cache.items():
+            mdist = -dist
+            self._push_neighbor(idx, mdist, j)
+            new_edges[j, idx] = dist
+
+            # also update j's reachability distances
+            old_mrd, new_mrd = self._push_neighbor(j, mdist, idx)
+            if old_mrd != new_mrd:
+                self._core_decreased(j, old_mrd, new_mrd, skip=idx)
+        distance_cache.clear()
+        return idx
 
     def update(self, elems, mst_update_rate=100000):
         """Add elements from elems and update the MST.
@@ -187,45 +487,94 @@ class FISHDBC:
                 self.update_mst()
         self.update_mst()
 
-    def update_mst(self):
-        """Update the minimum spanning tree."""
+    def update_mst(self, full=False):
+        """Update the minimum spanning tree.
+
+        self._mst_edges is kept sorted, as Kruskal's algorithm outputs
+        it. When there are few candidate edges with respect to the
+        nodes, each one is added to the tree and the heaviest edge of
+        the cycle it closes, if heavier, is dropped (see
+        _SpanningForest): this only visits the tree paths between the
+        endpoints of the candidates. Otherwise, the sorted candidates
+        are merged with the MST and Kruskal's algorithm is run on the
+        MST edges that aren't lighter than every candidate.
+
+        If full is true, all the edges are heapified and Kruskal's
+        algorithm is run from scratch, as in the original FISHDBC. In
+        all cases the resulting MST is the same.
+        """
         
         new_edges = self._new_edges
 
         if len(new_edges) == 0:
             return
         
-        candidate_edges = self._mst_edges
         nh = self._neighbor_heaps
-
-        candidate_edges.extend((max(dist, -nh[i][0][0], -nh[j][0][0]),
-                                i, j, dist)
-                               for (i, j), dist in new_edges.items())
-        heapq.heapify(candidate_edges)
-        
-        # Kruskal's algorithm
-        self._mst_edges = mst_edges = []
+        candidates = [(max(dist, -nh[i][0][0], -nh[j][0][0]), i, j, dist)
+                      for (i, j), dist in new_edges.items()]
         n = len(self.data)
-        needed_edges = n - 1
+        new_edges.clear()
+
+        if not full and len(candidates) * MST_REPLACE_RATIO < n:
+            forest = self._mst_forest
+            if forest is None:
+                forest = self._mst_forest = _SpanningForest(n, self._mst_edges)
+            else:
+                forest.grow(n)
+            mst_edges = self._mst_edges
+            for edge in candidates:
+                added, dropped = forest.add(edge)
+                if dropped is not None:
+                    del mst_edges[bisect.bisect_left(mst_edges, dropped)]
+                if added:
+                    bisect.insort(mst_edges, edge)
+            return
+
+        self._mst_forest = None
         uf = UnionFind(n)
-        while needed_edges:
-            _, i, j, _ = edge = heapq.heappop(candidate_edges)
+        if full:
+            heap = self._mst_edges
+            heap.extend(candidates)
+            heapq.heapify(heap)
+            candidate_edges = (heapq.heappop(heap) for _ in range(len(heap)))
+            mst_edges = []
+        else:
+            candidates.sort()
+            old_edges = self._mst_edges
+            # old edges lighter than all candidates are a forest, and
+            # Kruskal's algorithm would accept all of them
+            split = bisect.bisect_left(old_edges, candidates[0])
+            mst_edges = old_edges[:split]
+            for _, i, j, _ in mst_edges:
+                uf.union(i, j)
+            # two sorted runs: timsort merges them in linear time
+            candidate_edges = old_edges[split:] + candidates
+            candidate_edges.sort()
+
+        # Kruskal's algorithm
+        needed_edges = n - 1 - len(mst_edges)
+        for edge in candidate_edges:
+            if not needed_edges:
+                break
+            _, i, j, _ = edge
             if uf.union(i, j):
                 mst_edges.append(edge)
                 needed_edges -= 1
-
-        new_edges.clear()
+        self._mst_edges = mst_edges
     
     def cluster(self, min_cluster_size=None, cluster_selection_method='eom',
                 allow_single_cluster=False,
                 match_reference_implementation=False):
         """Returns: (labels, probs, stabilities, condensed_tree, slt, mst)."""
-        
+
+        from hdbscan import hdbscan_
         if min_cluster_size is None:
             min_cluster_size = self.min_samples
         self.update_mst()
         mst = np.array(self._mst_edges).astype(np.double)
         mst = np.concatenate((mst[:, 1:3], mst[:, 0].reshape(-1, 1)), axis=1)
+        if self._weights is not None:
+            mst = self._expand_mst(mst)
         slt = hdbscan_.label(mst)
         condensed_tree = hdbscan_.condense_tree(slt, min_cluster_size)
         stability_dict = hdbscan_.compute_stability(condensed_tree)
@@ -234,4 +583,26 @@ class FISHDBC:
                                     cluster_selection_method,
                                     allow_single_cluster,
                                     match_reference_implementation)
-        return lps + (condensed_tree, slt, mst)
\ No newline at end of file
+        return lps + (condensed_tree, slt, mst)
+
+    def _expand_mst(self, mst):
+        # Turn an MST on nodes into one on rows. The copies of a node are
+        # at distance 0 from each other, so their reachability distance
+        # is the node's core distance, which is not larger than that of
+        # any edge leaving the node: linking every copy to the node's
+        # first row gives an MST on rows.
+        rows = np.frombuffer(self.row_nodes, dtype=np.int64)
+        nodes, first_rows = np.unique(rows, return_index=True)
+        first_row = np.empty(len(self.data), dtype=np.int64)
+        first_row[nodes] = first_rows
+        node_edges = mst.copy()
+        node_edges[:, 0] = first_row[mst[:, 0].astype(np.int64)]
+        node_edges[:, 1] = first_row[mst[:, 1].astype(np.int64)]
+
+        core = -np.array([h[0][0] for h in self._neighbor_heaps])
+        copies = np.flatnonzero(first_row[rows] != np.arange(len(rows)))
+        copy_edges = np.column_stack((first_row[rows[copies]], copies,
+                                      core[rows[copies]])).astype(np.double)
+
+        edges = np.concatenate((node_edges, copy_edges))
+        return edges[np.argsort(edges[:, 2], kind='stable')]
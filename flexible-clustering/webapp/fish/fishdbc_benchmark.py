@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017-2018 Symantec Corporation. All Rights Reserved. 
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import time
+
+import numpy as np
+import sklearn.datasets
+
+from fish import FISHDBC
+
+parser = argparse.ArgumentParser(description="""
+Compare incremental and full MST updates on an append-heavy workload:
+after an initial batch, small batches of items are added and the MST is
+updated after each of them.
+
+Run from the webapp folder as: python -m fish.fishdbc_benchmark""")
+parser.add_argument('--nitems', type=int, default=5000,
+                    help="Number of initial items (default 5000).")
+parser.add_argument('--batch', type=int, default=100,
+                    help="Items added per update (default 100).")
+parser.add_argument('--nbatches', type=int, default=20,
+                    help="Number of updates (default 20).")
+args = parser.parse_args()
+
+total = args.nitems + args.batch * args.nbatches
+data, _ = sklearn.datasets.make_blobs(total, centers=10, random_state=0)
+
+def distance(x, y):
+    return np.linalg.norm(x - y)
+
+clusterers = {'full': FISHDBC(distance), 'incremental': FISHDBC(distance)}
+for name, clusterer in clusterers.items():
+    for elem in data[:args.nitems]:
+        clusterer.add(elem)
+    clusterer.update_mst(full=True)
+
+times = {name: 0 for name in clusterers}
+for start in range(args.nitems, total, args.batch):
+    for name, clusterer in clusterers.items():
+        for elem in data[start:start + args.batch]:
+            clusterer.add(elem)
+        t = time.perf_counter()
+        clusterer.update_mst(full=name == 'full')
+        times[name] += time.perf_counter() - t
+assert clusterers['full']._mst_edges == clusterers['incremental']._mst_edges
+
+for name, t in times.items():
+    print("{:>12}: {:8.2f} ms per update".format(name,
+                                                 1000 * t / args.nbatches))
@@ -46,6 +46,41 @@ except ImportError: # Python 2.x or <= 3.2
 
 inf = float('inf')
 
+def _tolist(values):
+    # NumPy arrays are converted, since Python floats compare faster
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+class _VisitedPool(object):
+    """Visited-node markers reused by the search kernels.
+
+    A marker is an [epoch, marks] pair, and node i has been visited by
+    the current search iff marks[i] == epoch: a new search increments
+    the epoch rather than clearing or reallocating anything. Each search
+    takes a marker from the pool and gives it back when it's done, so
+    concurrent searches (e.g., from threads) never share one."""
+
+    def __init__(self):
+        self._free = []
+
+    def acquire(self, n):
+        """Take a marker for a search over nodes 0..n-1."""
+
+        try:
+            marker = self._free.pop()
+        except IndexError:
+            marker = [0, []]
+        marker[0] += 1
+        marks = marker[1]
+        if len(marks) < n: # grow geometrically, as data grows by one
+            marks.extend([0] * max(n - len(marks), len(marks)))
+        return marker
+
+    def release(self, marker):
+        # a marker not released (e.g., if the distance raised) is
+        # simply not reused
+        self._free.append(marker)
+
+
 class HNSW(object):
     """Hierarchical Navigable Small World (HNSW) data structure.
 
@@ -57,15 +92,28 @@ class HNSW(object):
     """
 
     # self._graphs[level][i] contains a {j: dist} dictionary,
-    # where j is a neighbor of i and dist is distance
+    # where j is a neighbor of i and dist is distance. With compact=True,
+    # self._graphs[level] is an ArrayGraph and self._graphs[level][i] a
+    # dict-like view on its arrays.
 
     def __init__(self, d, m=5, ef=200, m0=None, level_mult=None,
-                 heuristic=True, vectorized=False):
+                 heuristic=True, vectorized=False, compact=False,
+                 compact_dtype=None, entry_points=None):
         """d the dissimilarity function
 
         If vectorized is true, d can be called on lists as second argument
         to compare multiple elements with the first.
 
+        If compact is true, each level of the graph is stored in
+        fixed-width NumPy arrays (see arraygraph.ArrayGraph) rather than
+        in dictionaries, using much less memory per node; compact_dtype
+        is the dtype used to store distances (default: np.float64).
+
+        entry_points, if given, is called as entry_points(elem) and
+        returns indices of nodes likely to be close to elem (e.g., from
+        a locality-sensitive hashing index); they are used as extra
+        entry points when searching the bottom level.
+
         See other parameters in http://arxiv.org/pdf/1603.09320v2.pdf"""
 
         self.data = []
@@ -87,6 +135,27 @@ class HNSW(object):
         self._level_mult = 1 / log2(m) if level_mult is None else level_mult
         self._graphs = []
         self._enter_point = None
+        self.entry_points = entry_points
+        self._visited = _VisitedPool()
+
+        # kept to save/load the data structure (see snapshot.py)
+        self._heuristic = heuristic
+        self._vectorized = vectorized
+        self._compact = compact
+        self._compact_dtype = compact_dtype
+
+        if compact:
+            from .arraygraph import ArrayGraph
+            kwargs = {}
+            if compact_dtype is not None:
+                kwargs['dtype'] = compact_dtype
+            def new_graph(level):
+                return ArrayGraph(self._m0 if level == 0 else self._m,
+                                  **kwargs)
+        else:
+            def new_graph(level):
+                return {}
+        self._new_graph = new_graph
 
         self._select = (self._select_heuristic if heuristic
                         else self._select_naive)
@@ -122,11 +191,14 @@ class HNSW(object):
             g0 = graphs[0]
             for g in reversed(graphs[:level]):
                 level_m = m if g is not g0 else self._m0
+                if g is g0:
+                    ep = self._add_entry_points(elem, ep, ef)
                 # navigate the graph and update ep with the closest
                 # nodes we find
                 ep = self._search_graph(elem, ep, g, ef)
                 # insert in g[idx] the best neighbors
-                g[idx] = g_idx = {}
+                g[idx] = {}
+                g_idx = g[idx]
                 self._select(g_idx, ep, level_m, g, heap=True)
                 #assert len(g_idx) <= level_m
                 # insert backlinks to the new node
@@ -136,7 +208,9 @@ class HNSW(object):
                 #assert all(e in g for _, e in ep)
         for i in range(len(graphs), level):
             # for all new levels, we create an empty graph
-            graphs.append({idx: {}})
+            g = self._new_graph(i)
+            g[idx] = {}
+            graphs.append(g)
             self._enter_point = idx
 
     def balanced_add(self, elem, ef=None):
@@ -177,8 +251,12 @@ class HNSW(object):
             for level, g in enumerate(graphs):
                 level_m = m0 if level == 0 else m
                 # find the candidate neighbors and select which ones to insert
-                candidates = self._search_graph(elem, [(-dist, point)], g, ef)
-                g[idx] = g_idx = {}
+                ep = [(-dist, point)]
+                if level == 0:
+                    ep = self._add_entry_points(elem, ep, ef)
+                candidates = self._search_graph(elem, ep, g, ef)
+                g[idx] = {}
+                g_idx = g[idx]
                 self._select(g_idx, candidates, level_m, g, heap=True)
                 # add reverse edges
                 for j, dist in g_idx.items():
@@ -192,7 +270,9 @@ class HNSW(object):
                     if any(p in graphs[level + 1] for p in g_idx):
                         return
                 point, dist = pd.pop()
-        graphs.append({idx: {}})
+        g = self._new_graph(len(graphs))
+        g[idx] = {}
+        graphs.append(g)
         self._enter_point = idx        
     
     def search(self, q, k=None, ef=None):
@@ -213,7 +293,8 @@ class HNSW(object):
         for g in reversed(graphs[1:]):
             point, dist = self._search_graph_ef1(q, point, dist, g)
         # look for ef neighbors in the bottom level
-        ep = self._search_graph(q, [(-dist, point)], graphs[0], ef)
+        ep = self._add_entry_points(q, [(-dist, point)], ef)
+        ep = self._search_graph(q, ep, graphs[0], ef)
 
         if k is not None:
             ep = nlargest(k, ep)
@@ -222,25 +303,220 @@ class HNSW(object):
 
         return [(idx, -md) for md, idx in ep]
 
+    def search_many(self, queries, k=None, ef=None, pairwise=None,
+                    workers=None):
+        """Find the k points closest to each of the queries.
+
+        Returns the same as [self.search(q, k, ef) for q in queries].
+
+        If pairwise is given, the queries walk the graph together, one
+        expansion step at a time, and the distances needed by all of
+        them at each step are computed with a single call to
+        pairwise(qs, js); qs and js are lists of indices, and it returns
+        the distances between queries[qs[n]] and self.data[js[n]] for
+        each n (e.g., norm(Q[qs] - D[js], axis=1) with NumPy arrays).
+
+        With workers > 1, the queries are split among that many threads;
+        this only helps if the distance releases the GIL (e.g., NumPy
+        operations on large arrays)."""
+
+        queries = list(queries)
+        if ef is None:
+            ef = self._ef
+        if self._enter_point is None:
+            raise ValueError("Empty graph")
+
+        def run(qs):
+            if pairwise is None:
+                return [self.search(queries[i], k, ef) for i in qs]
+            return self._search_many(queries, qs, k, ef, pairwise)
+
+        n = len(queries)
+        if not workers or workers <= 1 or n <= 1:
+            return run(range(n))
+
+        from concurrent.futures import ThreadPoolExecutor
+        size = -(-n // workers)
+        chunks = [range(i, min(i + size, n)) for i in range(0, n, size)]
+        with ThreadPoolExecutor(len(chunks)) as executor:
+            return [res for chunk in executor.map(run, chunks)
+                    for res in chunk]
+
+    def _search_many(self, queries, qs, k, ef, pairwise):
+
+        graphs = self._graphs
+        point = self._enter_point
+
+        qs = list(qs)
+        dists = _tolist(pairwise(qs, [point] * len(qs)))
+        points = [point] * len(qs)
+        # look for the closest neighbor from the top to the 2nd level
+        for g in reversed(graphs[1:]):
+            points, dists = self._search_many_ef1(qs, points, dists, g,
+                                                  pairwise)
+        # look for ef neighbors in the bottom level
+        eps = [self._add_entry_points(queries[i], [(-dist, p)], ef)
+               for i, p, dist in zip(qs, points, dists)]
+        eps = self._search_many_graph(qs, eps, graphs[0], ef, pairwise)
+
+        results = []
+        for ep in eps:
+            if k is not None:
+                ep = nlargest(k, ep)
+            else:
+                ep.sort(reverse=True)
+            results.append([(idx, -md) for md, idx in ep])
+        return results
+
+    @staticmethod
+    def _pairwise_many(qs, work, pairwise):
+        """For each (n, edges) in work, the distances between query
+        qs[n] and the nodes in edges, computed in a single call."""
+
+        if not work:
+            return []
+        xs, ys = [], []
+        for n, edges in work:
+            xs.extend([qs[n]] * len(edges))
+            ys.extend(edges)
+        dists = _tolist(pairwise(xs, ys))
+        res = []
+        start = 0
+        for _, edges in work:
+            end = start + len(edges)
+            res.append(dists[start:end])
+            start = end
+        return res
+
+    def _search_many_ef1(self, qs, points, dists, g, pairwise):
+        """_search_graph_ef1 for many queries, in lockstep."""
+
+        best = list(points)
+        best_dist = list(dists)
+        candidates = [[(dist, p)] for p, dist in zip(points, dists)]
+        visited = [set([p]) for p in points]
+        active = range(len(qs))
+
+        while active:
+            # each active query expands its next node with unvisited edges
+            work = []
+            for n in active:
+                cands = candidates[n]
+                vis = visited[n]
+                while cands:
+                    dist, c = heappop(cands)
+                    if dist > best_dist[n]:
+                        break
+                    edges = [e for e in g[c] if e not in vis]
+                    if edges:
+                        vis.update(edges)
+                        work.append((n, edges))
+                        break
+            for (n, edges), dists in zip(
+                    work, self._pairwise_many(qs, work, pairwise)):
+                for e, dist in zip(edges, dists):
+                    if dist < best_dist[n]:
+                        best[n] = e
+                        best_dist[n] = dist
+                        heappush(candidates[n], (dist, e))
+            # queries that had nothing to expand are done
+            active = [n for n, _ in work]
+
+        return best, best_dist
+
+    def _search_many_graph(self, qs, eps, g, ef, pairwise):
+        """_search_graph for many queries, in lockstep."""
+
+        candidates = []
+        visited = []
+        for ep in eps:
+            cands = [(-mdist, p) for mdist, p in ep]
+            heapify(cands)
+            candidates.append(cands)
+            visited.append(set(p for _, p in ep))
+        active = range(len(qs))
+
+        while active:
+            work = []
+            for n in active:
+                cands = candidates[n]
+                vis = visited[n]
+                mref = eps[n][0][0]
+                while cands:
+                    dist, c = heappop(cands)
+                    if dist > -mref:
+                        break
+                    edges = [e for e in g[c] if e not in vis]
+                    if edges:
+                        vis.update(edges)
+                        work.append((n, edges))
+                        break
+            for (n, edges), dists in zip(
+                    work, self._pairwise_many(qs, work, pairwise)):
+                ep = eps[n]
+                cands = candidates[n]
+                mref = ep[0][0]
+                for e, dist in zip(edges, dists):
+                    mdist = -dist
+                    if len(ep) < ef:
+                        heappush(cands, (dist, e))
+                        heappush(ep, (mdist, e))
+                        mref = ep[0][0]
+                    elif mdist > mref:
+                        heappush(cands, (dist, e))
+                        heapreplace(ep, (mdist, e))
+                        mref = ep[0][0]
+            active = [n for n, _ in work]
+
+        return eps
+
+    def _add_entry_points(self, q, ep, ef):
+        """Add to the heap ep the bottom-level nodes suggested by
+        self.entry_points, keeping the ef closest ones."""
+
+        if self.entry_points is None:
+            return ep
+        g0 = self._graphs[0]
+        known = set(p for _, p in ep)
+        extra = []
+        for p in self.entry_points(q):
+            # nodes not in g0 yet (e.g., the one being added) are skipped
+            if p not in known and p in g0:
+                known.add(p)
+                extra.append(p)
+        if not extra:
+            return ep
+        data = self.data
+        dists = self.vectorized_distance(q, [data[p] for p in extra])
+        ep = ep + [(-dist, p) for p, dist in zip(extra, dists)]
+        if len(ep) > ef:
+            ep = nlargest(ef, ep)
+        heapify(ep)
+        return ep
+
     def _search_graph_ef1(self, q, entry, dist, g):
         """Equivalent to _search_graph when ef=1."""
 
         vd = self.vectorized_distance
         data = self.data
+        pool = self._visited
+        marker = pool.acquire(len(data))
+        epoch, visited = marker
         
         best = entry
         best_dist = dist
         candidates = [(dist, entry)]
-        visited = set([entry])
+        visited[entry] = epoch
 
         while candidates:
             dist, c = heappop(candidates)
             if dist > best_dist:
                 break
-            edges = [e for e in g[c] if e not in visited]
+            edges = [e for e in g[c] if visited[e] != epoch]
             if not edges:
                 continue
-            visited.update(edges)
+            for e in edges:
+                visited[e] = epoch
             dists = vd(q, [data[e] for e in edges])
             for e, dist in zip(edges, dists):
                 if dist < best_dist:
@@ -249,16 +525,21 @@ class HNSW(object):
                     heappush(candidates, (dist, e))
                     # break
 
+        pool.release(marker)
         return best, best_dist
 
     def _search_graph(self, q, ep, g, ef):
 
         vd = self.vectorized_distance
         data = self.data
+        pool = self._visited
+        marker = pool.acquire(len(data))
+        epoch, visited = marker
         
         candidates = [(-mdist, p) for mdist, p in ep]
         heapify(candidates)
-        visited = set(p for _, p in ep)
+        for _, p in ep:
+            visited[p] = epoch
 
         while candidates:
             dist, c = heappop(candidates)
@@ -266,10 +547,11 @@ class HNSW(object):
             if dist > -mref:
                 break
 
-            edges = [e for e in g[c] if e not in visited]
+            edges = [e for e in g[c] if visited[e] != epoch]
             if not edges:
                 continue
-            visited.update(edges)
+            for e in edges:
+                visited[e] = epoch
             dists = vd(q, [data[e] for e in edges])
             for e, dist in zip(edges, dists):
                 mdist = -dist
@@ -282,6 +564,7 @@ class HNSW(object):
                     heapreplace(ep, (mdist, e))
                     mref = ep[0][0]
 
+        pool.release(marker)
         return ep
 
     def _select_naive(self, d, to_insert, m, g, heap=False):
@@ -320,17 +603,29 @@ class HNSW(object):
             assert len(d) == m
 
     def _select_heuristic(self, d, to_insert, m, g, heap=False):
-        
+
+        # A candidate idx at distance dist is dominated if a current
+        # neighbor j has it as a closer neighbor: g[j][idx] < dist. Non
+        # dominated candidates are preferred, then closer ones; this
+        # only computes the dominance checks that can change the outcome.
+
+        if not heap:
+            self._select_one(d, to_insert, m, g)
+            return
+
+        if not d: # e.g., the node being inserted: nothing is dominated
+            to_insert = nsmallest(m, ((-mdist, idx)
+                                      for mdist, idx in to_insert))
+            for dist, idx in to_insert:
+                d[idx] = dist
+            return
+
         nb_dicts = [g[idx] for idx in d]
         def prioritize(idx, dist):
             return any(nd.get(idx, inf) < dist for nd in nb_dicts), dist, idx
 
-        if not heap:
-            idx, dist = to_insert
-            to_insert = [prioritize(idx, dist)]
-        else:
-            to_insert = nsmallest(m, (prioritize(idx, -mdist)
-                                      for mdist, idx in to_insert))
+        to_insert = nsmallest(m, (prioritize(idx, -mdist)
+                                  for mdist, idx in to_insert))
 
         assert len(to_insert) > 0
         assert not any(idx in d for _, _, idx in to_insert)
@@ -354,6 +649,73 @@ class HNSW(object):
             d[idx_new] = d_new
             assert len(d) == m
 
+    @staticmethod
+    def _select_one(d, to_insert, m, g):
+        """_select_heuristic for a single candidate, e.g. a backlink.
+
+        The current neighbor that may be replaced is the worst one:
+        the farthest dominated one, or the farthest if none is
+        dominated. Neighbors are scanned from the farthest, so the scan
+        stops at the first dominated one, or as soon as the remaining
+        ones can't be worse than the candidate."""
+
+        idx, dist = to_insert
+        assert idx not in d
+        if len(d) < m:
+            d[idx] = dist
+            return
+
+        nb_dicts = [g[j] for j in d]
+        p_new = any(nd.get(idx, inf) < dist for nd in nb_dicts)
+        olds = sorted([(d_old, j) for j, d_old in d.items()], reverse=True)
+        for d_old, j in olds:
+            if p_new and d_old <= dist:
+                return
+            if any(nd.get(j, inf) < d_old for nd in nb_dicts):
+                break
+        else:
+            if p_new:
+                return
+            d_old, j = olds[0]
+            if d_old <= dist:
+                return
+        del d[j]
+        d[idx] = dist
+
+    def save(self, path):
+        """Save the data structure to a snapshot file at path.
+
+        Elements are stored as text if they are all strings, and
+        pickled otherwise. See snapshot.py for the file format."""
+
+        from . import snapshot
+        snapshot.save_hnsw(self, path)
+
+    @classmethod
+    def load(cls, path, d, entry_points=None):
+        """Load a data structure saved with save(); d is the
+        dissimilarity function and entry_points the one given to the
+        constructor, if any: functions can't be saved."""
+
+        from . import snapshot
+        return snapshot.load_hnsw(path, d, cls, entry_points)
+
+    @classmethod
+    def build_parallel(cls, d, data, workers=None, balanced=False,
+                       ef_merge=None, seed=None, **kwargs):
+        """Build a data structure holding data with a pool of worker
+        processes, each adding a partition of data; the partitions are
+        then merged (see parallel.py). d must be picklable.
+
+        workers defaults to one per CPU; ef_merge is the ef used to
+        search each element in the other partitions (default: ef).
+        With balanced, partitions are built with balanced_add. Other
+        keyword arguments are passed to the constructor."""
+
+        from . import parallel
+        return parallel.build_hnsw(cls, d, data, workers, balanced,
+                                   ef_merge, seed, **kwargs)
+
     def __getitem__(self, idx):
         """Returns a list of known neighbors of node at index idx."""
 
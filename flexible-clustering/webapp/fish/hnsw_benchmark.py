@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017-2018 Symantec Corporation. All Rights Reserved. 
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import os
+import random
+import time
+from math import inf
+
+import numpy as np
+
+from .hnsw import HNSW
+
+parser = argparse.ArgumentParser(description="""
+Benchmarks of HNSW on random vectors with the Euclidean distance.
+
+Run from the webapp folder as: python -m fish.hnsw_benchmark BENCHMARK""")
+parser.add_argument('--nitems', type=int, default=10000,
+                    help="Number of indexed items (default 10000).")
+parser.add_argument('--dim', type=int, default=16,
+                    help="Dimension of the vectors (default 16).")
+parser.add_argument('--seed', type=int, default=0)
+subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+
+def distance(x, ys):
+    return np.linalg.norm(np.asarray(ys) - x, axis=1)
+
+
+def build(data, seed, **kwargs):
+    random.seed(seed)
+    hnsw = HNSW(distance, vectorized=True, **kwargs)
+    for elem in data:
+        hnsw.add(elem)
+    return hnsw
+
+
+def recall(results, data, queries, k):
+    """Fraction of the true k nearest neighbors found."""
+
+    found = 0
+    for q, res in zip(queries, results):
+        true = np.argpartition(np.linalg.norm(data - q, axis=1), k)[:k]
+        found += len(set(true.tolist()) & set(idx for idx, _ in res))
+    return found / (k * len(queries))
+
+
+def bench_search_many(args, data):
+    rng = np.random.default_rng(args.seed + 1)
+    query_array = rng.standard_normal((args.nqueries, args.dim))
+    queries = list(query_array)
+    t = time.perf_counter()
+    hnsw = build(data, args.seed)
+    print("built {} items in {:.1f}s".format(len(data),
+                                             time.perf_counter() - t))
+
+    def pairwise(qs, js):
+        return np.linalg.norm(query_array[qs] - data[js], axis=1)
+
+    def per_query():
+        return [hnsw.search(q, args.k, args.ef) for q in queries]
+
+    runs = [('per-query loop', per_query),
+            ('search_many', lambda: hnsw.search_many(
+                queries, args.k, args.ef, pairwise))]
+    for workers in args.workers:
+        runs.append(('search_many, {} threads'.format(workers),
+                     lambda workers=workers: hnsw.search_many(
+                         queries, args.k, args.ef, pairwise, workers)))
+
+    expected = None
+    for name, run in runs:
+        t = time.perf_counter()
+        results = run()
+        elapsed = time.perf_counter() - t
+        ids = [[idx for idx, _ in res] for res in results]
+        if expected is None:
+            expected = ids
+        print("{:>36}: {:8.0f} QPS, recall@{} {:.3f}, same results: {}"
+              .format(name, len(queries) / elapsed, args.k,
+                      recall(results, data, queries, args.k),
+                      ids == expected))
+
+
+p = subparsers.add_parser('search-many', help="batched search vs a loop")
+p.add_argument('--nqueries', type=int, default=1000)
+p.add_argument('--k', type=int, default=10)
+p.add_argument('--ef', type=int, default=50)
+p.add_argument('--workers', type=int, nargs='*', default=[2, 4],
+               help="Thread counts to try (default 2 4).")
+p.set_defaults(run=bench_search_many)
+
+def bench_kernels(args, data):
+    import tracemalloc
+
+    for compact in False, True:
+        random.seed(args.seed)
+        hnsw = HNSW(distance, vectorized=True, compact=compact)
+        t = time.perf_counter()
+        for elem in data:
+            hnsw.add(elem)
+        insert = (time.perf_counter() - t) / len(data)
+
+        # best of a few runs, since searches don't change the index
+        queries = data[:args.nqueries] + 0.01
+        search = inf
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            for q in queries:
+                hnsw.search(q, 10)
+            search = min(search, (time.perf_counter() - t) / len(queries))
+
+        # memory allocated and freed while inserting, above what is kept
+        random.seed(args.seed)
+        hnsw = HNSW(distance, vectorized=True, compact=compact)
+        peaks = []
+        tracemalloc.start()
+        for elem in data[:args.traced]:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            hnsw.add(elem)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+
+        print("{:>8}: {:7.1f} us/insert, {:7.1f} us/search, {:7.0f} "
+              "transient bytes/insert".format(
+                  'array' if compact else 'dict', 1e6 * insert,
+                  1e6 * search, np.mean(peaks)))
+
+
+p = subparsers.add_parser('kernels', help="insert and search kernels")
+p.add_argument('--nqueries', type=int, default=1000)
+p.add_argument('--traced', type=int, default=2000,
+               help="Inserts traced for memory (default 2000).")
+p.add_argument('--repeat', type=int, default=3)
+p.set_defaults(run=bench_kernels)
+
+class _LegacyHNSW(HNSW):
+    """HNSW with the neighbor selection used before the early-exit
+    dominance scan, to compare against."""
+
+    def _select_heuristic(self, d, to_insert, m, g, heap=False):
+        from heapq import nlargest, nsmallest
+
+        nb_dicts = [g[idx] for idx in d]
+        def prioritize(idx, dist):
+            return any(nd.get(idx, inf) < dist for nd in nb_dicts), dist, idx
+
+        if not heap:
+            idx, dist = to_insert
+            to_insert = [prioritize(idx, dist)]
+        else:
+            to_insert = nsmallest(m, (prioritize(idx, -mdist)
+                                      for mdist, idx in to_insert))
+
+        unchecked = m - len(d)
+        to_insert, checked_ins = to_insert[:unchecked], to_insert[unchecked:]
+        to_check = len(checked_ins)
+        if to_check > 0:
+            checked_del = nlargest(to_check, (prioritize(idx, dist)
+                                              for idx, dist in d.items()))
+        else:
+            checked_del = []
+        for _, dist, idx in to_insert:
+            d[idx] = dist
+        zipped = zip(checked_ins, checked_del)
+        for (p_new, d_new, idx_new), (p_old, d_old, idx_old) in zipped:
+            if (p_old, d_old) <= (p_new, d_new):
+                break
+            del d[idx_old]
+            d[idx_new] = d_new
+
+
+def bench_select(args, data):
+    queries = data[:args.nqueries] + 0.01
+    for compact in False, True:
+        for balanced in False, True:
+            graphs = {}
+            for name, cls in ('legacy', _LegacyHNSW), ('current', HNSW):
+                random.seed(args.seed)
+                hnsw = cls(distance, m=args.m, m0=args.m0, ef=args.ef,
+                           vectorized=True, compact=compact)
+                add = hnsw.balanced_add if balanced else hnsw.add
+                t = time.perf_counter()
+                for elem in data:
+                    add(elem)
+                elapsed = time.perf_counter() - t
+                results = [hnsw.search(q, args.k) for q in queries]
+                graphs[name] = [{i: sorted(nb.items()) for i, nb in g.items()}
+                                for g in hnsw._graphs]
+                print("{:>5} {:>12} {:>7}: {:7.1f} us/insert, "
+                      "recall@{} {:.3f}".format(
+                          'array' if compact else 'dict',
+                          'balanced_add' if balanced else 'add', name,
+                          1e6 * elapsed / len(data), args.k,
+                          recall(results, data, queries, args.k)))
+            print("same graph:", graphs['legacy'] == graphs['current'])
+
+
+p = subparsers.add_parser('select', help="neighbor selection heuristic")
+p.add_argument('--m', type=int, default=5)
+p.add_argument('--m0', type=int, default=10)
+p.add_argument('--ef', type=int, default=50)
+p.add_argument('--k', type=int, default=10)
+p.add_argument('--nqueries', type=int, default=200)
+p.set_defaults(run=bench_select)
+
+def bench_parallel_build(args, data):
+    queries = np.random.default_rng(args.seed + 1).standard_normal(
+        (args.nqueries, args.dim))
+    kwargs = dict(m=args.m, ef=args.ef, vectorized=True,
+                  balanced=args.balanced)
+
+    def run(name, workers):
+        t = time.perf_counter()
+        hnsw = HNSW.build_parallel(distance, data, workers, seed=args.seed,
+                                   **kwargs)
+        elapsed = time.perf_counter() - t
+        res = recall([hnsw.search(q, args.k) for q in queries], data,
+                     queries, args.k)
+        print("{:>12}: {:6.1f}s, {:6.0f} inserts/s, recall@{} {:.3f}".format(
+            name, elapsed, len(data) / elapsed, args.k, res))
+        return elapsed, res
+
+    base_time, base_recall = run('sequential', 1)
+    worst = 0
+    for workers in range(2, args.workers + 1):
+        elapsed, res = run('{} workers'.format(workers), workers)
+        print("{:>12}  speedup {:.2f}x, recall drop {:+.3f}".format(
+            '', base_time / elapsed, base_recall - res))
+        worst = max(worst, base_recall - res)
+    if worst > args.tolerance:
+        raise SystemExit("recall dropped by {:.3f}, above the tolerance of "
+                         "{}".format(worst, args.tolerance))
+
+
+p = subparsers.add_parser('parallel-build',
+                          help="build_parallel with 1 to N workers")
+p.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+               help="Largest number of workers (default: CPU count).")
+p.add_argument('--tolerance', type=float, default=0.02,
+               help="Largest recall drop accepted against the sequential "
+               "build; exits with an error above it (default 0.02).")
+p.add_argument('--m', type=int, default=5)
+p.add_argument('--ef', type=int, default=50)
+p.add_argument('--k', type=int, default=10)
+p.add_argument('--nqueries', type=int, default=200)
+p.add_argument('--balanced', action='store_true',
+               help="Build the partitions with balanced_add.")
+p.set_defaults(run=bench_parallel_build)
+
+args = parser.parse_args()
+data = np.random.default_rng(args.seed).standard_normal(
+    (args.nitems, args.dim))
+args.run(args, data)
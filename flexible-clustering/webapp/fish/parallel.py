@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017-2018 Symantec Corporation. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""Parallel construction of an HNSW with a pool of worker processes.
+
+The data is split into one contiguous partition per worker, and each
+worker builds the HNSW of its partition. The partitions are then merged:
+
+1. their graphs are put side by side, level by level, in a union HNSW
+   whose nodes only link to nodes of the same partition;
+2. each element is searched again in the union, starting from the entry
+   points of all partitions: since a single ef bounds the search, it
+   costs about as much as one search and still reaches the closest
+   elements of every partition. Each element then selects its neighbors
+   among its current ones and those found. This runs in the workers;
+3. the new links get backlinks, as in HNSW.add (in this process).
+
+The distance function is sent to the workers, so it must be picklable
+(e.g., a function defined at module level).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heapify, nlargest
+import os
+import random
+
+# (hnsw, entries): the union HNSW, in the workers of the merge pool
+_union = None
+
+
+def build_hnsw(cls, d, data, workers=None, balanced=False, ef_merge=None,
+               seed=None, compact=False, compact_dtype=None, **settings):
+    """Build an instance of cls (HNSW or a subclass) holding data.
+
+    workers is the number of processes (default: one per CPU), and
+    ef_merge the ef of the searches of the merge (default: the ef of
+    the HNSW). balanced uses balanced_add rather than add, and seed
+    seeds the random levels of each partition. The other arguments are
+    passed to cls."""
+
+    data = list(data)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(data)))
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(32) for _ in range(workers)]
+
+    if workers == 1:
+        graphs, enter_point = _build_partition(cls, d, settings, data,
+                                               balanced, seeds[0])
+        return _finish(cls, d, settings, data, graphs, enter_point,
+                       compact, compact_dtype)
+
+    bounds = [len(data) * p // workers for p in range(workers + 1)]
+    with ProcessPoolExecutor(workers) as executor:
+        parts = list(executor.map(
+            _build_partition, [cls] * workers, [d] * workers,
+            [settings] * workers,
+            [data[lo:hi] for lo, hi in zip(bounds, bounds[1:])],
+            [balanced] * workers, seeds))
+
+    # the union of the partitions, with global indices
+    graphs = [{} for _ in range(max(len(g) for g, _ in parts))]
+    entries = [] # (top level, entry point) of each partition
+    for (part_graphs, enter_point), lo in zip(parts, bounds):
+        for level, g in enumerate(part_graphs):
+            union = graphs[level]
+            for i, neighbors in g.items():
+                union[i + lo] = {j + lo: dist
+                                 for j, dist in neighbors.items()}
+        entries.append((len(part_graphs) - 1, enter_point + lo))
+
+    if ef_merge is None:
+        ef_merge = settings.get('ef', 200)
+    nodes = list(range(len(data)))
+    chunk = -(-len(nodes) // (4 * workers))
+    chunks = [nodes[i:i + chunk] for i in range(0, len(nodes), chunk)]
+    with ProcessPoolExecutor(workers, initializer=_init_merge,
+                             initargs=(cls, d, settings, data, graphs,
+                                       entries)) as executor:
+        selected = [res for chunk_res in executor.map(
+                        _merge_nodes, chunks, [ef_merge] * len(chunks))
+                    for res in chunk_res]
+
+    hnsw = _union_hnsw(cls, d, settings, data, graphs, max(entries)[1])
+    # all neighbor lists are replaced first, then the backlinks added
+    for x, levels in selected:
+        for level, (neighbors, _) in enumerate(levels):
+            graphs[level][x] = neighbors
+    for x, levels in selected:
+        for level, (neighbors, added) in enumerate(levels):
+            g = graphs[level]
+            level_m = hnsw._m0 if level == 0 else hnsw._m
+            for j, dist in added:
+                if x not in g[j]:
+                    hnsw._select(g[j], (x, dist), level_m, g)
+
+    return _finish(cls, d, settings, data, graphs, hnsw._enter_point,
+                   compact, compact_dtype)
+
+
+def _build_partition(cls, d, settings, data, balanced, seed):
+    random.seed(seed)
+    hnsw = cls(d, **settings)
+    add = hnsw.balanced_add if balanced else hnsw.add
+    for elem in data:
+        add(elem)
+    return hnsw._graphs, hnsw._enter_point
+
+
+def _union_hnsw(cls, d, settings, data, graphs, enter_point):
+    hnsw = cls(d, **settings)
+    hnsw.data.extend(data)
+    hnsw._graphs = graphs
+    hnsw._enter_point = enter_point
+    return hnsw
+
+
+def _init_merge(cls, d, settings, data, graphs, entries):
+    global _union
+    _union = (_union_hnsw(cls, d, settings, data, graphs, None), entries)
+
+
+def _merge_nodes(nodes, ef):
+    hnsw, entries = _union
+    graphs = hnsw._graphs
+    res = []
+    for x in nodes:
+        top = 0
+        while top + 1 < len(graphs) and x in graphs[top + 1]:
+            top += 1
+        res.append((x, _merge_node(hnsw, entries, x, top, ef)))
+    return res
+
+
+def _merge_node(hnsw, entries, x, top, ef):
+    """New neighbors of x at levels 0..top, each as a (neighbors,
+    added) pair where added are the (neighbor, distance) pairs x didn't
+    have."""
+
+    data = hnsw.data
+    graphs = hnsw._graphs
+    q = data[x]
+    ep = []
+    levels = []
+    for level in reversed(range(len(graphs))):
+        # the partitions whose top level is this one join the search
+        new = [p for p_top, p in entries if p_top == level]
+        if new:
+            dists = hnsw.vectorized_distance(q, [data[p] for p in new])
+            ep.extend((-dist, p) for p, dist in zip(new, dists))
+            heapify(ep)
+        # above x's level, only keep about one entry per partition
+        level_ef = ef if level <= top else len(entries)
+        if len(ep) > level_ef:
+            ep = nlargest(level_ef, ep)
+            heapify(ep)
+        g = graphs[level]
+        ep = hnsw._search_graph(q, ep, g, level_ef)
+        if level > top:
+            continue
+        own = g[x]
+        candidates = {p: -mdist for mdist, p in ep if p != x}
+        candidates.update(own)
+        neighbors = {}
+        hnsw._select(neighbors, [(-dist, p) for p, dist in candidates.items()],
+                     hnsw._m0 if level == 0 else hnsw._m, g, heap=True)
+        levels.append((neighbors, [(p, dist) for p, dist in neighbors.items()
+                                   if p not in own]))
+    levels.reverse()
+    return levels
+
+
+def _finish(cls, d, settings, data, graphs, enter_point, compact,
+            compact_dtype):
+    hnsw = cls(d, compact=compact, compact_dtype=compact_dtype, **settings)
+    hnsw.data.extend(data)
+    if compact:
+        for level, g in enumerate(graphs):
+            compact_g = hnsw._new_graph(level)
+            for i, neighbors in g.items():
+                compact_g[i] = neighbors
+            hnsw._graphs.append(compact_g)
+    else:
+        hnsw._graphs = graphs
+    hnsw._enter_point = enter_point
+    return hnsw
@@ -0,0 +1,354 @@
+# Copyright (c) 2017-2018 Symantec Corporation. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""Snapshot files for HNSW and FISHDBC.
+
+A snapshot is a single binary file that can be memory-mapped:
+
+    MAGIC (8 bytes) | version (uint32) | header length (uint32) |
+    header (JSON, utf-8) | arrays, each aligned to ALIGN bytes
+
+The header has a "meta" dictionary of scalar settings and an "arrays"
+dictionary mapping names to the dtype, shape and offset of each array.
+Loaders only map the file and build views on it, so the cost of loading
+is that of rebuilding the Python data structures, with no distance
+computation at all.
+"""
+
+import json
+import os
+import pickle
+import struct
+
+import numpy as np
+
+MAGIC = b'FISHSNAP'
+VERSION = 1
+ALIGN = 64
+
+_PREFIX = struct.Struct('<8sII')
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def write_snapshot(path, meta, arrays):
+    """Write meta (a JSON-serializable dict) and arrays (a dict of
+    NumPy arrays) to path.
+
+    The file is written to a temporary name and then renamed, so readers
+    never see a partially written snapshot."""
+
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    index = {}
+    offset = 0
+    for name, a in arrays.items():
+        index[name] = {'dtype': a.dtype.str, 'shape': list(a.shape),
+                       'offset': offset}
+        offset = _aligned(offset + a.nbytes)
+    header = json.dumps({'meta': meta, 'arrays': index}).encode('utf-8')
+    start = _aligned(_PREFIX.size + len(header))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, a in arrays.items():
+            f.seek(start + index[name]['offset'])
+            f.write(a.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    """Return (meta, arrays) from a snapshot file.
+
+    Arrays are read-only views on a memory map of the file."""
+
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError("{} is truncated".format(path))
+        magic, version, header_len = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError("{} is not a snapshot file".format(path))
+        if version != VERSION:
+            raise ValueError("unsupported snapshot version {} in {}"
+                             .format(version, path))
+        header = f.read(header_len)
+        if len(header) < header_len:
+            raise ValueError("{} is truncated".format(path))
+        header = json.loads(header.decode('utf-8'))
+    start = _aligned(_PREFIX.size + header_len)
+
+    if os.path.getsize(path) > start:
+        mm = np.memmap(path, dtype=np.uint8, mode='r', offset=start)
+    else:  # np.memmap refuses empty maps
+        mm = np.zeros(0, dtype=np.uint8)
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        offset = info['offset']
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        if nbytes and offset + nbytes > len(mm):
+            raise ValueError("{} is truncated".format(path))
+        arrays[name] = mm[offset:offset + nbytes].view(dtype).reshape(shape)
+    return header['meta'], arrays
+
+
+def _encode_data(data, arrays):
+    if all(isinstance(x, str) for x in data):
+        encoded = [x.encode('utf-8') for x in data]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in encoded], out=offsets[1:])
+        arrays['data_offsets'] = offsets
+        arrays['data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return 'str'
+    arrays['data'] = np.frombuffer(pickle.dumps(list(data), protocol=4),
+                                   dtype=np.uint8)
+    return 'pickle'
+
+
+def _decode_data(fmt, arrays):
+    blob = arrays['data'].tobytes()
+    if fmt == 'pickle':
+        return pickle.loads(blob)
+    offsets = arrays['data_offsets'].tolist()
+    return [blob[a:b].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+
+
+def _encode_graphs(hnsw, arrays):
+    for level, g in enumerate(hnsw._graphs):
+        if hasattr(g, 'to_csr'):
+            nodes, indptr, indices, dists = g.to_csr()
+        else:
+            nodes = np.fromiter(g, dtype=np.int64, count=len(g))
+            indptr = np.zeros(len(g) + 1, dtype=np.int64)
+            np.cumsum([len(g[i]) for i in nodes.tolist()], out=indptr[1:])
+            indices = np.fromiter((j for i in nodes.tolist() for j in g[i]),
+                                  dtype=np.int64, count=indptr[-1])
+            dists = np.fromiter((dist for i in nodes.tolist()
+                                 for dist in g[i].values()),
+                                dtype=np.float64, count=indptr[-1])
+        prefix = 'level{}_'.format(level)
+        arrays[prefix + 'nodes'] = nodes
+        arrays[prefix + 'indptr'] = indptr
+        arrays[prefix + 'indices'] = indices
+        arrays[prefix + 'dists'] = dists
+    return len(hnsw._graphs)
+
+
+def _decode_graphs(hnsw, nlevels, arrays):
+    graphs = []
+    for level in range(nlevels):
+        prefix = 'level{}_'.format(level)
+        nodes = arrays[prefix + 'nodes']
+        indptr = arrays[prefix + 'indptr']
+        indices = arrays[prefix + 'indices']
+        dists = arrays[prefix + 'dists']
+        if hnsw._compact:
+            from .arraygraph import ArrayGraph
+            dtype = hnsw._compact_dtype or np.float64
+            width = hnsw._m0 if level == 0 else hnsw._m
+            g = ArrayGraph.from_csr(width, nodes, indptr, indices, dists,
+                                    dtype)
+        else:
+            indptr = indptr.tolist()
+            indices = indices.tolist()
+            dists = dists.tolist()
+            g = {i: dict(zip(indices[a:b], dists[a:b]))
+                 for i, a, b in zip(nodes.tolist(), indptr, indptr[1:])}
+        graphs.append(g)
+    return graphs
+
+
+def _hnsw_meta(hnsw):
+    dtype = hnsw._compact_dtype
+    return {
+        'm': hnsw._m,
+        'ef': hnsw._ef,
+        'm0': hnsw._m0,
+        'level_mult': hnsw._level_mult,
+        'heuristic': hnsw._heuristic,
+        'vectorized': hnsw._vectorized,
+        'compact': hnsw._compact,
+        'compact_dtype': None if dtype is None else np.dtype(dtype).str,
+        'enter_point': hnsw._enter_point,
+        # entry_points can't be saved: loaders must be given it again
+        'entry_points': hnsw.entry_points is not None,
+    }
+
+
+def save_hnsw(hnsw, path):
+    """Save an HNSW, including its data, to path."""
+
+    arrays = {}
+    meta = _hnsw_meta(hnsw)
+    meta['kind'] = 'HNSW'
+    meta['data_format'] = _encode_data(hnsw.data, arrays)
+    meta['nlevels'] = _encode_graphs(hnsw, arrays)
+    write_snapshot(path, meta, arrays)
+
+
+def _check_entry_points(path, meta, entry_points):
+    if meta['entry_points'] and entry_points is None:
+        raise ValueError("{} was saved with entry_points: they must be "
+                         "passed to the loader".format(path))
+
+
+def load_hnsw(path, d, cls=None, entry_points=None):
+    """Load an HNSW saved by save_hnsw; d is the dissimilarity function
+    and entry_points the one the HNSW was built with, if any."""
+
+    if cls is None:
+        from .hnsw import HNSW as cls
+    meta, arrays = read_snapshot(path)
+    if meta['kind'] != 'HNSW':
+        raise ValueError("{} contains a {} snapshot"
+                         .format(path, meta['kind']))
+    _check_entry_points(path, meta, entry_points)
+    hnsw = cls(d, meta['m'], meta['ef'], meta['m0'], meta['level_mult'],
+               meta['heuristic'], meta['vectorized'], meta['compact'],
+               meta['compact_dtype'], entry_points)
+    hnsw.data.extend(_decode_data(meta['data_format'], arrays))
+    hnsw._graphs = _decode_graphs(hnsw, meta['nlevels'], arrays)
+    hnsw._enter_point = meta['enter_point']
+    return hnsw
+
+
+def save_fishdbc(fishdbc, path):
+    """Save a FISHDBC, including its data, to path.
+
+    The MST is saved as it is, so pending edges in fishdbc._new_edges are
+    saved as well rather than merged."""
+
+    hnsw = fishdbc._hnsw
+    arrays = {}
+    meta = _hnsw_meta(hnsw)
+    meta['kind'] = 'FISHDBC'
+    meta['min_samples'] = fishdbc.min_samples
+    meta['balanced_add'] = fishdbc._balanced_add
+    meta['cache_hits'] = fishdbc.cache_hits
+    meta['cache_misses'] = fishdbc.cache_misses
+    meta['data_format'] = _encode_data(fishdbc.data, arrays)
+    meta['nlevels'] = _encode_graphs(hnsw, arrays)
+
+    # heaps are stored in CSR format; the (-inf, -inf) placeholders
+    # are stored with a -1 index
+    heaps = fishdbc._neighbor_heaps
+    heap_indptr = np.zeros(len(heaps) + 1, dtype=np.int64)
+    np.cumsum([len(h) for h in heaps], out=heap_indptr[1:])
+    arrays['heap_indptr'] = heap_indptr
+    arrays['heap_dists'] = np.fromiter(
+        (md for h in heaps for md, _ in h),
+        dtype=np.float64, count=heap_indptr[-1])
+    arrays['heap_ids'] = np.fromiter(
+        (-1 if j == -np.inf else j for h in heaps for _, j in h),
+        dtype=np.int64, count=heap_indptr[-1])
+
+    meta['collapse_duplicates'] = fishdbc._weights is not None
+    if fishdbc._weights is not None:
+        arrays['weights'] = np.array(fishdbc._weights, dtype=np.int64)
+        arrays['row_nodes'] = np.frombuffer(fishdbc.row_nodes,
+                                            dtype=np.int64)
+
+    mst = fishdbc._mst_edges
+    arrays['mst_nodes'] = np.array([(i, j) for _, i, j, _ in mst],
+                                   dtype=np.int64).reshape(-1, 2)
+    arrays['mst_dists'] = np.array([(rd, dist) for rd, _, _, dist in mst],
+                                   dtype=np.float64).reshape(-1, 2)
+
+    new_edges = fishdbc._new_edges
+    arrays['new_edges_nodes'] = np.array(list(new_edges.keys()),
+                                         dtype=np.int64).reshape(-1, 2)
+    arrays['new_edges_dists'] = np.array(list(new_edges.values()),
+                                         dtype=np.float64)
+    write_snapshot(path, meta, arrays)
+
+
+def load_fishdbc(path, d, cls=None, entry_points=None):
+    """Load a FISHDBC saved by save_fishdbc; d is the dissimilarity
+    function and entry_points the one the FISHDBC was built with, if
+    any."""
+
+    if cls is None:
+        from .fishdbc import FISHDBC as cls
+    meta, arrays = read_snapshot(path)
+    if meta['kind'] != 'FISHDBC':
+        raise ValueError("{} contains a {} snapshot"
+                         .format(path, meta['kind']))
+    _check_entry_points(path, meta, entry_points)
+    collapse_duplicates = meta['collapse_duplicates']
+    fishdbc = cls(d, meta['min_samples'], meta['m'], meta['ef'], meta['m0'],
+                  meta['level_mult'], meta['heuristic'], meta['balanced_add'],
+                  meta['vectorized'], meta['compact'], meta['compact_dtype'],
+                  collapse_duplicates, entry_points)
+    fishdbc.cache_hits = meta['cache_hits']
+    fishdbc.cache_misses = meta['cache_misses']
+
+    # the distance functions refer to fishdbc.data, so we fill it in place
+    data = _decode_data(meta['data_format'], arrays)
+    fishdbc.data.extend(data)
+    hnsw = fishdbc._hnsw
+    hnsw.data.extend(range(len(data)))
+    hnsw._graphs = _decode_graphs(hnsw, meta['nlevels'], arrays)
+    hnsw._enter_point = meta['enter_point']
+
+    minus_infty = -np.inf
+    heap_indptr = arrays['heap_indptr'].tolist()
+    heap_dists = arrays['heap_dists'].tolist()
+    heap_ids = arrays['heap_ids'].tolist()
+    fishdbc._neighbor_heaps.extend(
+        [(md, minus_infty if j < 0 else j)
+         for md, j in zip(heap_dists[a:b], heap_ids[a:b])]
+        for a, b in zip(heap_indptr, heap_indptr[1:]))
+
+    if collapse_duplicates:
+        fishdbc._weights.extend(arrays['weights'].tolist())
+        fishdbc._node_index.update((x, i) for i, x in enumerate(data))
+        fishdbc.row_nodes.frombytes(arrays['row_nodes'].tobytes())
+        in_heaps = fishdbc._in_heaps
+        in_heaps.extend(set() for _ in data)
+        for i, h in enumerate(fishdbc._neighbor_heaps):
+            for _, j in h:
+                if j != i and j != minus_infty:
+                    in_heaps[j].add(i)
+
+    fishdbc._mst_edges = [
+        (rd, i, j, dist) for (i, j), (rd, dist)
+        in zip(arrays['mst_nodes'].tolist(), arrays['mst_dists'].tolist())]
+    fishdbc._new_edges.update(
+        ((i, j), dist) for (i, j), dist
+        in zip(arrays['new_edges_nodes'].tolist(),
+               arrays['new_edges_dists'].tolist()))
+    return fishdbc
@@ -1,9 +1,112 @@
-def __bootstrap__():
-    global __bootstrap__, __loader__, __file__
-    import sys, pkg_resources, importlib.util
-    __file__ = pkg_resources.resource_filename(__name__, 'unionfind.cpython-310-x86_64-linux-gnu.so')
-    __loader__ = None; del __bootstrap__, __loader__
-    spec = importlib.util.spec_from_file_location(__name__,__file__)
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-__bootstrap__()
+# Copyright (c) 2017-2018 Symantec Corporation. All Rights Reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""Loader of the compiled unionfind extension.
+
+The import system loads unionfind.<suffix> directly when it was built
+for the running interpreter (python setup.py build_ext --inplace), so
+this module only runs when no such build is found. It then looks for
+one under every extension suffix the interpreter accepts, and falls back
+on a pure Python UnionFind with the same interface."""
+
+import importlib.machinery
+import importlib.util
+import os
+import warnings
+
+
+def _load_extension():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        path = os.path.join(directory, 'unionfind' + suffix)
+        if not os.path.exists(path):
+            continue
+        loader = importlib.machinery.ExtensionFileLoader(__name__, path)
+        spec = importlib.util.spec_from_file_location(__name__, path,
+                                                      loader=loader)
+        try:
+            module = importlib.util.module_from_spec(spec)
+            loader.exec_module(module)
+        except ImportError:
+            continue  # e.g. built for a different interpreter
+        return module
+    return None
+
+
+class _UnionFind(object):
+    """Union-find algorithm, with link-by-rank and path compression.
+
+    Pure Python version of unionfind.pyx.
+    """
+
+    def __init__(self, n):
+        """n is the number of elements."""
+
+        self.parents = list(range(n))
+        self.ranks = [0] * n
+
+    def find_root(self, x):
+        """Return a representative for x's set."""
+
+        parents = self.parents
+        i = x
+        while parents[i] != i:
+            parents[x] = i = parents[i]
+        return i
+
+    def union(self, x, y):
+        """Returns True if x and y were not in the same set."""
+
+        root_x = self.find_root(x)
+        root_y = self.find_root(y)
+
+        if root_x == root_y:
+            return False
+
+        ranks = self.ranks
+        rank_x, rank_y = ranks[root_x], ranks[root_y]
+        if rank_x <= rank_y:
+            if rank_x == rank_y:
+                ranks[root_x] = rank_y + 1
+            self.parents[root_x] = root_y
+        else:
+            self.parents[root_y] = root_x
+        return True
+
+
+_extension = _load_extension()
+if _extension is not None:
+    UnionFind = _extension.UnionFind
+else:
+    warnings.warn("the unionfind extension is not built for this "
+                  "interpreter, using a slower pure Python version; run "
+                  "'python setup.py build_ext --inplace' to build it",
+                  RuntimeWarning)
+    UnionFind = _UnionFind
@@ -37,8 +37,9 @@ cdef class UnionFind:
     See https://en.wikipedia.org/wiki/Disjoint-set_data_structure.
     """
 
-    cdef np.ndarray parents
-    cdef np.ndarray ranks
+    # typed memoryviews: indexing untyped ndarrays goes through Python
+    cdef np.intp_t[:] parents
+    cdef np.intp_t[:] ranks
 
     def __init__(self, n):
         """n is the number of elements."""
@@ -57,11 +58,12 @@ cdef class UnionFind:
 
         return self._find_root(x)
 
-    def union(self, x, y):
+    def union(self, np.intp_t x, np.intp_t y):
         "Returns True if x and y were not in the same set."""
 
         cdef np.intp_t root_x = self._find_root(x)
         cdef np.intp_t root_y = self._find_root(y)
+        cdef np.intp_t rank_x, rank_y
 
         if root_x == root_y:
             return False
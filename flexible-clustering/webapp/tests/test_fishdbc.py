@@ -0,0 +1,174 @@
+"""FISHDBC: incremental MST updates and duplicate collapsing."""
+
+import random
+
+import numpy as np
+import pytest
+
+from fish import fishdbc
+from fish.fishdbc import FISHDBC
+
+
+def distance(x, y):
+    return abs(x - y)
+
+
+def points(n, seed=0):
+    # integers in a few dense groups: many tied and zero distances
+    rng = random.Random(seed)
+    return [rng.choice((0, 40, 100)) + rng.randrange(15) for _ in range(n)]
+
+
+def add(model, elem, seed):
+    # HNSW levels are random: seeding each insert makes models agree
+    random.seed(seed)
+    return model.add(elem)
+
+
+def run_batches(batches, **kwargs):
+    """Feed the same batches to two models, updating one
+    incrementally and the other with update_mst(full=True); returns
+    the models and the paths taken by the incremental updates."""
+
+    incremental = FISHDBC(distance, **kwargs)
+    full = FISHDBC(distance, **kwargs)
+    paths = set()
+    seed = 0
+    for batch in batches:
+        for elem in batch:
+            add(incremental, elem, seed)
+            add(full, elem, seed)
+            seed += 1
+        incremental.update_mst()
+        full.update_mst(full=True)
+        paths.add(incremental._mst_forest is not None)
+        assert incremental._mst_edges == full._mst_edges
+    return incremental, full, paths
+
+
+def mixed_batches(n=2000, seed=0):
+    # an insert brings about 100 candidate edges: past 1500 nodes,
+    # single inserts are below MST_REPLACE_RATIO and batches above it
+    data = points(n, seed)
+    sizes = [1500, 1, 2, 1, 200, 1, 1, 3, 100, 1, 2, 1]
+    batches, start = [], 0
+    for size in sizes:
+        batches.append(data[start:start + size])
+        start += size
+    batches.append(data[start:])
+    return batches
+
+
+def test_mixed_batches_match_full_rebuild():
+    incremental, full, paths = run_batches(mixed_batches())
+    # both the in-place and the merge paths ran
+    assert paths == {True, False}
+    labels, *_ = incremental.cluster()
+    expected, *_ = full.cluster()
+    np.testing.assert_array_equal(labels, expected)
+
+
+@pytest.mark.parametrize('ratio', [0, 1, fishdbc.MST_REPLACE_RATIO, 10 ** 9])
+def test_replace_ratio(monkeypatch, ratio):
+    monkeypatch.setattr(fishdbc, 'MST_REPLACE_RATIO', ratio)
+    incremental, full, paths = run_batches(mixed_batches(seed=1))
+    if ratio == 0:
+        assert paths == {True}
+    elif ratio == 10 ** 9:
+        assert paths == {False}
+    labels, *_ = incremental.cluster()
+    expected, *_ = full.cluster()
+    np.testing.assert_array_equal(labels, expected)
+
+
+@pytest.mark.parametrize('ratio', [0, 10 ** 9])
+def test_tied_distances(monkeypatch, ratio):
+    # every distance is 0 or 1, so most edges tie
+    monkeypatch.setattr(fishdbc, 'MST_REPLACE_RATIO', ratio)
+    data = [i % 2 for i in range(300)]
+    batches = [data[:100]] + [[x] for x in data[100:150]] + [data[150:]]
+    incremental, full, _ = run_batches(batches, min_samples=3)
+    assert len(incremental._mst_edges) == len(data) - 1
+    labels, *_ = incremental.cluster()
+    expected, *_ = full.cluster()
+    np.testing.assert_array_equal(labels, expected)
+
+
+def weighted_core_distances(model):
+    """Core distances of the nodes of a collapse_duplicates model,
+    computed by brute force on the rows they stand for."""
+
+    data, weights, k = model.data, model._weights, model.min_samples
+    core = []
+    for i, x in enumerate(data):
+        dists = [0.0] * (weights[i] - 1)
+        for j, y in enumerate(data):
+            if j != i:
+                dists.extend([distance(x, y)] * weights[j])
+        dists.sort()
+        core.append(dists[k - 1] if len(dists) >= k else np.inf)
+    return core
+
+
+def same_partition(labels, expected):
+    # equal up to a renaming of the clusters
+    pairs = set(zip(labels, expected))
+    return (len(pairs) == len(set(labels)) == len(set(expected))
+            and all((a == -1) == (b == -1) for a, b in pairs))
+
+
+def duplicated_rows(n=400, seed=0):
+    # few distinct values in three groups, each repeated many times
+    rng = random.Random(seed)
+    return [rng.choice((0, 100, 250)) + rng.randrange(20) for _ in range(n)]
+
+
+def test_collapsed_core_distances():
+    model = FISHDBC(distance, collapse_duplicates=True)
+    rows = duplicated_rows()
+    for seed, x in enumerate(rows[:300]):
+        add(model, x, seed)
+    # a weighted duplicate lowers the core distances of its node and of
+    # the nodes that have it as a neighbor
+    model.add(rows[0], weight=4)
+    for seed, x in enumerate(rows[300:], 300):
+        add(model, x, seed)
+    core = [-h[0][0] for h in model._neighbor_heaps]
+    assert core == weighted_core_distances(model)
+    assert sum(model._weights) == len(model.row_nodes) == len(rows) + 4
+
+
+def test_collapsed_labels_match_uncollapsed():
+    # small enough for the uncollapsed HNSW to find every neighbor
+    # among the duplicates
+    rows = duplicated_rows(150, seed=1)
+    collapsed = FISHDBC(distance, collapse_duplicates=True)
+    plain = FISHDBC(distance)
+    for seed, x in enumerate(rows):
+        add(collapsed, x, seed)
+        add(plain, x, seed)
+    assert len(collapsed) < len(rows) // 2
+    labels, *_, mst = collapsed.cluster()
+    expected, *_, expected_mst = plain.cluster()
+    assert len(labels) == len(rows)
+    assert mst[:, 2].sum() == pytest.approx(expected_mst[:, 2].sum())
+    assert same_partition(labels, expected)
+
+
+def test_row_nodes_after_later_adds():
+    model = FISHDBC(distance, collapse_duplicates=True)
+    rows = duplicated_rows(200, seed=2)
+    for seed, x in enumerate(rows[:150]):
+        assert add(model, x, seed) == model.row_nodes[-1]
+    labels, *_ = model.cluster()
+    assert len(labels) == 150
+    # new elements and duplicates of old ones, some weighted
+    for seed, x in enumerate(rows[150:], 150):
+        add(model, x, seed)
+    model.add(rows[3], weight=3)
+    model.add(1000, weight=2)
+    rows += [rows[3]] * 3 + [1000] * 2
+    assert [model.data[i] for i in model.row_nodes] == rows
+    assert sum(model._weights) == len(rows)
+    labels, *_ = model.cluster()
+    assert len(labels) == len(rows)
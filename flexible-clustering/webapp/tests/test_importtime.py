@@ -0,0 +1,31 @@
+"""
+Import time of the webapp modules; see `python -m clustering.benchmarks importtime`.
+
+The time budget depends on the machine, so it only runs when IMPORTTIME_BUDGET is set to
+a number of seconds, e.g. `IMPORTTIME_BUDGET=0.5 python -m pytest tests`.
+"""
+
+import os
+
+import pytest
+
+from clustering.benchmarks import LAZY_MODULES, import_times
+
+WEBAPP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET = os.environ.get("IMPORTTIME_BUDGET")
+
+
+def test_clustering_algorithms_imports_lazily(monkeypatch):
+    monkeypatch.chdir(WEBAPP_DIR)
+    imports = import_times("clustering.clustering_algorithms")
+    assert "clustering.clustering_algorithms" in imports
+    assert [name for name in LAZY_MODULES if name in imports] == []
+
+
+@pytest.mark.skipif(BUDGET is None, reason="set IMPORTTIME_BUDGET to check import times")
+@pytest.mark.parametrize("module", ["clustering.clustering_algorithms", "fish"])
+def test_importtime_budget(monkeypatch, module):
+    monkeypatch.chdir(WEBAPP_DIR)
+    imports = import_times(module)
+    slowest = sorted(imports.items(), key=lambda item: -item[1])[:10]
+    assert imports[module] <= float(BUDGET), slowest
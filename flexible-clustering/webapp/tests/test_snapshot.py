@@ -0,0 +1,145 @@
+"""Snapshot files: round trips and unreadable files."""
+
+import random
+import struct
+
+import numpy as np
+import pytest
+
+from fish import snapshot
+from fish.fishdbc import FISHDBC
+from fish.hnsw import HNSW
+
+
+def distance(x, y):
+    return abs(x - y)
+
+
+def points(n, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice((0, 40, 100)) + rng.random() * 15 for _ in range(n)]
+
+
+def add_all(models, elems, seed):
+    # HNSW levels are random: seeding each insert makes models agree
+    for elem in elems:
+        for model in models:
+            random.seed(seed)
+            model.add(elem)
+        seed += 1
+    return seed
+
+
+def assert_same_fishdbc(loaded, model):
+    labels, *_ = loaded.cluster()
+    expected, *_ = model.cluster()
+    np.testing.assert_array_equal(labels, expected)
+    assert loaded._mst_edges == model._mst_edges
+    assert loaded._neighbor_heaps == model._neighbor_heaps
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'compact': True},
+    {'collapse_duplicates': True},
+])
+def test_fishdbc_round_trip(tmp_path, kwargs):
+    path = str(tmp_path / 'model.fishdbc')
+    model = FISHDBC(distance, **kwargs)
+    data = points(400)
+    if kwargs.get('collapse_duplicates'):
+        data = [round(x) for x in data]
+    seed = add_all([model], data[:300], 0)
+    model.update_mst()
+    # pending edges are saved too
+    add_all([model], data[300:320], seed)
+    model.save(path)
+
+    loaded = FISHDBC.load(path, distance)
+    assert loaded.data == model.data
+    assert_same_fishdbc(loaded, model)
+
+    # both keep growing the same way
+    add_all([model, loaded], data[320:], seed + 20)
+    assert_same_fishdbc(loaded, model)
+    if kwargs.get('collapse_duplicates'):
+        assert loaded.row_nodes == model.row_nodes
+
+
+def test_hnsw_round_trip(tmp_path):
+    path = str(tmp_path / 'index.hnsw')
+    data = points(300, seed=1)
+    hnsw = HNSW(distance)
+    add_all([hnsw], data, 0)
+    hnsw.save(path)
+    loaded = HNSW.load(path, distance)
+    assert loaded.data == hnsw.data
+    for q in (3.5, 50, 110):
+        assert loaded.search(q, 5) == hnsw.search(q, 5)
+
+
+def test_entry_points(tmp_path):
+    path = str(tmp_path / 'index.hnsw')
+    data = points(100, seed=2)
+
+    def entry_points(elem):
+        return [0]
+
+    hnsw = HNSW(distance, entry_points=entry_points)
+    add_all([hnsw], data, 0)
+    hnsw.save(path)
+    with pytest.raises(ValueError, match='entry_points'):
+        HNSW.load(path, distance)
+    loaded = HNSW.load(path, distance, entry_points=entry_points)
+    assert loaded.entry_points is entry_points
+    assert loaded.search(50, 5) == hnsw.search(50, 5)
+
+    model = FISHDBC(distance, entry_points=entry_points)
+    add_all([model], data, 0)
+    model.save(path)
+    with pytest.raises(ValueError, match='entry_points'):
+        FISHDBC.load(path, distance)
+    loaded = FISHDBC.load(path, distance, entry_points=entry_points)
+    assert loaded._hnsw.entry_points is entry_points
+
+
+@pytest.fixture
+def saved(tmp_path):
+    path = str(tmp_path / 'model.fishdbc')
+    model = FISHDBC(distance)
+    add_all([model], points(100), 0)
+    model.save(path)
+    with open(path, 'rb') as f:
+        return path, f.read()
+
+
+@pytest.mark.parametrize('size', [0, 10, 100, -1])
+def test_truncated(saved, size):
+    path, content = saved
+    with open(path, 'wb') as f:
+        f.write(content[:size])
+    with pytest.raises(ValueError, match='truncated'):
+        FISHDBC.load(path, distance)
+
+
+def test_bad_magic(saved):
+    path, content = saved
+    with open(path, 'wb') as f:
+        f.write(b'NOTSNAPS' + content[8:])
+    with pytest.raises(ValueError, match='not a snapshot'):
+        FISHDBC.load(path, distance)
+
+
+def test_wrong_version(saved):
+    path, content = saved
+    with open(path, 'wb') as f:
+        f.write(content[:8] + struct.pack('<I', snapshot.VERSION + 1)
+                + content[12:])
+    with pytest.raises(ValueError, match='unsupported snapshot version'):
+        FISHDBC.load(path, distance)
+
+
+def test_wrong_kind(saved):
+    path, _ = saved
+    with pytest.raises(ValueError, match='FISHDBC snapshot'):
+        HNSW.load(path, distance)
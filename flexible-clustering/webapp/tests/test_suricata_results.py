@@ -0,0 +1,95 @@
+"""
+Suricata results on a small hand-built cluster tree.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from clustering import clustering_algorithms
+from clustering.config import kiburl
+from clustering.load_data import CommandResources
+
+SURICATA_PURPOSES = {"SIG A": "Recon", "SIG B": "Exploit"}
+
+# points 0-4; cluster 5 is the root, with children 6 = {0, 1} and 7 = {2, 3, 4}
+TREE = [(5, 6, 0.1, 2), (5, 7, 0.1, 3), (6, 0, 0.5, 1), (6, 1, 0.5, 1),
+        (7, 2, 0.4, 1), (7, 3, 0.4, 1), (7, 4, 0.4, 1)]
+
+
+def link(i):
+    return f"{kiburl}logstash-{i}/_source?id=doc{i}"
+
+
+def alerts():
+    df = pd.DataFrame({
+        "_id": [f"doc{i}" for i in range(5)],
+        "_index": [f"logstash-{i}" for i in range(5)],
+        "@timestamp": ["2025-01-0%d" % d for d in (3, 1, 2, 5, 4)],
+        "purpose": ["Recon", "Unknown", "Recon", "Exploit", None],
+        "src_ip": ["10.0.0.1", "10.0.0.2", "10.0.0.2", "10.0.0.3", "10.0.0.3"],
+    })
+    commands = pd.Series(["SIG A", "SIG B", "SIG A", "SIG C", "SIG C"])
+    return df, commands
+
+
+@pytest.fixture(autouse=True)
+def purposes(monkeypatch):
+    resources = CommandResources(set(), None, {}, SURICATA_PURPOSES)
+    monkeypatch.setattr(clustering_algorithms, "get_resources", lambda: resources)
+
+
+def structured(tree):
+    dtype = [("parent", np.intp), ("child", np.intp), ("lambda_val", float), ("child_size", np.intp)]
+    return np.array(tree, dtype=dtype)
+
+
+@pytest.mark.parametrize("tree", [TREE, structured(TREE)], ids=["tuples", "structured"])
+def test_purposes(tree):
+    df, commands = alerts()
+    results = clustering_algorithms.build_suricata_results(df, commands, tree)
+    assert results == [
+        {
+            "id": 5,
+            "parent": "ROOT",
+            # member purposes, "Unknown" and missing ones left out
+            "purpose": "Exploit + Recon",
+            "size": 5,
+            "unique": 3,
+            # signatures grouped by their own purpose, unknown signatures under "Unknown"
+            "grouped_commands": {
+                "Exploit": [("SIG B", 1, link(1), 1, "2025-01-01", "2025-01-01")],
+                "Recon": [("SIG A", 2, link(0), 2, "2025-01-02", "2025-01-03")],
+                "Unknown": [("SIG C", 2, link(3), 1, "2025-01-04", "2025-01-05")],
+            },
+        },
+        {
+            "id": 6,
+            "parent": "5",
+            "purpose": "Recon",
+            "size": 2,
+            "unique": 2,
+            "grouped_commands": {
+                "Exploit": [("SIG B", 1, link(1), 1, "2025-01-01", "2025-01-01")],
+                "Recon": [("SIG A", 1, link(0), 1, "2025-01-03", "2025-01-03")],
+            },
+        },
+        {
+            "id": 7,
+            "parent": "5",
+            "purpose": "Exploit + Recon",
+            "size": 3,
+            "unique": 2,
+            "grouped_commands": {
+                "Recon": [("SIG A", 1, link(2), 1, "2025-01-02", "2025-01-02")],
+                "Unknown": [("SIG C", 2, link(3), 1, "2025-01-04", "2025-01-05")],
+            },
+        },
+    ]
+
+
+def test_unknown_purposes():
+    df, commands = alerts()
+    df["purpose"] = ["Unknown", None, "", "Unknown", "Unknown"]
+    results = clustering_algorithms.build_suricata_results(df, commands, TREE)
+    assert [r["purpose"] for r in results] == ["Unknown"] * 3